@@ -21,8 +21,8 @@ from collections import Counter
 
 import numpy as np
 
-from scipy.ndimage import measurements
-from scipy.sparse import dok_matrix
+from scipy.ndimage import measurements, generate_binary_structure
+from scipy.sparse import dok_matrix, csr_matrix
 
 from mvpa2.mappers.base import IdentityMapper, _verified_reverse1
 from mvpa2.datasets import Dataset
@@ -198,10 +198,13 @@ class GroupClusterThreshold(Learner):
     n_blocks = Parameter(
         1, constraints=EnsureInt() & EnsureRange(min=1),
         doc="""Number of segments used to compute the feature-wise NULL
-            distributions. This parameter determines the peak memory demand.
-            In case of a single segment a matrix of size
-            (n_bootstrap x nfeatures) will be allocated. Increasing the number
-            of segments reduces the peak memory demand by that roughly factor.
+            distributions. Bootstrap maps of a segment are computed in
+            batches (see ``batch_size``) and only the largest values needed
+            for the threshold are kept, hence in case of a single segment
+            matrices of size
+            ((batch_size + n_bootstrap * feature_thresh_prob) x nfeatures)
+            will be allocated. Increasing the number of segments reduces the
+            peak memory demand by that roughly factor.
             """)
 
     n_proc = Parameter(
@@ -209,6 +212,14 @@ class GroupClusterThreshold(Learner):
         doc="""Number of parallel processes to use for computation.
             Requires `joblib` external module.""")
 
+    batch_size = Parameter(
+        100, constraints=EnsureInt() & EnsureRange(min=1),
+        doc="""Number of bootstrap maps that are computed at once when
+            estimating feature-wise thresholds, and that are thresholded and
+            labeled together when estimating the NULL distribution of cluster
+            sizes. Larger batches are faster, but require memory for that
+            many maps in the original (reverse-mapped) space.""")
+
     def __init__(self, **kwargs):
         # force disable auto-train: would make no sense
         Learner.__init__(self, auto_train=False, **kwargs)
@@ -242,6 +253,13 @@ class GroupClusterThreshold(Learner):
         bcombos = [[random.sample(v, 1)[0] for v in chunk_samples.values()]
                    for i in xrange(self.params.n_bootstrap)]
         bcombos = np.array(bcombos, dtype=int)
+        # bootstrap averages are computed as a product of this sparse
+        # (n_bootstrap x nsamples) combination-indicator matrix with the data
+        nchunks = bcombos.shape[1]
+        bmat = csr_matrix((np.ones(bcombos.size) / nchunks,
+                           bcombos.ravel(),
+                           np.arange(0, bcombos.size + 1, nchunks)),
+                          shape=(len(bcombos), len(ds)))
         #
         # Step 1: find the per-feature threshold that corresponds to some p
         # in the NULL
@@ -257,20 +275,16 @@ class GroupClusterThreshold(Learner):
 
         def featuresegment_producer(ncols):
             for segstart in xrange(0, ds.nfeatures, ncols):
-                # one average map for every stored bcombo
-                # this also slices the input data into feature subsets
+                # this slices the input data into feature subsets
                 # for the compute blocks
-                yield [np.mean(
-                       # get a view to a subset of the features
-                       # -- should be somewhat efficient as feature axis is
-                       # sliced
-                       ds_samples[sidx, segstart:segstart + ncols],
-                       axis=0)
-                       for sidx in bcombos]
+                # -- should be somewhat efficient as feature axis is sliced
+                yield ds_samples[:, segstart:segstart + ncols]
         if self.params.n_proc == 1:
             # Serial execution
             thrmap = np.hstack(  # merge across compute blocks
-                [get_thresholding_map(d, self.params.feature_thresh_prob)
+                [_get_bootstrap_thresholding_map(
+                    bmat, d, self.params.feature_thresh_prob,
+                    self.params.batch_size)
                  # compute a partial threshold map for as many features
                  # as fit into a compute block
                  for d in featuresegment_producer(segwidth)])
@@ -285,8 +299,9 @@ class GroupClusterThreshold(Learner):
                 Parallel(n_jobs=self.params.n_proc,
                          pre_dispatch=self.params.n_proc,
                          verbose=verbose_level_parallel)(
-                             delayed(get_thresholding_map)
-                        (d, self.params.feature_thresh_prob)
+                             delayed(_get_bootstrap_thresholding_map)
+                        (bmat, d, self.params.feature_thresh_prob,
+                         self.params.batch_size)
                              for d in featuresegment_producer(segwidth)))
         # store for later thresholding of input data
         self._thrmap = thrmap
@@ -300,17 +315,17 @@ class GroupClusterThreshold(Learner):
         dsa = dict(mapper=ds.a.mapper) if 'mapper' in ds.a else {}
         if __debug__:
             debug('GCTHR', 'Estimating NULL distribution of cluster sizes')
+        # maps are thresholded and labeled in batches of bootstrap samples
+        def batch_producer(nrows):
+            for bstart in xrange(0, len(bcombos), nrows):
+                avgmaps = bmat[bstart:bstart + nrows].dot(ds_samples)
+                # apply threshold and wrap into a throw-away dataset to get
+                # the reverse mapping right
+                yield Dataset(avgmaps > thrmap, a=dsa)
         # this step can be computed in parallel chunks to speeds things up
         if self.params.n_proc == 1:
             # Serial execution
-            for sidx in bcombos:
-                avgmap = np.mean(ds_samples[sidx], axis=0)[None]
-                # apply threshold
-                clustermap = avgmap > thrmap
-                # wrap into a throw-away dataset to get the reverse mapping right
-                bds = Dataset(clustermap, a=dsa)
-                # this function reverse-maps every sample one-by-one, hence no need
-                # to collect chunks of bootstrapped maps
+            for bds in batch_producer(self.params.batch_size):
                 cluster_sizes = get_cluster_sizes(bds, cluster_sizes)
         else:
             # Parallel execution
@@ -318,11 +333,9 @@ class GroupClusterThreshold(Learner):
             for jobres in Parallel(n_jobs=self.params.n_proc,
                                    pre_dispatch=self.params.n_proc,
                                    verbose=verbose_level_parallel)(
-                                       delayed(get_cluster_sizes)
-                                  (Dataset(np.mean(ds_samples[sidx],
-                                           axis=0)[None] > thrmap,
-                                           a=dsa))
-                                       for sidx in bcombos):
+                                       delayed(get_cluster_sizes)(bds)
+                                       for bds in batch_producer(
+                                           self.params.batch_size)):
                 # aggregate
                 cluster_sizes += jobres
         # store cluster size histogram for later p-value evaluation
@@ -437,7 +450,7 @@ class GroupClusterThreshold(Learner):
         return outds
 
 
-def get_thresholding_map(data, p=0.001):
+def get_thresholding_map(data, p=0.001, nsamples=None):
     """Return array of thresholds corresponding to a probability of such value in the input
 
     Thresholds are returned as an array with one value per column in the input
@@ -445,21 +458,61 @@ def get_thresholding_map(data, p=0.001):
 
     Parameters
     ----------
-    data : 2D-array
+    data : 2D-array or iterable of 2D-arrays
       Array with data on which the cumulative distribution is based.
-      Values in each column are sorted and the value corresponding to the
-      desired probability is returned.
+      The value corresponding to the desired probability in each column is
+      returned.  If `nsamples` is given, this is an iterable (e.g. a
+      generator) yielding blocks of rows of such array instead.  Only the
+      values exceeding the threshold are kept while the blocks are consumed,
+      so the whole array never has to be in memory.
     p : float [0,1]
       Value greater or equal than the returned threshold have a probability `p` or less.
+    nsamples : int, optional
+      Total number of rows in all blocks yielded by `data`.
     """
-    # we need NumPy indexing logic, even if a dataset comes in
-    data = np.asanyarray(data)
-    p_index = int(len(data) * p)
+    if nsamples is None:
+        # we need NumPy indexing logic, even if a dataset comes in
+        data = np.asanyarray(data)
+        nsamples = len(data)
+        data = [data]
+    p_index = int(nsamples * p)
     if p_index < 1:
         raise ValueError("requested probability is too low for the given number of samples")
-    # threshold indices are all in one row of the argsorted inputs
-    thridx = np.argsort(data, axis=0, kind='quicksort')[-p_index]
-    return data[thridx, np.arange(data.shape[1])]
+    # the p_index largest values per column seen so far
+    top = None
+    for block in data:
+        block = np.asanyarray(block)
+        if top is not None:
+            block = np.vstack((top, block))
+        if len(block) > p_index:
+            # only partial ordering is needed
+            block = np.partition(block, len(block) - p_index, axis=0)[-p_index:]
+        top = block
+    # threshold is the smallest of the largest values
+    return top.min(axis=0)
+
+
+def _get_bootstrap_thresholding_map(bmat, samples, p, batch_size):
+    """Thresholds for bootstrap average maps computed block by block
+
+    Parameters
+    ----------
+    bmat : sparse matrix
+      (n_bootstrap x nsamples) weights of samples for each bootstrap map.
+    samples : 2D-array
+      Data to be averaged.
+    p : float [0,1]
+    batch_size : int
+      Minimal number of bootstrap maps to compute at once.
+    """
+    nbootstrap = bmat.shape[0]
+    # blocks no smaller than the number of kept values, so partitioning
+    # is amortized
+    nrows = max(batch_size, int(nbootstrap * p))
+    return get_thresholding_map(
+        (bmat[bstart:bstart + nrows].dot(samples)
+         for bstart in xrange(0, nbootstrap, nrows)),
+        p=p, nsamples=nbootstrap)
 
 
 def _get_map_cluster_sizes(map_):
@@ -477,12 +530,34 @@ def _get_map_cluster_sizes(map_):
         return area.astype(int)
 
 
+def _get_maps_cluster_sizes(maps):
+    """Cluster sizes of all maps stacked along the first axis
+
+    Maps are labeled together, with connectivity limited to within each
+    map.  Like `_get_map_cluster_sizes`, a zero is reported for every map
+    without any cluster.
+    """
+    maps = np.asanyarray(maps)
+    # no connectivity along the stacking axis
+    structure = np.zeros((3,) * maps.ndim, dtype=bool)
+    structure[1] = generate_binary_structure(maps.ndim - 1, 1)
+    labels, num = measurements.label(maps, structure=structure)
+    area = measurements.sum(maps, labels, index=np.arange(1, num + 1))
+    # labels are assigned in the order of the maps, so maps without clusters
+    # do not increase the maximal label seen so far
+    maxlabels = np.maximum.accumulate(labels.reshape(len(maps), -1).max(axis=1))
+    nempty = np.sum(np.diff(np.concatenate(([0], maxlabels))) == 0)
+    return np.concatenate((np.asarray(area, dtype=int),
+                           np.zeros(nempty, dtype=int)))
+
+
 def get_cluster_sizes(ds, cluster_counter=None):
     """Compute cluster sizes from all samples in a boolean dataset.
 
     Individually for each sample, in the input dataset, clusters of non-zero
     values will be determined after reverse-applying any transformation of the
-    dataset's mapper (if any).
+    dataset's mapper (if any).  All samples are reverse-mapped and labeled
+    at once, hence memory demand scales with the number of samples.
 
     Parameters
     ----------
@@ -507,6 +582,14 @@ def get_cluster_sizes(ds, cluster_counter=None):
     if hasattr(ds, 'a') and 'mapper' in ds.a:
         mapper = ds.a.mapper
 
+    if len(data) > 1:
+        # label all samples at once, as long as the mapper maps them
+        # one-to-one
+        odata = mapper.reverse(data)
+        if len(odata) == len(data):
+            cluster_counter.update(_get_maps_cluster_sizes(odata))
+            return cluster_counter
+
     for i in xrange(len(ds)):
         osamp = _verified_reverse1(mapper, data[i])
         m_clusters = _get_map_cluster_sizes(osamp)
@@ -20,6 +20,8 @@ __docformat__ = 'restructuredtext'
 # don't leak the world
 __all__ = ['Hyperalignment']
 
+import os
+import tempfile
 from mvpa2.support.copy import deepcopy
 
 import numpy as np
@@ -33,6 +35,8 @@ from mvpa2.mappers.base import ChainMapper
 from mvpa2.mappers.zscore import zscore, ZScoreMapper
 from mvpa2.mappers.staticprojection import StaticProjectionMapper
 from mvpa2.mappers.svd import SVDMapper
+from mvpa2.base.parallel import SerialExecutor, get_executor, share_array, \
+     release_shared
 
 from mvpa2.support.due import due, Doi
 
@@ -55,6 +59,127 @@ def mean_axis0(a):
     return np.mean(a, axis=0)
 
 
+def _load_dataset(filename):
+    """Load a dataset to be hyperaligned from a file
+
+    Samples stored in .npy files are memory-mapped, .npz files are expected
+    to be stored by `Dataset.to_npz`, directories by `Dataset.to_npy` (and
+    are memory-mapped as well), and anything else is loaded with `h5load`.
+    """
+    if os.path.isdir(filename):
+        return Dataset.from_npy(filename)
+    if filename.endswith('.npy'):
+        return Dataset(np.load(filename, mmap_mode='r'))
+    elif filename.endswith('.npz'):
+        return Dataset.from_npz(filename)
+    from mvpa2.base.hdf5 import h5load
+    return h5load(filename)
+
+
+def _read_npy_shape(f):
+    """Shape of an array from the header of a .npy file object"""
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)[0]
+    return np.lib.format.read_array_header_2_0(f)[0]
+
+
+def _get_nfeatures(source):
+    """Number of features of a dataset to be hyperaligned
+
+    For datasets given as filenames only the header of the stored samples
+    is read, if possible.
+    """
+    if not isinstance(source, basestring):
+        return source.nfeatures
+    if os.path.isdir(source):
+        # samples stored by Dataset.to_npy
+        shape = np.load(os.path.join(source, 'samples.npy'),
+                        mmap_mode='r').shape
+    elif source.endswith('.npy'):
+        shape = np.load(source, mmap_mode='r').shape
+    elif source.endswith('.npz'):
+        import zipfile
+        zf = zipfile.ZipFile(source)
+        try:
+            f = zf.open('samples.npy')
+            try:
+                shape = _read_npy_shape(f)
+            finally:
+                f.close()
+        finally:
+            zf.close()
+    else:
+        from mvpa2.base.hdf5 import _get_stored_samples_shape
+        shape = _get_stored_samples_shape(source)
+        if shape is None:
+            return _load_dataset(source).nfeatures
+    return shape[1] if len(shape) > 1 else 0
+
+
+def _get_regularization_mapper(ds, alpha):
+    U, S, Vh = np.linalg.svd(ds)
+    S = 1/np.sqrt( (1-alpha)*np.square(S) + alpha )
+    S.resize(len(Vh))
+    S = np.matrix(np.diag(S))
+    W = np.matrix(Vh.T)*S*np.matrix(Vh)
+    wmapper = StaticProjectionMapper(proj=W, auto_train=False)
+    wmapper.train(ds)
+    return wmapper
+
+
+def _preprocess(ds, zscore_all=False, alpha=1):
+    """Z-score and regularize a dataset as configured for hyperalignment
+
+    Returns
+    -------
+    Dataset, list
+      Preprocessed dataset and the trained mappers which were applied.
+    """
+    premappers = []
+    if zscore_all:
+        zmapper = ZScoreMapper(chunks_attr=None)
+        zmapper.train(ds)
+        ds = zmapper.forward(ds)
+        premappers.append(zmapper)
+    if alpha < 1:
+        wmapper = _get_regularization_mapper(ds, alpha)
+        ds = wmapper.forward(ds)
+        premappers.append(wmapper)
+    return ds, premappers
+
+
+def _get_dataset(source, zscore_all=False, alpha=1, premappers=None):
+    """Provide a dataset to be hyperaligned
+
+    Datasets given as filenames are loaded and preprocessed (see
+    `_preprocess`), while all others are assumed to be preprocessed
+    already.  If `premappers` of an earlier preprocessing of the same
+    file are given, they are applied instead of training new ones.
+
+    Returns
+    -------
+    Dataset, list
+      Dataset and the mappers applied while preprocessing it.
+    """
+    if not isinstance(source, basestring):
+        return source, []
+    ds = _load_dataset(source)
+    if premappers is None:
+        return _preprocess(ds, zscore_all, alpha)
+    for m in premappers:
+        ds = m.forward(ds)
+    return ds, premappers
+
+
+def _share_for(executor, a):
+    """Place an array into shared memory if workers would need a copy"""
+    if executor.shares_state or isinstance(executor, SerialExecutor):
+        return a, []
+    a = share_array(a)
+    return a, [a]
+
+
 class Hyperalignment(ClassWithCollections):
     """Align the features across multiple datasets into a common feature space.
 
@@ -80,6 +205,14 @@ class Hyperalignment(ClassWithCollections):
     datasets. This dataset list may or may not be identical to the training
     datasets.
 
+    Datasets might also be given as filenames, in which case each one is
+    loaded only when it is needed, so that only a single one has to be kept
+    in memory at a time.  Mappers for z-scoring and regularization are
+    trained when a file is loaded for the first time, and reused whenever it
+    is loaded again.  The projections onto the common space are then kept in
+    a temporary file on disk (see `tmp_prefix`), which allows to hyperalign
+    more datasets than would fit into memory.
+
     The default values for the parameters of the algorithm (e.g. projection via
     Procrustean transformation, common space aggregation by averaging) resemble
     the setup reported in :ref:`Haxby et al., Neuron (2011) <HGC+11>` *A common,
@@ -201,6 +334,24 @@ class Hyperalignment(ClassWithCollections):
             joblib v0.10.3. If it is set to specific value here, then that will
             be used at the risk of failure.""")
 
+    backend = Parameter(None, constraints=EnsureStr() | EnsureNone(),
+            doc="""Parallel backend (see :mod:`mvpa2.base.parallel`) to
+            fit the mappers of the 2nd and the 3rd level with `nproc`
+            workers.  The common space is placed into shared memory, so
+            worker processes do not receive copies of it.  Projections of
+            datasets given as arrays are kept in shared memory (i.e. in RAM)
+            as well, those of datasets given as filenames in a temporary
+            file (see `tmp_prefix`).  If None, only the 3rd level is
+            parallelized using joblib (see `joblib_backend`).""")
+
+    tmp_prefix = Parameter(None, constraints=EnsureStr() | EnsureNone(),
+            doc="""If provided, the projections of the training datasets onto
+            the common space are stored in a temporary memory-mapped file with
+            this prefix (which might include a directory) instead of memory
+            while training.  Datasets given as filenames are always projected
+            into such a file on disk, in the system's temporary directory by
+            default.""")
+
     def __init__(self, **kwargs):
         ClassWithCollections.__init__(self, **kwargs)
         self.commonspace = None
@@ -209,6 +360,8 @@ class Hyperalignment(ClassWithCollections):
         # Moreover, it is similar to commonspace, in that, it is required for mapping
         # new subjects
         self._svd_mapper = None
+        # mappers trained to preprocess datasets given as filenames
+        self._premappers = {}
 
 
     @due.dcite(
@@ -220,7 +373,10 @@ class Hyperalignment(ClassWithCollections):
 
         Parameters
         ----------
-        datasets : sequence of datasets
+        datasets : sequence of datasets or filenames
+          Datasets stored in files (HDF5, .npz as stored by `Dataset.to_npz`,
+          or .npy with the samples which get memory-mapped) are loaded only
+          when needed.
 
         Returns
         -------
@@ -234,7 +390,6 @@ class Hyperalignment(ClassWithCollections):
                             "(of type list, tuple, or ndarray) of datasets.")
 
         ndatasets = len(datasets)
-        nfeatures = [ds.nfeatures for ds in datasets]
         alpha = params.alpha
 
         residuals = None
@@ -250,8 +405,11 @@ class Hyperalignment(ClassWithCollections):
             debug('HPAL', "Hyperalignment %s for %i datasets"
                   % (self, ndatasets))
 
+        # files might have changed since a previous training
+        self._premappers = {}
+
         if params.ref_ds is None:
-            ref_ds = np.argmax(nfeatures)
+            ref_ds = np.argmax([_get_nfeatures(ds) for ds in datasets])
         else:
             ref_ds = params.ref_ds
             # Making sure that ref_ds is within range.
@@ -270,24 +428,20 @@ class Hyperalignment(ClassWithCollections):
         # TODO: handle floats and non-floats differently to prevent
         #       waste of memory if there is no need (e.g. no z-scoring)
         #otargets = [ds.sa.targets for ds in datasets]
-        datasets = [ds.copy(deep=False) for ds in datasets]
         #datasets = [Dataset(ds.samples.astype(float), sa={'targets': [None] * len(ds)})
         #datasets = [Dataset(ds.samples, sa={'targets': [None] * len(ds)})
         #            for ds in datasets]
 
-        if params.zscore_all:
-            if __debug__:
-                debug('HPAL', "Z-scoring all datasets")
-            for ids in xrange(len(datasets)):
-                zmapper = ZScoreMapper(chunks_attr=None)
-                zmapper.train(datasets[ids])
-                datasets[ids] = zmapper.forward(datasets[ids])
-
-        if alpha < 1:
-            datasets, wmappers = self._regularize(datasets, alpha)
+        # datasets given as filenames get preprocessed when first loaded
+        if __debug__ and (params.zscore_all or alpha < 1):
+            debug('HPAL', "Preprocessing all datasets")
+        datasets = [ds if isinstance(ds, basestring)
+                    else _preprocess(ds.copy(deep=False),
+                                     params.zscore_all, alpha)[0]
+                    for ds in datasets]
 
         # initial common space is the reference dataset
-        commonspace = datasets[ref_ds].samples
+        commonspace = self._get_dataset(datasets[ref_ds])[0].samples
         # the reference dataset might have been zscored already, don't do it
         # twice
         if params.zscore_common and not params.zscore_all:
@@ -304,7 +458,7 @@ class Hyperalignment(ClassWithCollections):
         else:
             # create a mapper per dataset
             # might prefer some other way to initialize... later
-            mappers = [deepcopy(params.alignment) for ds in datasets]
+            mappers = [deepcopy(params.alignment) for i in xrange(ndatasets)]
 
             #
             # Level 1 -- initial projection
@@ -315,10 +469,13 @@ class Hyperalignment(ClassWithCollections):
             # Level 2 -- might iterate multiple times
             #
             # this is the final common space
-            self.commonspace = self._level2(datasets, lvl1_projdata, mappers,
-                                            residuals)
+            try:
+                self.commonspace = self._level2(datasets, lvl1_projdata,
+                                                mappers, residuals)
+            finally:
+                release_shared(lvl1_projdata)
         if params.output_dim is not None:
-            mappers = self._level3(datasets)
+            mappers = self._level3(datasets)[0]
             self._svd_mapper = SVDMapper()
             self._svd_mapper.train(self._map_and_mean(datasets, mappers))
             self._svd_mapper = StaticProjectionMapper(
@@ -329,7 +486,8 @@ class Hyperalignment(ClassWithCollections):
 
         Parameters
         ----------
-        datasets : sequence of datasets
+        datasets : sequence of datasets or filenames
+          See `train`.
 
         Returns
         -------
@@ -348,69 +506,97 @@ class Hyperalignment(ClassWithCollections):
         datasets = list(datasets)
 
         params = self.params            # for quicker access ;)
-        alpha = params.alpha             # for letting me be lazy ;)
-        if params.zscore_all:
-            if __debug__:
-                debug('HPAL', "Z-scoring all datasets")
-            # zscore them once while storing corresponding ZScoreMapper's
-            # so we can assemble a comprehensive mapper at the end
-            # (together with procrustes)
-            zmappers = []
-            for ids in xrange(len(datasets)):
-                zmapper = ZScoreMapper(chunks_attr=None)
-                zmappers.append(zmapper)
-                zmapper.train(datasets[ids])
-                datasets[ids] = zmapper.forward(datasets[ids])
-
-        if alpha < 1:
-            datasets, wmappers = self._regularize(datasets, alpha)
+        # preprocess them once while storing the corresponding mappers
+        # so we can assemble a comprehensive mapper at the end
+        # (together with procrustes).  Datasets given as filenames get
+        # preprocessed when loaded in the 3rd level, unless they were
+        # preprocessed while training already.
+        premappers = [[] for ds in datasets]
+        if __debug__ and (params.zscore_all or params.alpha < 1):
+            debug('HPAL', "Preprocessing all datasets")
+        for ids, ds in enumerate(datasets):
+            if not isinstance(ds, basestring):
+                datasets[ids], premappers[ids] = _preprocess(
+                    ds, params.zscore_all, params.alpha)
 
         #
         # Level 3 -- final, from-scratch, alignment to final common space
         #
-        mappers = self._level3(datasets)
+        mappers, lvl3_premappers = self._level3(datasets)
         # return trained mappers for projection from all datasets into the
         # common space
-        if params.zscore_all:
-            # We need to construct new mappers which would chain
-            # zscore and then final transformation
-            if params.alpha < 1:
-                mappers = [ChainMapper([zm, wm, m]) for zm, wm, m in zip(zmappers, wmappers, mappers)]
-            else:
-                mappers = [ChainMapper([zm, m]) for zm, m in zip(zmappers, mappers)]
-        elif params.alpha < 1:
-            mappers = [ChainMapper([wm, m]) for wm, m in zip(wmappers, mappers)]
+        # We need to construct new mappers which would chain
+        # zscore and/or regularization and then final transformation
+        mappers = [ChainMapper(pm + lpm + [m]) if len(pm + lpm) else m
+                   for pm, lpm, m in zip(premappers, lvl3_premappers, mappers)]
         if params.output_dim is not None:
             mappers = [ChainMapper([m, self._svd_mapper]) for m in mappers]
         return mappers
 
 
-    def _regularize(self, datasets, alpha):
-        if __debug__:
-            debug('HPAL', "Using regularized hyperalignment with alpha of %d"
-                    % alpha)
-        wmappers = []
-        for ids in xrange(len(datasets)):
-            U, S, Vh = np.linalg.svd(datasets[ids])
-            S = 1/np.sqrt( (1-alpha)*np.square(S) + alpha )
-            S.resize(len(Vh))
-            S = np.matrix(np.diag(S))
-            W = np.matrix(Vh.T)*S*np.matrix(Vh)
-            wmapper = StaticProjectionMapper(proj=W, auto_train=False)
-            wmapper.train(datasets[ids])
-            wmappers.append(wmapper)
-            datasets[ids] = wmapper.forward(datasets[ids])
-        return datasets, wmappers
+    def _get_dataset(self, source):
+        """Load and preprocess a dataset given as filename
+
+        The mappers trained while first preprocessing a file are kept and
+        applied whenever it is loaded again.
+        """
+        if not isinstance(source, basestring):
+            return source, []
+        ds, premappers = _get_dataset(source, self.params.zscore_all,
+                                      self.params.alpha,
+                                      self._premappers.get(source))
+        self._premappers[source] = premappers
+        return ds, premappers
+
+
+    def _get_premappers(self, source):
+        """Preprocessing mappers kept for a dataset given as filename"""
+        if not isinstance(source, basestring):
+            return None
+        return self._premappers.get(source)
+
+
+    def _get_executor(self):
+        """Executor to fit the mappers of the individual datasets"""
+        params = self.params
+        if params.backend is None:
+            return SerialExecutor()
+        return get_executor(params.backend, nproc=params.nproc)
+
+
+    def _get_mapped_storage(self, datasets, shape):
+        """Container for the projections of all datasets onto common space
+        """
+        params = self.params
+        ndatasets = len(datasets)
+        out_of_core = any(isinstance(ds, basestring) for ds in datasets)
+        if params.tmp_prefix is None and params.backend is None \
+           and not out_of_core:
+            return [None] * ndatasets
+        if params.tmp_prefix is None:
+            prefix = 'tmphpal'
+            # datasets which do not fit into memory will not have
+            # projections which fit into (shared) memory either
+            dir_ = tempfile.gettempdir() if out_of_core else None
+        else:
+            prefix = params.tmp_prefix
+            # on disk instead of (shared) memory
+            dir_ = None if os.path.dirname(prefix) else tempfile.gettempdir()
+        return share_array(shape=(ndatasets,) + tuple(shape), dtype=float,
+                           readonly=False, prefix=prefix, dir=dir_)
 
 
     def _level1(self, datasets, commonspace, ref_ds, mappers, residuals):
         params = self.params            # for quicker access ;)
-        data_mapped = [ds.samples for ds in datasets]
+        data_mapped = self._get_mapped_storage(datasets, commonspace.shape)
         counts = 1  # number of datasets used so far for generating commonspace
-        for i, (m, ds_new) in enumerate(zip(mappers, datasets)):
+        for i, (m, source) in enumerate(zip(mappers, datasets)):
             if __debug__:
                 debug('HPAL_', "Level 1: ds #%i" % i)
+            ds_new = self._get_dataset(source)[0]
             if i == ref_ds:
+                # the reference dataset remains unchanged
+                data_mapped[i] = ds_new.samples
                 continue
             # assign common space to ``space`` of the mapper, because this is
             # where it will be looking for it
@@ -453,7 +639,7 @@ class Hyperalignment(ClassWithCollections):
         data_mapped = lvl1_data
         # aggregate all processed 1st-level datasets into a new 2nd-level
         # common space
-        commonspace = params.combiner2(data_mapped)
+        commonspace = np.asarray(params.combiner2(data_mapped))
 
         # XXX Why is this commented out? Who knows what combiner2 is doing and
         # whether it changes the distribution of the data
@@ -461,40 +647,31 @@ class Hyperalignment(ClassWithCollections):
         #zscore(commonspace, chunks_attr=None)
 
         ndatasets = len(datasets)
+        executor = self._get_executor()
         for loop in xrange(params.level2_niter):
+            if __debug__:
+                debug('HPAL_', "Level 2 (%i-th iteration) using %s"
+                      % (loop, executor))
             # 2nd-level alignment starts from the original/unprojected datasets
-            # again
-            for i, (m, ds_new) in enumerate(zip(mappers, datasets)):
-                if __debug__:
-                    debug('HPAL_', "Level 2 (%i-th iteration): ds #%i" % (loop, i))
-
-                # Optimization speed up heuristic
-                # Slightly modify the common space towards other feature
-                # spaces and reduce influence of this feature space for the
-                # to-be-computed projection
-                temp_commonspace = (commonspace * ndatasets - data_mapped[i]) \
-                                    / (ndatasets - 1)
-
-                if params.zscore_common:
-                    zscore(temp_commonspace, chunks_attr=None)
-                # assign current common space
-                ds_new.sa[m.get_space()] = temp_commonspace
-                # retrain the mapper for this dataset
-                m.train(ds_new)
-                # remove common space attribute again to save on memory when the
-                # common space is updated for the next iteration
-                del ds_new.sa[m.get_space()]
-                # obtain the 2nd-level projection
-                ds_ = m.forward(ds_new.samples)
-                if params.zscore_common:
-                    zscore(ds_, chunks_attr=None)
-                # store for 2nd-level combiner
-                data_mapped[i] = ds_
-                # compute residuals
-                if residuals is not None:
-                    residuals[1+loop, i] = np.linalg.norm(ds_ - commonspace)
-
-            commonspace = params.combiner2(data_mapped)
+            # again.  All of them are aligned to the same common space, so
+            # they could be processed in parallel
+            commonspace_, shared = _share_for(executor, commonspace)
+            try:
+                results = executor.map(
+                    self._fit_level2,
+                    [((source, m, commonspace_, data_mapped[i], ndatasets,
+                       residuals is not None), {})
+                     for i, (m, source) in enumerate(zip(mappers, datasets))])
+                for i, (ds_, residual) in enumerate(results):
+                    # store for 2nd-level combiner
+                    data_mapped[i] = ds_
+                    # compute residuals
+                    if residuals is not None:
+                        residuals[1+loop, i] = residual
+            finally:
+                release_shared(shared)
+
+            commonspace = np.asarray(params.combiner2(data_mapped))
 
         # and again
         if params.zscore_common:
@@ -504,10 +681,43 @@ class Hyperalignment(ClassWithCollections):
         return commonspace
 
 
+    def _fit_level2(self, source, mapper, commonspace, ds_mapped, ndatasets,
+                    compute_residual):
+        """Obtain the 2nd-level projection of a single dataset"""
+        params = self.params            # for quicker access ;)
+        ds_new = self._get_dataset(source)[0]
+        # Optimization speed up heuristic
+        # Slightly modify the common space towards other feature
+        # spaces and reduce influence of this feature space for the
+        # to-be-computed projection
+        temp_commonspace = (commonspace * ndatasets - ds_mapped) \
+                            / (ndatasets - 1)
+
+        if params.zscore_common:
+            zscore(temp_commonspace, chunks_attr=None)
+        # assign current common space
+        ds_new.sa[mapper.get_space()] = temp_commonspace
+        # retrain the mapper for this dataset
+        mapper.train(ds_new)
+        # remove common space attribute again to save on memory when the
+        # common space is updated for the next iteration
+        del ds_new.sa[mapper.get_space()]
+        # obtain the 2nd-level projection
+        ds_ = mapper.forward(ds_new.samples)
+        if params.zscore_common:
+            zscore(ds_, chunks_attr=None)
+        residual = None
+        if compute_residual:
+            residual = np.linalg.norm(ds_ - commonspace)
+        return ds_, residual
+
+
     def _level3(self, datasets):
         params = self.params            # for quicker access ;)
         # create a mapper per dataset
-        mappers = [deepcopy(params.alignment) for ds in datasets]
+        mappers = [deepcopy(params.alignment) for i in xrange(len(datasets))]
+        compute_residual = self.ca['residual_errors'].enabled
+        prep = dict(zscore_all=params.zscore_all, alpha=params.alpha)
 
         # key different from level-2; the common space is uniform
         #temp_commonspace = commonspace
@@ -517,7 +727,7 @@ class Hyperalignment(ClassWithCollections):
             warning("nproc of 0 doesn't make sense. Setting nproc to 1.")
             params.nproc = 1
         # Checking for joblib, if not, set nproc to 1
-        if params.nproc != 1:
+        if params.nproc != 1 and params.backend is None:
             from mvpa2.base import externals, warning
             if not externals.exists('joblib'):
                 warning("Setting nproc different from 1 requires joblib package, which "
@@ -525,15 +735,19 @@ class Hyperalignment(ClassWithCollections):
                 params.nproc = 1
 
         # start from original input datasets again
-        if params.nproc == 1:
-            residuals = []
-            for i, (m, ds_new) in enumerate(zip(mappers, datasets)):
-                if __debug__:
-                    debug('HPAL_', "Level 3: ds #%i" % i)
-                m, residual = get_trained_mapper(ds_new, self.commonspace, m,
-                                                 self.ca['residual_errors'].enabled)
-                if self.ca['residual_errors'].enabled:
-                    residuals.append(residual)
+        if params.nproc == 1 or params.backend is not None:
+            executor = self._get_executor()
+            if __debug__:
+                debug('HPAL_', "Level 3: Using %s" % executor)
+            commonspace, shared = _share_for(executor, self.commonspace)
+            try:
+                res = list(executor.map(
+                    _get_trained_mapper,
+                    [((ds, commonspace, mapper, compute_residual),
+                      dict(prep, premappers=self._get_premappers(ds)))
+                     for ds, mapper in zip(datasets, mappers)]))
+            finally:
+                release_shared(shared)
         else:
             if __debug__:
                 debug('HPAL_', "Level 3: Using joblib with nproc = %d " % params.nproc)
@@ -551,26 +765,26 @@ class Hyperalignment(ClassWithCollections):
                     backend=params.joblib_backend,
                     verbose=verbose_level_parallel
                     )(
-                        delayed(get_trained_mapper)
-                        (ds, self.commonspace, mapper, self.ca['residual_errors'].enabled)
+                        delayed(_get_trained_mapper)
+                        (ds, self.commonspace, mapper, compute_residual,
+                         premappers=self._get_premappers(ds), **prep)
                         for ds, mapper in zip(datasets, mappers)
                     )
-            mappers = [m for m, r in res]
-            if self.ca['residual_errors'].enabled:
-                residuals = [r for m, r in res]
-
-        if self.ca['residual_errors'].enabled:
+        mappers = [m for m, r, pm in res]
+        if compute_residual:
+            residuals = [r for m, r, pm in res]
             self.ca.residual_errors = Dataset(samples=np.array(residuals)[None, :])
 
-        return mappers
+        # mappers applied while preprocessing datasets loaded from files
+        return mappers, [pm for m, r, pm in res]
 
     def _map_and_mean(self, datasets, mappers):
         params = self.params
         data_mapped = [[] for ds in datasets]
-        for i, (m, ds_new) in enumerate(zip(mappers, datasets)):
+        for i, (m, source) in enumerate(zip(mappers, datasets)):
             if __debug__:
                 debug('HPAL_', "Mapping training data for SVD: ds #%i" % i)
-            ds_ = m.forward(ds_new.samples)
+            ds_ = m.forward(self._get_dataset(source)[0].samples)
             # XXX should we zscore data before averaging and running SVD?
             # zscore(ds_, chunks_attr=None)
             data_mapped[i] = ds_
@@ -605,3 +819,16 @@ def get_trained_mapper(ds, commonspace, mapper, compute_residual=False):
         data_mapped = mapper.forward(ds.samples)
         residual = np.linalg.norm(data_mapped - commonspace)
     return mapper, residual
+
+
+def _get_trained_mapper(source, commonspace, mapper, compute_residual=False,
+                        zscore_all=False, alpha=1, premappers=None):
+    """Like `get_trained_mapper`, but loading the dataset if necessary
+
+    Returns the mappers applied while preprocessing the loaded dataset as
+    a third value.
+    """
+    ds, premappers = _get_dataset(source, zscore_all, alpha, premappers)
+    mapper, residual = get_trained_mapper(ds, commonspace, mapper,
+                                          compute_residual)
+    return mapper, residual, premappers
@@ -11,7 +11,7 @@
 import os
 import numpy as np
 
-from tempfile import mktemp
+from tempfile import mkstemp
 from numpy.linalg import LinAlgError
 
 import mvpa2
@@ -49,6 +49,94 @@ if __debug__:
             debug('SHPAL', "%s" % msg)
 
 
+class _SparseTriplets(object):
+    """Growable storage of (row, column, value) triplets of a sparse matrix
+
+    Triplets are appended to preallocated arrays, which get doubled in
+    size whenever they run out of space, and the matrix is only built once
+    all of them were collected, summing up duplicate entries.
+    """
+
+    def __init__(self, shape, dtype, tmp_prefix=None, capacity=1024):
+        """
+        Parameters
+        ----------
+        shape : tuple
+          Minimal shape of the matrix.  It is extended to fit the largest
+          row and column indices appended.
+        dtype : dtype
+          Type of the values.
+        tmp_prefix : str or None
+          If provided, triplets are stored in temporary memory-mapped files
+          with this prefix instead of memory.
+        capacity : int
+          Initial number of triplets to allocate.
+        """
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self._tmp_prefix = tmp_prefix
+        self._size = 0
+        self._files = []
+        self._arrays = self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        arrays = []
+        files = []
+        for dtype in ('int32', 'int32', self.dtype):
+            if self._tmp_prefix is None:
+                arrays.append(np.empty(capacity, dtype=dtype))
+            else:
+                fd, filename = mkstemp(prefix=self._tmp_prefix,
+                                       suffix='-triplets.npy')
+                os.close(fd)
+                files.append(filename)
+                arrays.append(np.lib.format.open_memmap(
+                    filename, mode='w+', dtype=dtype, shape=(capacity,)))
+        self._unlink()
+        self._files = files
+        return arrays
+
+    def _unlink(self):
+        for filename in self._files:
+            if os.path.exists(filename):
+                os.unlink(filename)
+        self._files = []
+
+    def __len__(self):
+        return self._size
+
+    def append(self, rows, cols, values):
+        """Append triplets given as three sequences of the same length"""
+        start = self._size
+        stop = start + len(values)
+        capacity = len(self._arrays[0])
+        if stop > capacity:
+            old = [a[:start] for a in self._arrays]
+            self._arrays = self._allocate(max(2 * capacity, stop))
+            for a, a_old in zip(self._arrays, old):
+                a[:start] = a_old
+            del old
+        for a, v in zip(self._arrays, (rows, cols, values)):
+            a[start:stop] = v
+        self._size = stop
+
+    def tocsc(self):
+        """Build the matrix out of all triplets and release the storage"""
+        rows, cols, values = [a[:self._size] for a in self._arrays]
+        shape = self.shape
+        if self._size:
+            shape = (max(shape[0], rows.max() + 1),
+                     max(shape[1], cols.max() + 1))
+        # duplicates get summed up during the conversion
+        proj = coo_matrix((values, (rows, cols)),
+                          shape=shape, dtype=self.dtype).tocsc()
+        del rows, cols, values
+        self._arrays = None
+        self._size = 0
+        self._unlink()
+        return proj
+
+
 @due.dcite(
     Doi('10.1016/j.neuron.2011.08.026'),
     description="Per-feature measure of maximal correlation to features in other datasets",
@@ -333,6 +421,13 @@ class SearchlightHyperalignment(ClassWithCollections):
         constraints='str',
         doc="""Prefix for temporary files. See Searchlight documentation.""")
 
+    spill_triplets = Parameter(
+        False,
+        constraints=EnsureBool(),
+        doc="""Store the elements of the projection matrices collected within
+            a block in temporary files (see `tmp_prefix`) instead of memory
+            until the matrices get built.""")
+
     def __init__(self, **kwargs):
         _shpaldebug("Initializing.")
         ClassWithCollections.__init__(self, **kwargs)
@@ -367,9 +462,12 @@ class SearchlightHyperalignment(ClassWithCollections):
         if __debug__:
             debug('SLC', 'Starting computing block for %i elements' % len(block))
         bar = ProgressBar()
-        projections = [csc_matrix((self.nfeatures, self.nfeatures),
-                                  dtype=self.params.dtype)
-                       for isub in range(self.ndatasets)]
+        tmp_prefix = self.params.tmp_prefix \
+            if self.params.spill_triplets else None
+        triplets = [_SparseTriplets((self.nfeatures, self.nfeatures),
+                                    self.params.dtype,
+                                    tmp_prefix=tmp_prefix)
+                    for isub in range(self.ndatasets)]
         for i, node_id in enumerate(block):
             # retrieve the feature ids of all features in the ROI from the query
             # engine
@@ -403,32 +501,31 @@ class SearchlightHyperalignment(ClassWithCollections):
             for isub, roi_feature_ids in enumerate(roi_feature_ids_all):
                 if not self.params.combine_neighbormappers:
                     I = roi_feature_ids
-                    #J = [roi_feature_ids[node_id]] * len(roi_feature_ids)
-                    J = [node_id] * len(roi_feature_ids)
-                    V = hmappers[isub].tolist()
-                    if np.isscalar(V):
-                        V = [V]
+                    J = np.repeat(node_id, len(roi_feature_ids))
+                    V = np.atleast_1d(hmappers[isub])
                 else:
-                    I, J, V = [], [], []
-                    for f2, roi_feature_id_ref_ds in enumerate(roi_feature_ids_ref_ds):
-                        I += roi_feature_ids
-                        J += [roi_feature_id_ref_ds] * len(roi_feature_ids)
-                        V += hmappers[isub][:, f2].tolist()
-                proj = coo_matrix(
-                    (V, (I, J)),
-                    shape=(max(self.nfeatures, max(I) + 1), max(self.nfeatures, max(J) + 1)),
-                    dtype=self.params.dtype)
-                proj = proj.tocsc()
-                # Cleaning up the current subject's projections to free up memory
-                hmappers[isub] = [[] for _ in hmappers]
-                projections[isub] = projections[isub] + proj
+                    # column by column of the mapper, i.e. each feature of
+                    # the ROI gets a weight for every reference feature
+                    I = np.tile(roi_feature_ids, len(roi_feature_ids_ref_ds))
+                    J = np.repeat(roi_feature_ids_ref_ds, len(roi_feature_ids))
+                    V = np.ravel(hmappers[isub], order='F')
+                triplets[isub].append(I, J, V)
+                # Cleaning up the current subject's mapper to free up memory
+                hmappers[isub] = None
+
+        # build each subject's projection only once per block
+        projections = []
+        for isub in range(self.ndatasets):
+            projections.append(triplets[isub].tocsc())
+            triplets[isub] = None
 
         if self.params.results_backend == 'native':
             return projections
         elif self.params.results_backend == 'hdf5':
             # store results in a temporary file and return a filename
-            results_file = mktemp(prefix=self.params.tmp_prefix,
-                                  suffix='-%s.hdf5' % iblock)
+            fd, results_file = mkstemp(prefix=self.params.tmp_prefix,
+                                       suffix='-%s.hdf5' % iblock)
+            os.close(fd)
             if __debug__:
                 debug('SLC', "Storing results into %s" % results_file)
             h5save(results_file, projections)
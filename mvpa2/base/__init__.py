@@ -208,6 +208,7 @@ if __debug__:
     debug.register('LOOP', "Support's loop construct")
     debug.register('PLR', "PLR call")
     debug.register('NBH', "Neighborhood estimations")
+    debug.register('PAR', "Parallel execution of tasks")
     debug.register('SLC', "Searchlight call")
     debug.register('SLC_', "Searchlight call (verbose)")
     debug.register('SVS', "Surface-based voxel selection (a.k.a. 'surfing')")
@@ -40,6 +40,10 @@ class Collectable(object):
     A named single item container that allows for type, or property checks of
     an assigned value, and also offers utility functionality.
     """
+
+    _lazy = None
+    """Function and arguments to compute the value upon first access"""
+
     def __init__(self, value=None, name=None, doc=None):
         """
         Parameters
@@ -102,6 +106,8 @@ class Collectable(object):
 
 
     def __reduce__(self):
+        if self._lazy is not None:
+            self._materialize()
         return (self.__class__,
                     (self._value, self.name, self.__doc__))
 
@@ -139,12 +145,34 @@ class Collectable(object):
         self.__name = name
 
 
+    def set_lazy(self, fx, *args):
+        """Defer computing the value until it is accessed first
+
+        Parameters
+        ----------
+        fx : callable
+          Called with `args` to provide the value, which gets assigned as
+          usual.
+        """
+        self._value = None
+        self._lazy = (fx, args)
+
+
+    def _materialize(self):
+        fx, args = self._lazy
+        self._lazy = None
+        self._set(fx(*args))
+
+
     # Instead of going for VProperty lets make use of virtual method
     def _get_virtual(self):
+        if self._lazy is not None:
+            self._materialize()
         return self._get()
 
 
     def _set_virtual(self, value):
+        self._lazy = None
         return self._set(value)
 
 
@@ -202,6 +230,9 @@ class SequenceCollectable(Collectable):
 
 
     def __len__(self):
+        if self._lazy is not None and self._target_length is not None:
+            # no need to compute the value
+            return self._target_length
         return self.value.__len__()
 
 
@@ -590,11 +621,11 @@ class UniformLengthCollection(Collection):
             value = ArrayCollectable(value)
         if ulength is None:
             ulength = len(value)
-        elif not len(value.value) == ulength:
+        elif not len(value) == ulength:
             raise ValueError("Collectable '%s' with length [%i] does not match "
                              "the required length [%i] of collection '%s'."
                              % (key,
-                                len(value.value),
+                                len(value),
                                 ulength,
                                 str(self)))
         # tell the attribute to maintain the desired length
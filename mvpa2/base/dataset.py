@@ -10,7 +10,9 @@
 
 __docformat__ = 'restructuredtext'
 
+import os
 from os.path import lexists
+import os.path as osp
 import numpy as np
 import copy
 
@@ -29,6 +31,40 @@ if not __REPR_STYLE__ in ('full', 'str'):
     raise ValueError("Incorrect value %r for option datasets.repr."
                      " Valid are 'full' and 'str'." % __REPR_STYLE__)
 
+# name of the file listing all arrays of a dataset stored by to_npy()
+_NPY_MANIFEST = 'manifest.json'
+
+
+def _as_contiguous_slice(idx, length):
+    """Return a slice equivalent to a selection of consecutive elements
+
+    Selections by index arrays or boolean masks which could be expressed as
+    a slice are converted, so numpy could provide views instead of copies.
+    Anything else is returned as is.
+    """
+    if isinstance(idx, slice):
+        return idx
+    idx_ = np.asanyarray(idx)
+    if idx_.ndim != 1 or not len(idx_):
+        return idx
+    if idx_.dtype == np.bool:
+        if len(idx_) != length:
+            return idx
+        idx_ = idx_.nonzero()[0]
+        if not len(idx_):
+            return idx
+    elif not np.issubdtype(idx_.dtype, np.integer):
+        return idx
+    start, stop = idx_[0], idx_[-1] + 1
+    if start < 0 or stop - start != len(idx_) \
+            or (len(idx_) > 1 and np.any(np.diff(idx_) != 1)):
+        return idx
+    return slice(start, stop)
+
+
+def _take(value, idx):
+    return value[idx]
+
 
 class AttrDataset(object):
     """Generic storage class for datasets with multiple attributes.
@@ -187,7 +223,18 @@ class AttrDataset(object):
     Whereas the call: 'ds.samples[[0,1,2], [1,2]]' would not be
     possible. In `AttrDatasets` selection of samples and features is always
     applied individually and independently to each axis.
+
+    With `lazy_slicing` enabled (configuration option
+    ``datasets.lazy slicing``, or the class/instance attribute itself),
+    attributes of a selection are only sliced (or, for dataset attributes,
+    copied) when accessed first.  Moreover, selections of consecutive
+    samples or features by index arrays or boolean masks behave like
+    slices, i.e. the selected samples are a view of the original ones.
     """
+
+    lazy_slicing = cfg.getboolean('datasets', 'lazy slicing', default='no')
+    """Whether selections defer slicing of the attributes until accessed"""
+
     def __init__(self, samples, sa=None, fa=None, a=None):
         """
         A Dataset might have an arbitrary number of attributes for samples,
@@ -432,6 +479,12 @@ class AttrDataset(object):
             if isinstance(a, int):
                 args[i] = [a]
 
+        lazy = self.lazy_slicing
+        if lazy and isinstance(self.samples, np.ndarray):
+            # consecutive selections can be views, just like slices
+            args = [_as_contiguous_slice(a, l)
+                    for a, l in zip(args, self.samples.shape)]
+
         # for simultaneous slicing of numpy arrays we should
         # distinguish the case when one of the args is a slice, so no
         # ix_ is needed
@@ -467,9 +520,15 @@ class AttrDataset(object):
         # we need fresh SamplesAttributes even if they share the data
         for attr in self.sa.values():
             # preserve attribute type
-            newattr = attr.__class__(doc=attr.__doc__)
-            # slice
-            newattr.value = attr.value[args[0]]
+            if lazy:
+                # slice only once accessed
+                newattr = attr.__class__(doc=attr.__doc__,
+                                         length=samples.shape[0])
+                newattr.set_lazy(_take, attr.value, args[0])
+            else:
+                newattr = attr.__class__(doc=attr.__doc__)
+                # slice
+                newattr.value = attr.value[args[0]]
             # assign to target collection
             sa[attr.name] = newattr
 
@@ -477,9 +536,14 @@ class AttrDataset(object):
         # since we need fresh SamplesAttributes even if they share the data
         for attr in self.fa.values():
             # preserve attribute type
-            newattr = attr.__class__(doc=attr.__doc__)
-            # slice
-            newattr.value = attr.value[args[1]]
+            if lazy:
+                newattr = attr.__class__(doc=attr.__doc__,
+                                         length=samples.shape[1])
+                newattr.set_lazy(_take, attr.value, args[1])
+            else:
+                newattr = attr.__class__(doc=attr.__doc__)
+                # slice
+                newattr.value = attr.value[args[1]]
             # assign to target collection
             fa[attr.name] = newattr
 
@@ -490,12 +554,19 @@ class AttrDataset(object):
             # do a shallow copy here
             # XXX every DatasetAttribute should have meaningful __copy__ if
             # necessary -- most likely all mappers need to have one
-            newattr.value = copy.copy(attr.value)
+            if lazy:
+                newattr.set_lazy(copy.copy, attr.value)
+            else:
+                newattr.value = copy.copy(attr.value)
             # assign to target collection
             a[attr.name] = newattr
 
         # and after a long way instantiate the new dataset of the same type
-        return self.__class__(samples, sa=sa, fa=fa, a=a)
+        ds = self.__class__(samples, sa=sa, fa=fa, a=a)
+        if 'lazy_slicing' in self.__dict__:
+            # selections keep the mode chosen for this instance
+            ds.lazy_slicing = lazy
+        return ds
 
     def __repr_full__(self):
         return "%s(%s, sa=%s, fa=%s, a=%s)" \
@@ -616,6 +687,10 @@ class AttrDataset(object):
         savez = np.savez_compressed if compress else np.savez
         if not filename.endswith('.npz'):
             filename += '.npz'
+        return savez(filename, **self._get_array_entries())
+
+    def _get_array_entries(self):
+        """Samples and all attributes which are ndarrays by their names"""
         entries = {'samples': self.samples}
         skipped = []
         for c in ('a', 'fa', 'sa'):
@@ -629,7 +704,84 @@ class AttrDataset(object):
                     skipped.append(e)
         if skipped:
             warning("Skipping %s since not ndarrays" % (', '.join(skipped)))
-        return savez(filename, **entries)
+        return entries
+
+    def to_npy(self, dirname):
+        """Save dataset into a directory with a .npy file per array
+
+        Unlike `to_npz` the arrays are stored uncompressed in separate files,
+        so that `from_npy` can memory-map them.  Along with samples all
+        fa/sa/a which are ndarrays are stored.  A manifest lists all of them
+        and is written last, hence a directory is only loadable once all
+        arrays are stored.
+
+        Parameters
+        ----------
+        dirname : str
+          Directory to store the dataset in.  It is created if necessary.
+        """
+        import json
+        if not osp.exists(dirname):
+            os.makedirs(dirname)
+        manifest_file = osp.join(dirname, _NPY_MANIFEST)
+        if lexists(manifest_file):
+            # invalidate any previous content, and remove its arrays, which
+            # would otherwise be left behind (e.g. those of attributes no
+            # longer present)
+            with open(manifest_file) as f:
+                old_files = json.load(f)['entries'].values()
+            os.unlink(manifest_file)
+            for fname in old_files:
+                filename = osp.join(dirname, fname)
+                if lexists(filename):
+                    os.unlink(filename)
+        entries = {}
+        for i, (e, v) in enumerate(sorted(self._get_array_entries().items())):
+            # attribute names are not necessarily good filenames
+            fname = 'samples.npy' if e == 'samples' \
+                    else '%s_%i.npy' % (e.split('.', 1)[0], i)
+            np.save(osp.join(dirname, fname), v)
+            entries[e] = fname
+        with open(manifest_file, 'w') as f:
+            json.dump({'version': 1, 'entries': entries}, f, indent=1)
+
+    @classmethod
+    def from_npy(cls, dirname, mmap_mode='r'):
+        """Load dataset from a directory as stored by to_npy
+
+        Parameters
+        ----------
+        dirname : str
+          Directory the dataset was stored in.
+        mmap_mode : {None, 'r', 'r+', 'c'}, optional
+          Mode to memory-map arrays with (see `numpy.load`).  By default
+          arrays are mapped read-only, so a dataset is opened instantly and
+          could be shared by multiple processes without loading it.
+          Arrays of Python objects are always loaded into memory.
+        """
+        import json
+        manifest_file = osp.join(dirname, _NPY_MANIFEST)
+        if not lexists(manifest_file):
+            raise ValueError("%s contains no dataset stored by to_npy"
+                             % dirname)
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+        cols = {'a': {}, 'fa': {}, 'sa': {}}
+        samples = None
+        for e, fname in manifest['entries'].iteritems():
+            filename = osp.join(dirname, fname)
+            try:
+                v = np.load(filename, mmap_mode=mmap_mode)
+            except ValueError:
+                # arrays of objects cannot be memory-mapped
+                v = np.load(filename)
+            if e == 'samples':
+                samples = v
+            else:
+                c, k = str(e).split('.', 1)
+                cols[c][k] = v
+        return cls(samples, **cols)
 
     @classmethod
     def from_npz(cls, filename):
@@ -642,9 +794,12 @@ class AttrDataset(object):
         Parameters
         ----------
         filename: str
-          Filename for the .npz file.  Can be specified without .npz suffix
+          Filename for the .npz file.  Can be specified without .npz suffix.
+          A directory is loaded with `from_npy`, i.e. memory-mapped.
 
         """
+        if osp.isdir(filename):
+            return cls.from_npy(filename)
         # some sugaring
         filename_npz = filename + '.npz'
         if not lexists(filename) and not filename.endswith('.npz') and lexists(filename_npz):
@@ -557,6 +557,24 @@ def _hdf_to_ndarray(hdf):
     return obj
 
 
+def _get_chunks(chunks, shape):
+    """Adapt a chunk shape to the shape of an array
+
+    Leading dimensions of the chunk shape are used for arrays with fewer
+    dimensions, missing ones span the whole array, and all of them are
+    limited to the size of the array.
+    """
+    if not np.prod(shape):
+        # empty arrays cannot be chunked
+        return None
+    if not isinstance(chunks, tuple):
+        # e.g. True for automatic chunking
+        return chunks
+    chunks = tuple(chunks[:len(shape)]) + tuple(shape[len(chunks):])
+    return tuple(max(1, min(c if c else s, s))
+                 for c, s in zip(chunks, shape))
+
+
 def _seqitems_to_hdf(obj, hdf, memo, noid=False, **kwargs):
     """Store a sequence as HDF item list"""
     hdf.attrs.create('length', len(obj))
@@ -659,13 +677,16 @@ def obj2hdf(hdf, obj, name=None, memo=None, noid=False, **kwargs):
             debug('HDF5', "Store '%s' (ref: %i) in [%s/%s]"
                   % (type(obj), obj_id, hdf.name, name))
         # the real action is here
-        if 'compression' in kwargs \
+        if ('compression' in kwargs or 'chunks' in kwargs) \
                 and (is_scalar or (is_ndarray and not len(obj.shape))):
             # recent (>= 2.0.0) h5py is strict not allowing
             # compression to be set for scalar types or anything with
             # shape==() ... TODO: check about is_objarrays ;-)
             kwargs = dict([(k, v) for (k, v) in kwargs.iteritems()
-                           if k != 'compression'])
+                           if not k in ('compression', 'chunks')])
+        elif is_ndarray and kwargs.get('chunks') is not None:
+            kwargs = dict(kwargs, chunks=_get_chunks(kwargs['chunks'],
+                                                     obj.shape))
 
         is_a_view = False
         try:
@@ -692,6 +713,11 @@ def obj2hdf(hdf, obj, name=None, memo=None, noid=False, **kwargs):
                 obj_ = obj
             assert(obj_.flags.c_contiguous or obj_.flags.f_contiguous)
             obj_data = np.frombuffer(obj_.data, dtype=np.int8)
+            chunks = kwargs.get('chunks')
+            if isinstance(chunks, tuple):
+                # chunks of the same number of bytes in the flat view
+                kwargs = dict(kwargs, chunks=_get_chunks(
+                    (int(np.prod(chunks)) * obj_.itemsize,), obj_data.shape))
             hdf.create_dataset(name, None, None, obj_data, **kwargs)
             hdf[name].attrs.create('is_a_view', True)
             hdf[name].attrs.create('c_order', obj_.flags.c_contiguous)
@@ -900,7 +926,13 @@ def h5save(filename, data, name=None, mode='w', mkdir=True, **kwargs):
       Create target directory if it does not exist yet.
     **kwargs
       All additional arguments will be passed to `h5py.Group.create_dataset`.
-      This could, for example, be `compression='gzip'`.
+      This could, for example, be `compression='gzip'`, or `compression='lzf'`
+      for a fast compression at a lower ratio.  A tuple passed as `chunks`
+      determines the layout of all arrays: e.g. `chunks=(10, 1000)` stores
+      samples of a dataset in blocks of 10 samples by 1000 features, so
+      subsets could be loaded efficiently (see `h5load()`).  Arrays with
+      fewer dimensions, such as attributes, are chunked along the leading
+      dimensions, i.e. by 10 elements in this example.
     """
     if mkdir:
         target_dir = osp.dirname(filename)
@@ -934,30 +966,269 @@ def h5save(filename, data, name=None, mode='w', mkdir=True, **kwargs):
         hdf.close()
 
 
-def h5load(filename, name=None):
+def _select_from_dataset(ds, samples=None, features=None,
+                         sa=None, fa=None, a=None):
+    """Same selection as `_load_dataset_selection()` on a loaded dataset"""
+    def _get_sel(sel, col, length):
+        if isinstance(sel, dict):
+            mask = np.ones(length, dtype=bool)
+            for name, values in sel.iteritems():
+                mask &= np.in1d(col[name].value, np.atleast_1d(values))
+            return np.flatnonzero(mask)
+        return _get_index(sel, length)
+
+    ds = ds[_get_sel(samples, ds.sa, ds.nsamples)]
+    if features is not None:
+        ds = ds[:, _get_sel(features, ds.fa, ds.nfeatures)]
+    for col, names in ((ds.sa, sa), (ds.fa, fa), (ds.a, a)):
+        if names is not None:
+            for k in [k for k in col.keys() if not k in names]:
+                del col[k]
+    return ds
+
+
+def _is_stored_dataset(hdf):
+    """Whether an HDF5 group holds a dataset stored by `obj2hdf()`"""
+    if not (isinstance(hdf, h5py.Group) and 'recon' in hdf.attrs
+            and 'rcargs' in hdf):
+        return False
+    from mvpa2.base.dataset import AttrDataset
+    try:
+        cls = _import_from_thin_air(hdf.attrs['module'].decode(),
+                                    hdf.attrs['recon'].decode())[1]
+    except (ImportError, KeyError):
+        return False
+    return isinstance(cls, type) and issubclass(cls, AttrDataset)
+
+
+def _get_index(sel, length):
+    """Turn a selection into a sorted index array (or a slice)"""
+    if sel is None:
+        return slice(None)
+    if isinstance(sel, slice):
+        return sel
+    sel = np.asanyarray(sel)
+    if sel.dtype == np.bool:
+        if len(sel) != length:
+            raise ValueError("Boolean selection of length %i does not match "
+                             "%i elements" % (len(sel), length))
+        sel = np.flatnonzero(sel)
+    else:
+        sel = np.atleast_1d(sel).astype(int)
+        sel[sel < 0] += length
+    return sel
+
+
+def _read_selection(hdf, rows, cols=None):
+    """Read selected rows (and columns) of an HDF5 dataset
+
+    Only the selected part is read from the file.  Index arrays might be
+    unsorted and contain duplicates.
+    """
+    def _h5index(idx):
+        # h5py demands increasing indices, so read unique sorted
+        # ones and remember how to get the requested ones from them
+        if isinstance(idx, slice):
+            return idx, None
+        if not len(idx):
+            return slice(0, 0), None
+        uidx, inverse = np.unique(idx, return_inverse=True)
+        if len(uidx) == len(idx) and np.all(uidx == idx):
+            inverse = None
+        return list(uidx), inverse
+
+    from mvpa2.base.dataset import _as_contiguous_slice
+    rows = _as_contiguous_slice(rows, hdf.shape[0])
+    hrows, rinverse = _h5index(rows)
+    if cols is None or len(hdf.shape) < 2:
+        obj = hdf[hrows] if len(hdf.shape) else hdf[()]
+    else:
+        cols = _as_contiguous_slice(cols, hdf.shape[1])
+        hcols, cinverse = _h5index(cols)
+        if not isinstance(hrows, slice) and not isinstance(hcols, slice):
+            # h5py can only do one list of indices at a time
+            obj = hdf[hrows][:, hcols]
+        else:
+            obj = hdf[hrows, hcols]
+        if cinverse is not None:
+            obj = obj[:, cinverse]
+    if rinverse is not None:
+        obj = obj[rinverse]
+    return obj
+
+
+def _hdf_collection_items(hdf):
+    """Yield (name, group) of all attributes of a stored collection"""
+    items = hdf['items']
+    if not items.attrs.get('__keys_in_tuple__', 0):
+        raise LookupError("Unsupported layout of a collection")
+    for i in xrange(hdf.attrs.get('length', len(items))):
+        item = items[str(i)]['items']
+        yield hdf2obj(item['0']), item['1']
+
+
+def _load_attribute(hdf, memo, sel=slice(None)):
+    """Load the (selected part of the) value of a stored attribute"""
+    value_hdf = hdf['rcargs']['items'].get('0')
+    if isinstance(value_hdf, h5py.Dataset) \
+            and not [k for k in ('is_a_view', 'is_objarray', 'is_scalar',
+                                 'is_numpy_scalar')
+                     if k in value_hdf.attrs]:
+        # read only what is needed
+        return _read_selection(value_hdf, sel)
+    # anything else is loaded completely
+    value = hdf2obj(hdf, memo).value
+    return value[sel] if not np.isscalar(value) else value
+
+
+def _resolve_selection(sel, hdf, memo, length):
+    """Determine indices of a selection
+
+    Besides anything suitable for `_get_index()` this could be a dict of
+    attribute names and values to select elements, whose attributes have
+    any of the values.
+    """
+    if not isinstance(sel, dict):
+        return _get_index(sel, length)
+    mask = np.ones(length, dtype=bool)
+    found = set()
+    for name, attr_hdf in _hdf_collection_items(hdf):
+        if name in sel:
+            found.add(name)
+            mask &= np.in1d(_load_attribute(attr_hdf, memo),
+                            np.atleast_1d(sel[name]))
+    if len(found) < len(sel):
+        raise ValueError("Unknown attributes %s for the selection"
+                         % sorted(set(sel).difference(found)))
+    return np.flatnonzero(mask)
+
+
+def _get_stored_samples_shape(filename, name=None):
+    """Shape of the samples of a dataset stored in an HDF5 file
+
+    Only the layout of the file is read, not the samples.
+
+    Returns
+    -------
+    tuple or None
+      None if the file contains no dataset with plainly stored samples.
+    """
+    hdf = h5py.File(filename, 'r')
+    try:
+        hdf_ = hdf[name] if name is not None else hdf
+        if not _is_stored_dataset(hdf_):
+            return None
+        samples_hdf = hdf_['rcargs']['items']['0']
+        if not isinstance(samples_hdf, h5py.Dataset) \
+                or 'is_a_view' in samples_hdf.attrs:
+            return None
+        return samples_hdf.shape
+    finally:
+        hdf.close()
+
+
+def _load_dataset_selection(hdf, samples=None, features=None,
+                            sa=None, fa=None, a=None):
+    """Load selected samples, features and attributes of a stored dataset
+
+    See `h5load()` for details.
+    """
+    cls = _import_from_thin_air(hdf.attrs['module'].decode(),
+                                hdf.attrs['recon'].decode())[1]
+    args = hdf['rcargs']['items']
+    samples_hdf = args['0']
+    memo = {}
+    if not isinstance(samples_hdf, h5py.Dataset) \
+            or 'is_a_view' in samples_hdf.attrs:
+        raise LookupError("Samples are not stored as a plain array")
+    nsamples = samples_hdf.shape[0]
+    nfeatures = samples_hdf.shape[1] if len(samples_hdf.shape) > 1 else 0
+    rows = _resolve_selection(samples, args['1'], memo, nsamples)
+    cols = _resolve_selection(features, args['2'], memo, nfeatures)
+
+    def _load_collection(col_hdf, names, sel):
+        col = {}
+        for name, attr_hdf in _hdf_collection_items(col_hdf):
+            if names is None or name in names:
+                col[name] = _load_attribute(attr_hdf, memo, sel)
+        return col
+
+    data = _read_selection(samples_hdf, rows,
+                           None if features is None else cols)
+    a_ = {}
+    for name, attr_hdf in _hdf_collection_items(args['3']):
+        if a is None or name in a:
+            a_[name] = hdf2obj(attr_hdf, memo).value
+    ds = cls(data,
+             sa=_load_collection(args['1'], sa, rows),
+             fa=_load_collection(args['2'], fa, cols),
+             a=a_)
+    if features is not None and 'mapper' in ds.a \
+            and hasattr(ds, '_append_mapper'):
+        # keep the mapper in line with the feature selection
+        from mvpa2.datasets.base import _get_feature_selection
+        ds._append_mapper(
+            _get_feature_selection(cols, samples_hdf.shape[1:]))
+    return ds
+
+
+def h5load(filename, name=None, samples=None, features=None,
+           sa=None, fa=None, a=None):
     """Loads the content of an HDF5 file that has been stored by `h5save()`.
 
     This is a convenience wrapper around `hdf2obj()`. Please see its
     documentation for more details.
 
+    For stored datasets it is possible to load only a selection of samples,
+    features, or attributes.  Only the selected parts are read from the file,
+    hence it is beneficial to store large datasets with a suitable chunk
+    layout (see `h5save()`).
+
     Parameters
     ----------
     filename : str
       Name of the file to open and load its content.
     name : str
       Name of a specific object to load from the file.
+    samples : slice or sequence or dict, optional
+      Samples of a stored dataset to load, as index array, boolean mask, or
+      slice.  A dict of attribute names and values selects all samples
+      whose attributes match any of the values, e.g. `{'chunks': 3}` to
+      load a single run.  All samples by default.
+    features : slice or sequence or dict, optional
+      Same as `samples`, but for features.  A mapper in the dataset's
+      attributes is extended by the feature selection.
+    sa, fa, a : sequence of str, optional
+      Names of sample, feature, or dataset attributes to load.  All of
+      them by default.
 
     Returns
     -------
     instance
       An object of whatever has been stored in the file.
     """
+    selection = [x for x in (samples, features, sa, fa, a) if x is not None]
     hdf = h5py.File(filename, 'r')
     try:
+        if name is not None and not name in hdf:
+            raise ValueError("No object of name '%s' in file '%s'."
+                             % (name, filename))
+        if selection:
+            hdf_ = hdf[name] if name is not None else hdf
+            if not _is_stored_dataset(hdf_):
+                raise ValueError("Selections can only be loaded for datasets, "
+                                 "but '%s' contains no dataset%s."
+                                 % (filename, name and " '%s'" % name or ''))
+            try:
+                return _load_dataset_selection(hdf_, samples, features,
+                                               sa, fa, a)
+            except LookupError as e:
+                if __debug__:
+                    debug('HDF5', "Cannot load selection directly (%s), "
+                                  "loading whole dataset" % e)
+                return _select_from_dataset(hdf2obj(hdf_), samples,
+                                            features, sa, fa, a)
         if name is not None:
-            if not name in hdf:
-                raise ValueError("No object of name '%s' in file '%s'."
-                                 % (name, filename))
             obj = hdf2obj(hdf[name])
         else:
             if not len(hdf) and not len(hdf.attrs):
@@ -0,0 +1,553 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the PyMVPA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Pluggable executors to run independent computations in parallel
+
+Each executor applies a function to a sequence of tasks (pairs of
+positional and keyword arguments) and returns the results in the order of
+the tasks.  Process-based executors fork their workers *after* the
+function and the tasks were registered, so neither has to be picklable
+(as it used to be with `pprocess`) -- only the results are transferred
+back to the parent process.
+
+Large arrays could be placed into shared memory (see `share_array`), so
+they get passed to the workers by reference whenever they need to be
+pickled, and workers could write their results into them directly.
+"""
+
+__docformat__ = 'restructuredtext'
+
+import os
+import tempfile
+import numpy as np
+
+from mvpa2.base import externals, warning
+
+if __debug__:
+    from mvpa2.base import debug
+
+__all__ = ['Executor', 'SerialExecutor', 'PProcessExecutor',
+           'MultiprocessingExecutor', 'ThreadExecutor', 'JoblibExecutor',
+           'FuturesExecutor', 'get_executor', 'get_nproc', 'get_blocks',
+           'parallel_backends', 'SharedArray', 'share_array',
+           'share_dataset', 'release_shared']
+
+
+# function and tasks to be consumed by the worker processes.  Assigned
+# before the workers are started, so it gets inherited upon fork
+_worker_job = None
+
+def _init_worker(fx, tasks):
+    """Register the job within a (freshly started) worker process"""
+    global _worker_job
+    _worker_job = (fx, tasks)
+
+
+def _run_task(i):
+    """Run i-th task of the registered job"""
+    fx, tasks = _worker_job
+    args, kwargs = tasks[i]
+    return fx(*args, **kwargs)
+
+
+def _call_method(obj, name, *args, **kwargs):
+    """Call a method of an object -- to avoid pickling bound methods"""
+    return getattr(obj, name)(*args, **kwargs)
+
+
+def _get_cpu_count():
+    import multiprocessing
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+class Executor(object):
+    """Base class for all executors
+
+    Derived classes implement `map` which might return a generator, so the
+    results could be processed as soon as they become available.
+    """
+
+    external = None
+    """Name of the external required by the executor"""
+
+    shares_state = False
+    """Whether the tasks operate on the very same objects (e.g. in threads)"""
+
+    def __init__(self, nproc=None):
+        """
+        Parameters
+        ----------
+        nproc : None or int
+          Maximal number of workers to use.  If None -- number of available
+          cores.
+        """
+        if self.external is not None:
+            externals.exists(self.external, raise_='always')
+        self.nproc = self._get_default_nproc() if nproc is None else nproc
+
+
+    def __repr__(self):
+        return "%s(nproc=%r)" % (self.__class__.__name__, self.nproc)
+
+
+    def _get_default_nproc(self):
+        return _get_cpu_count()
+
+
+    def _get_nworkers(self, tasks):
+        return max(1, min(self.nproc, len(tasks)))
+
+
+    def map(self, fx, tasks):
+        """Apply `fx` to all `tasks`
+
+        Parameters
+        ----------
+        fx : callable
+        tasks : iterable of (tuple, dict)
+          Positional and keyword arguments for each invocation of `fx`.
+
+        Returns
+        -------
+        iterable
+          Results in the order of `tasks`.
+        """
+        raise NotImplementedError
+
+
+
+class SerialExecutor(Executor):
+    """Run all tasks one after another in the current process"""
+
+    def _get_default_nproc(self):
+        return 1
+
+
+    def map(self, fx, tasks):
+        return (fx(*args, **kwargs) for args, kwargs in tasks)
+
+
+
+class PProcessExecutor(Executor):
+    """Run tasks in forked processes managed by `pprocess`"""
+
+    external = 'pprocess'
+
+    def _get_default_nproc(self):
+        import pprocess
+        try:
+            return pprocess.get_number_of_cores() or 1
+        except AttributeError:
+            warning("pprocess version %s has no API to figure out maximal "
+                    "number of cores. Using 1"
+                    % externals.versions['pprocess'])
+            return 1
+
+
+    def map(self, fx, tasks):
+        import pprocess
+        tasks = list(tasks)
+        results = pprocess.Map(limit=self._get_nworkers(tasks))
+        compute = results.manage(pprocess.MakeParallel(fx))
+        for args, kwargs in tasks:
+            compute(*args, **kwargs)
+        return results
+
+
+
+class MultiprocessingExecutor(Executor):
+    """Run tasks in a pool of processes of the `multiprocessing` module
+
+    Workers pull tasks one at a time, so faster workers pick up the slack of
+    the slower ones.
+    """
+
+    def _get_pool(self, nworkers, fx, tasks):
+        """Return the pool and the function to be mapped over task indices"""
+        import multiprocessing
+        return (multiprocessing.Pool(nworkers, initializer=_init_worker,
+                                     initargs=(fx, tasks)),
+                _run_task)
+
+
+    def map(self, fx, tasks):
+        tasks = list(tasks)
+        nworkers = self._get_nworkers(tasks)
+        if __debug__:
+            debug('PAR', "Starting %d workers of %s for %d tasks"
+                  % (nworkers, self, len(tasks)))
+        pool, run_task = self._get_pool(nworkers, fx, tasks)
+        try:
+            for res in pool.imap(run_task, range(len(tasks)), chunksize=1):
+                yield res
+            pool.close()
+        finally:
+            # no-op if pool was closed already, and kills workers if we
+            # were interrupted
+            pool.terminate()
+            pool.join()
+
+
+
+class ThreadExecutor(MultiprocessingExecutor):
+    """Run tasks in a pool of threads
+
+    Only beneficial for functions which release the GIL (e.g. heavy
+    lifting within numpy/BLAS or compiled extensions), but avoids any
+    serialization of the results.
+    """
+
+    shares_state = True
+
+    def _get_pool(self, nworkers, fx, tasks):
+        from multiprocessing.pool import ThreadPool
+        # threads share the memory, so no need to register the job globally
+        def run_task(i):
+            args, kwargs = tasks[i]
+            return fx(*args, **kwargs)
+        return ThreadPool(nworkers), run_task
+
+
+
+class JoblibExecutor(Executor):
+    """Run tasks using `joblib.Parallel`
+
+    Unlike the other process-based executors, `fx` and the tasks must be
+    picklable since `joblib` might reuse already running workers.
+    """
+
+    external = 'joblib'
+
+    def map(self, fx, tasks):
+        import joblib
+        tasks = list(tasks)
+        obj = getattr(fx, '__self__', None)
+        if obj is not None:
+            # bound methods might not be picklable (e.g. in Python 2), so
+            # pass the instance and the name of the method instead
+            name = fx.__name__
+            args_fx = lambda args: (obj, name) + tuple(args)
+            fx = _call_method
+        else:
+            args_fx = tuple
+        return joblib.Parallel(n_jobs=self._get_nworkers(tasks))(
+            joblib.delayed(fx)(*args_fx(args), **kwargs)
+            for args, kwargs in tasks)
+
+
+
+class FuturesExecutor(Executor):
+    """Run tasks using `concurrent.futures.ProcessPoolExecutor`"""
+
+    external = 'concurrent.futures'
+
+    def map(self, fx, tasks):
+        from concurrent.futures import ProcessPoolExecutor
+        tasks = list(tasks)
+        nworkers = self._get_nworkers(tasks)
+        # workers get started upon submission, so with fork they would
+        # inherit the job registered in the parent.  Recent Pythons
+        # provide an initializer which allows for other start methods
+        _init_worker(fx, tasks)
+        try:
+            try:
+                pool = ProcessPoolExecutor(nworkers, initializer=_init_worker,
+                                           initargs=(fx, tasks))
+            except TypeError:
+                pool = ProcessPoolExecutor(nworkers)
+            try:
+                futures = [pool.submit(_run_task, i)
+                           for i in range(len(tasks))]
+                for future in futures:
+                    yield future.result()
+            finally:
+                pool.shutdown(wait=True)
+        finally:
+            _init_worker(None, None)
+
+
+
+parallel_backends = {
+    'serial': SerialExecutor,
+    'pprocess': PProcessExecutor,
+    'multiprocessing': MultiprocessingExecutor,
+    'threads': ThreadExecutor,
+    'joblib': JoblibExecutor,
+    'futures': FuturesExecutor,
+    }
+"""Known executors.  Custom executors could be registered here as well"""
+
+
+def _get_default_backend():
+    # pprocess remains the default for the sake of consistent behavior
+    return 'pprocess' if externals.exists('pprocess') else 'multiprocessing'
+
+
+def get_nproc(nproc=None, backend=None):
+    """Figure out how many workers to use
+
+    Parameters
+    ----------
+    nproc : None or int
+      Requested number of workers.  If None -- all available cores, but
+      only if `backend` was specified or the default 'pprocess' backend is
+      available (otherwise 1, as it always was).
+    backend : None or str or Executor
+    """
+    if nproc is not None:
+        return nproc
+    if isinstance(backend, Executor):
+        return backend.nproc
+    if backend is None:
+        if not externals.exists('pprocess'):
+            return 1
+        backend = 'pprocess'
+    return get_executor(backend).nproc
+
+
+def get_executor(backend=None, nproc=None):
+    """Provide an executor instance
+
+    Parameters
+    ----------
+    backend : None or str or Executor
+      Name of the backend (one of the `parallel_backends`) or an instance of
+      an executor which is returned as is.  If None -- 'pprocess' if it is
+      available, 'multiprocessing' otherwise.
+    nproc : None or int
+      Number of workers to use.  If None -- all available cores.
+    """
+    if isinstance(backend, Executor):
+        return backend
+    if backend is None:
+        backend = _get_default_backend()
+    try:
+        cls = parallel_backends[backend.lower()]
+    except KeyError:
+        raise ValueError("Unknown parallel backend %r. Known are: %s"
+                         % (backend, ', '.join(sorted(parallel_backends))))
+    return cls(nproc=nproc)
+
+
+def get_blocks(ids, nproc, nblocks=None, min_size=None):
+    """Split ids into blocks to be processed by the workers
+
+    Parameters
+    ----------
+    ids : sequence
+    nproc : int
+      Number of workers the blocks are destined for.
+    nblocks : None or int
+      If provided, `ids` are split into that many equally sized blocks.
+      Otherwise (guided scheduling) block sizes decrease progressively, so
+      that the workers which are done with their (cheaper) blocks could pick
+      up the remaining small ones while the others still work on theirs.
+    min_size : None or int
+      The smallest size of a block in guided scheduling.  By default 1/16th
+      of the share of a single worker.
+
+    Returns
+    -------
+    list of arrays
+    """
+    ids = np.asanyarray(ids)
+    if nblocks is not None:
+        return np.array_split(ids, nblocks)
+    n = len(ids)
+    if nproc <= 1 or n <= nproc:
+        return np.array_split(ids, max(1, min(n, nproc)))
+    if min_size is None:
+        min_size = max(1, n // (16 * nproc))
+    blocks = []
+    start = 0
+    while start < n:
+        size = max(min_size, int(np.ceil((n - start) / (2. * nproc))))
+        blocks.append(ids[start:start + size])
+        start += size
+    return blocks
+
+
+#
+# Shared memory
+#
+
+# arrays mapped within this process, keyed by the filename
+_shared_roots = {}
+
+
+def _get_shared_dir():
+    # POSIX shared memory is exposed as a filesystem on Linux
+    return '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+class SharedArray(np.ndarray):
+    """Array residing in a memory-mapped file
+
+    Whenever pickled (e.g. to be sent to a worker process), it gets
+    passed as a reference to the file, so the worker maps the same memory
+    instead of receiving a copy.  Pickled copies (and results of
+    computations) carry the data as usual.
+    """
+
+    def __array_finalize__(self, obj):
+        self._shared_info = getattr(obj, '_shared_info', None)
+
+
+    def __reduce__(self):
+        info = self._shared_info
+        if info is not None:
+            filename, mode, dtype, shape, ptr, nbytes = info
+            low, high = np.byte_bounds(self)
+            if low >= ptr and high <= ptr + nbytes:
+                offset = self.__array_interface__['data'][0] - ptr
+                return (_attach_shared_array,
+                        (filename, mode, dtype, shape,
+                         offset, self.dtype, self.shape, self.strides))
+        # not (entirely) within the mapped memory -- pass by value
+        return np.asarray(self).__reduce__()
+
+
+
+def _map_shared_array(filename, mode, dtype, shape):
+    root = np.memmap(filename, dtype=dtype, mode=mode,
+                     shape=shape).view(SharedArray)
+    root._shared_info = (filename, mode, dtype, shape,
+                         root.__array_interface__['data'][0], root.nbytes)
+    if mode == 'r':
+        root.flags.writeable = False
+    _shared_roots[filename] = root
+    return root
+
+
+def _attach_shared_array(filename, mode, dtype, shape,
+                         offset, vdtype, vshape, vstrides):
+    """Attach to a shared array and provide a view of it"""
+    root = _shared_roots.get(filename)
+    if root is None or root._shared_info[:4] != (filename, mode, dtype, shape):
+        root = _map_shared_array(filename, mode, dtype, shape)
+    view = np.ndarray(vshape, dtype=vdtype, buffer=root, offset=offset,
+                      strides=vstrides).view(SharedArray)
+    view._shared_info = root._shared_info
+    if mode == 'r':
+        view.flags.writeable = False
+    return view
+
+
+def share_array(a=None, shape=None, dtype=None, readonly=True,
+                prefix='tmpshared', dir=None):
+    """Place an array into shared memory
+
+    Parameters
+    ----------
+    a : array, optional
+      Array to be copied into shared memory.  If None, a zero-filled array
+      of `shape` and `dtype` is allocated.
+    shape : tuple, optional
+    dtype : dtype, optional
+    readonly : bool
+      Whether the array should be made read-only.  Otherwise modifications
+      done by any process are visible to all others.
+    prefix : str
+      Prefix for the file backing the memory (might include a path).
+    dir : str, optional
+      Directory for the file.  By default /dev/shm if it exists, and the
+      system's temporary directory otherwise.
+
+    Returns
+    -------
+    SharedArray
+      Has to be passed to `release_shared` whenever not needed any longer.
+    """
+    if a is not None:
+        a = np.asanyarray(a)
+        shape, dtype = a.shape, a.dtype
+    dtype = np.dtype(dtype)
+    if dtype.hasobject:
+        raise ValueError("Arrays of objects cannot be shared (dtype=%s)"
+                         % dtype)
+    shape = tuple(shape)
+    if dir is None and not os.path.dirname(prefix):
+        dir = _get_shared_dir()
+    fd, filename = tempfile.mkstemp(prefix=prefix, suffix='.shm', dir=dir)
+    os.close(fd)
+    if not np.prod(shape, dtype=int) or not dtype.itemsize:
+        # nothing to be mapped
+        os.unlink(filename)
+        return np.zeros(shape, dtype=dtype) if a is None else a
+    out = np.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+    if a is not None:
+        out[...] = a
+    out.flush()
+    del out
+    if __debug__:
+        debug('PAR', "Shared array of shape %s and dtype %s in %s"
+              % (shape, dtype, filename))
+    # attach as others would do
+    return _map_shared_array(filename, 'r' if readonly else 'r+',
+                             dtype, shape)
+
+
+def share_dataset(ds, **kwargs):
+    """Shallow copy of a dataset with its samples and feature attributes
+    placed into shared memory
+
+    Attributes which cannot be shared (e.g. of dtype object) are left
+    untouched.
+
+    Parameters
+    ----------
+    ds : Dataset
+    **kwargs
+      Passed to `share_array`.
+
+    Returns
+    -------
+    Dataset, list of SharedArray
+      The latter has to be passed to `release_shared` whenever not needed
+      any longer.
+    """
+    out = ds.copy(deep=False)
+    shared = []
+    def _share(value):
+        if not isinstance(value, np.ndarray) or value.dtype.hasobject \
+                or isinstance(value, SharedArray):
+            return value
+        value = share_array(value, **kwargs)
+        if isinstance(value, SharedArray):
+            shared.append(value)
+        return value
+
+    out.samples = _share(ds.samples)
+    for k in out.fa.keys():
+        out.fa[k].value = _share(ds.fa[k].value)
+    return out, shared
+
+
+def release_shared(arrays):
+    """Release the memory of shared arrays once they are no longer needed
+
+    Already attached processes could still access the memory, as long as
+    they hold the references.
+    """
+    if isinstance(arrays, np.ndarray):
+        arrays = [arrays]
+    for a in arrays:
+        info = getattr(a, '_shared_info', None)
+        if info is None:
+            continue
+        filename = info[0]
+        _shared_roots.pop(filename, None)
+        try:
+            os.unlink(filename)
+        except OSError, e:
+            if os.path.exists(filename):
+                warning("Failed to remove shared memory file %s: %s"
+                        % (filename, e))
@@ -66,7 +66,7 @@ class kNN(Classifier):
     __tags__ = ['knn', 'non-linear', 'binary', 'multiclass', 'oneclass']
 
     def __init__(self, k=2, dfx=squared_euclidean_distance,
-                 voting='weighted', **kwargs):
+                 voting='weighted', chunk_size=None, **kwargs):
         """
         Parameters
         ----------
@@ -80,6 +80,10 @@ class kNN(Classifier):
           Possible values are 'majority' (simple majority of classes
           determines vote) and 'weighted' (votes are weighted according to the
           relative frequencies of each class in the training data).
+        chunk_size : None or int
+          Number of test samples to compute distances for at once.  Limits
+          the memory footprint while predicting large test sets.  If None,
+          all test samples are processed at once.
         **kwargs
           Additional arguments are passed to the base class.
         """
@@ -90,8 +94,10 @@ class kNN(Classifier):
         self.__k = k
         self.__dfx = dfx
         self.__voting = voting
+        self.__chunk_size = chunk_size
         self.__data = None
         self.__weights = None
+        self.__labels_idx = None
 
 
     def __repr__(self, prefixes=None): # pylint: disable-msg=W0102
@@ -102,6 +108,8 @@ class kNN(Classifier):
         return super(kNN, self).__repr__(
             ["k=%d" % self.__k, "dfx=%s" % self.__dfx,
              "voting=%s" % repr(self.__voting)]
+            + (self.__chunk_size is not None
+               and ["chunk_size=%d" % self.__chunk_size] or [])
             + prefixes)
 
 
@@ -127,27 +135,20 @@ class kNN(Classifier):
                         "Overflow on arithmetic operations might result in"+\
                         " errors. Please convert dataset's samples into" +\
                         " floating datatype if any error is reported.")
+        # index of each training sample's label among the unique ones
+        label_index = dict(zip(uniquelabels, xrange(Nuniquelabels)))
+        self.__labels_idx = np.array([label_index[l] for l in labels],
+                                     dtype=int)
+
         if self.__voting == 'weighted':
-            self.__labels = labels.copy()
             Nlabels = len(labels)
-
-            # TODO: To get proper speed up for the next line only,
-            #       histogram should be computed
-            #       via sorting + counting "same" elements while reducing.
-            #       Guaranteed complexity is NlogN whenever now it is N^2
             # compute the relative proportion of samples belonging to each
-            # class (do it in one loop to improve speed and reduce readability
-            weights = \
-                [ 1.0 - ((labels == label).sum() / Nlabels) \
-                    for label in uniquelabels ]
-            self.__weights = dict(zip(uniquelabels, weights))
+            # class
+            counts = np.bincount(self.__labels_idx, minlength=Nuniquelabels)
+            self.__weights = 1.0 - (counts / Nlabels)
         else:
             self.__weights = None
 
-        # create dictionary with an item for each condition
-        self.__votes_init = dict(zip(uniquelabels,
-                                     [0] * Nuniquelabels))
-
 
     @accepts_dataset_as_samples
     def _predict(self, data):
@@ -172,78 +173,96 @@ class kNN(Classifier):
                 raise ValueError, "Length of data samples (features) does " \
                                   "not match the classifier."
 
-        # compute the distance matrix between training and test data with
-        # distances stored row-wise, i.e. distances between test sample [0]
-        # and all training samples will end up in row 0
-        dists = self.__dfx(self.__data.samples, data).T
-        if self.ca.is_enabled('distances'):
-            # .sa.copy() now does deepcopying by default
-            self.ca.distances = Dataset(dists, fa=self.__data.sa.copy())
-
-        # determine the k nearest neighbors per test sample
-        knns = dists.argsort(axis=1)[:, :self.__k]
-
-        # predictions and votes for all samples
-        all_votes, predictions = [], []
-        for inns, nns in enumerate(knns):
-            votes = self.__votes_init.copy()
-            # TODO: optimize!
-            for nn in nns:
-                votes[labels[nn]] += 1
-
-            # optionally weight votes
-            if self.__voting == 'majority':
-                pass
-            elif self.__voting == 'weighted':
-                # TODO: optimize!
-                for ul in uniquelabels:
-                    votes[ul] *= self.__weights[ul]
-            else:
-                raise ValueError, "kNN told to perform unknown voting '%s'." \
-                      % self.__voting
-
-            # reverse dictionary items and sort them to get the
-            # winners
-            # It would be more expensive than just to look for
-            # the maximum, but this piece should be the least
-            # cpu-intensive while distances computation should consume
-            # the most. Also it would allow to look and break the ties
-            votes_reversed = sorted([(v, k) for k, v in votes.iteritems()],
-                                    reverse=True)
-            # check for ties
-            max_vote, max_vote_label = votes_reversed[0]
-
-            if len(votes_reversed) > 1 and max_vote == votes_reversed[1][0]:
-                # figure out all ties and break them based on the mean
-                # distance
-                # TODO: theoretically we could break out of the loop earlier
-                ties = [x[1] for x in votes_reversed if x[0] == max_vote]
-
-                # compute mean distances to the corresponding clouds
-                # restrict analysis only to k-nn's
-                nns_labels = labels[nns]
-                nns_dists = dists[inns][nns]
-                ties_dists = [np.mean(nns_dists[nns_labels == t]) for t in ties]
-                max_vote_label = ties[np.argmin(ties_dists)]
-                if __debug__:
-                    debug('KNN',
-                          'Ran into the ties: %s with votes: %s, dists: %s, max_vote %r',
-                          (ties, votes_reversed, ties_dists, max_vote_label))
-
+        if not self.__voting in ('majority', 'weighted'):
+            raise ValueError, "kNN told to perform unknown voting '%s'." \
+                  % self.__voting
+
+        chunk_size = self.__chunk_size
+        if chunk_size is None:
+            chunk_size = max(len(data), 1)
+        store_dists = self.ca.is_enabled('distances')
+
+        all_dists, all_votes, predictions = [], [], []
+        for start in xrange(0, len(data), chunk_size):
+            # compute the distance matrix between training and test data
+            # with distances stored row-wise, i.e. distances between test
+            # sample [0] and all training samples will end up in row 0
+            dists = self.__dfx(self.__data.samples,
+                               data[start:start + chunk_size]).T
+            if store_dists:
+                all_dists.append(dists)
+            votes, winners = self.__vote(dists, uniquelabels)
             all_votes.append(votes)
-            predictions.append(max_vote_label)
+            predictions.extend(uniquelabels[winners])
+
+        if store_dists:
+            # .sa.copy() now does deepcopying by default
+            self.ca.distances = Dataset(np.vstack(all_dists),
+                                        fa=self.__data.sa.copy())
 
         # store the predictions in the state. Relies on State._setitem to do
         # nothing if the relevant state member is not enabled
         self.ca.predictions = predictions
-        self.ca.estimates = all_votes # np.array([r[1] for r in results])
+        if self.ca.is_enabled('estimates'):
+            self.ca.estimates = [dict(zip(uniquelabels, v))
+                                 for votes in all_votes
+                                 for v in votes.tolist()]
 
         return predictions
 
+
+    def __vote(self, dists, uniquelabels):
+        """Votes per class and the winning class index for each test sample
+        """
+        nsamples, ntrain = dists.shape
+        nlabels = len(uniquelabels)
+        k = min(self.__k, ntrain)
+
+        # determine the k nearest neighbors per test sample -- their order
+        # is irrelevant for voting
+        if k < ntrain:
+            knns = np.argpartition(dists, k - 1, axis=1)[:, :k]
+        else:
+            knns = np.tile(np.arange(ntrain), (nsamples, 1))
+        rows = np.arange(nsamples)[:, None]
+        nns_dists = dists[rows, knns]
+
+        # count votes (and sum distances) of the neighbors per class
+        bins = (rows * nlabels + self.__labels_idx[knns]).ravel()
+        counts = np.bincount(bins, minlength=nsamples * nlabels)\
+                   .reshape(nsamples, nlabels)
+        sum_dists = np.bincount(bins, weights=nns_dists.ravel(),
+                                minlength=nsamples * nlabels)\
+                      .reshape(nsamples, nlabels)
+
+        # optionally weight votes
+        if self.__voting == 'weighted':
+            votes = counts * self.__weights
+        else:
+            votes = counts
+
+        # ties are broken by the minimal mean distance to the corresponding
+        # k-neighbors, and then in favor of the "largest" label
+        ties = votes == votes.max(axis=1)[:, None]
+        tie_dists = np.empty(votes.shape)
+        tie_dists.fill(np.inf)
+        tie_dists[ties] = sum_dists[ties] / np.maximum(counts[ties], 1)
+        winners = nlabels - 1 - np.argmin(tie_dists[:, ::-1], axis=1)
+
+        if __debug__ and 'KNN' in debug.active:
+            for i in np.where(ties.sum(axis=1) > 1)[0]:
+                debug('KNN',
+                      'Ran into the ties: %s with votes: %s, dists: %s, '
+                      'max_vote %r',
+                      (uniquelabels[ties[i]], votes[i], tie_dists[i],
+                       uniquelabels[winners[i]]))
+        return votes, winners
+
     def _untrain(self):
         """Reset trained state"""
         self.__data = None
         self.__weights = None
+        self.__labels_idx = None
         super(kNN, self)._untrain()
 
     dfx = property(fget=lambda self: self.__dfx)
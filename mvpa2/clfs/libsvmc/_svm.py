@@ -217,22 +217,35 @@ class SVMProblem:
         self.size = size = len(y)
 
         self.y_array = y_array = svmc.new_double(size)
-        for i in xrange(size):
-            svmc.double_setitem(y_array, i, y[i])
-
         self.x_matrix = x_matrix = svmc.svm_node_matrix(size)
-        data = [None for i in xrange(size)]
-        maxlen = 0
-        for i in xrange(size):
-            x_i = x[i]
-            lx_i = len(x_i)
-            data[i] = d = seq_to_svm_node(x_i)
-            svmc.svm_node_matrix_set(x_matrix, i, d)
-            if isinstance(x_i, dict):
-                if (lx_i > 0):
-                    maxlen = max(maxlen, max(x_i.keys()))
-            else:
-                maxlen = max(maxlen, lx_i)
+        # single block of nodes for all samples of dense data
+        self.block = None
+        if isinstance(x, np.ndarray) and x.ndim == 2:
+            # convert all samples (and labels) at once
+            x = np.ascontiguousarray(x, dtype=np.float64)
+            svmc.double_array_set_all(
+                y_array, np.ascontiguousarray(y, dtype=np.float64))
+            self.block = svmc.svm_node_block(x)
+            svmc.svm_node_matrix_set_block(x_matrix, self.block,
+                                           size, x.shape[1])
+            data = []
+            maxlen = x.shape[1]
+        else:
+            for i in xrange(size):
+                svmc.double_setitem(y_array, i, y[i])
+
+            data = [None for i in xrange(size)]
+            maxlen = 0
+            for i in xrange(size):
+                x_i = x[i]
+                lx_i = len(x_i)
+                data[i] = d = seq_to_svm_node(x_i)
+                svmc.svm_node_matrix_set(x_matrix, i, d)
+                if isinstance(x_i, dict):
+                    if (lx_i > 0):
+                        maxlen = max(maxlen, max(x_i.keys()))
+                else:
+                    maxlen = max(maxlen, lx_i)
 
         # bind to instance
         self.data = data
@@ -253,8 +266,10 @@ class SVMProblem:
         del self.prob
         if svmc is not None:
             svmc.delete_double(self.y_array)
-        for i in range(self.size):
-            svmc.svm_node_array_destroy(self.data[i])
+        for d in self.data:
+            svmc.svm_node_array_destroy(d)
+        if self.block is not None:
+            svmc.svm_node_array_destroy(self.block)
         svmc.svm_node_matrix_destroy(self.x_matrix)
         del self.data
         del self.x_matrix
@@ -344,9 +359,33 @@ class SVMModel:
         return ret
 
 
-    ##REF: Name was automagically refactored
-    def predict_values(self, x):
-        v = self.predict_values_raw(x)
+    def predict_batch(self, x):
+        """Predict labels and raw decision values for all rows of a matrix
+
+        Unlike calling `predict` and `predict_values_raw` for every sample,
+        all of them are processed within a single call into libsvm.
+
+        Returns
+        -------
+        labels : array
+          Predicted label per sample.
+        values : array
+          Decision values (as returned by `predict_values_raw`), one row
+          per sample.
+        """
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        if x.ndim != 2:
+            raise ValueError("Expected a 2D array of samples, got shape %s"
+                             % (x.shape,))
+        n = self.nr_class*(self.nr_class-1)//2
+        labels = np.empty(len(x))
+        values = np.empty((len(x), n))
+        svmc.svm_predict_values_block(self.model, x, labels, values)
+        return labels, values
+
+
+    def values_from_raw(self, v):
+        """Convert raw decision values into those of `predict_values`"""
         if self.svm_type == NU_SVR \
            or self.svm_type == EPSILON_SVR \
            or self.svm_type == ONE_CLASS:
@@ -362,6 +401,11 @@ class SVMModel:
             return  d
 
 
+    ##REF: Name was automagically refactored
+    def predict_values(self, x):
+        return self.values_from_raw(self.predict_values_raw(x))
+
+
     ##REF: Name was automagically refactored
     def predict_probability(self, x):
         #c code will do nothing on wrong type, so we have to check ourself
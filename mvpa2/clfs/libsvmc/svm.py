@@ -40,7 +40,8 @@ from mvpa2.clfs.libsvmc.svmc import \
      PRECOMPUTED, ONE_CLASS
 
 def _data2ls(data):
-    return np.asarray(data).astype(float)
+    # contiguous doubles can be handed to libsvm in a single block
+    return np.ascontiguousarray(data, dtype=np.float64)
 
 class SVM(_SVM):
     """Support Vector Machine Classifier.
@@ -205,11 +206,13 @@ class SVM(_SVM):
         src = _data2ls(data)
         ca = self.ca
 
-        predictions = [ self.model.predict(p) for p in src ]
+        # labels and decision values for all samples in a single pass
+        predictions, values = self.model.predict_batch(src)
+        predictions = predictions.tolist()
 
         if ca.is_enabled('estimates'):
             if self.__is_regression__:
-                estimates = [ self.model.predict_values_raw(p)[0] for p in src ]
+                estimates = values[:, 0].tolist()
             else:
                 # if 'trained_targets' are literal they have to be mapped
                 if ( np.issubdtype(self.ca.trained_targets.dtype, 'c') or
@@ -219,19 +222,13 @@ class SVM(_SVM):
                 else:
                     trained_targets = self.ca.trained_targets
                 nlabels = len(trained_targets)
-                # XXX We do duplicate work. model.predict calls
-                # predict_values_raw internally and then does voting or
-                # thresholding. So if speed becomes a factor we might
-                # want to move out logic from libsvm over here to base
-                # predictions on obtined values, or adjust libsvm to
-                # spit out values from predict() as well
                 if nlabels == 2 and self._svm_impl != 'ONE_CLASS':
                     # Apperently libsvm reorders labels so we need to
                     # track (1,0) values instead of (0,1) thus just
                     # lets take negative reverse
-                    estimates = [ self.model.predict_values(p)[(trained_targets[1],
-                                                            trained_targets[0])]
-                               for p in src ]
+                    sign = self.model.values_from_raw([1.0])[
+                        (trained_targets[1], trained_targets[0])]
+                    estimates = sign * values[:, 0]
                     if len(estimates) > 0:
                         if __debug__:
                             debug("SVM",
@@ -241,7 +238,8 @@ class SVM(_SVM):
                 else:
                     # In multiclass we return dictionary for all pairs
                     # of labels, since libsvm does 1-vs-1 pairs
-                    estimates = [ self.model.predict_values(p) for p in src ]
+                    estimates = [ self.model.values_from_raw(v)
+                                  for v in values ]
             ca.estimates = estimates
 
         if ca.is_enabled("probabilities"):
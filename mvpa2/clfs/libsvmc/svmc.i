@@ -101,6 +101,19 @@ static PyObject* doubleppcarray2numpy_array(double** carray, int rows, int cols)
 	return PyArray_Return ( (PyArrayObject*) array	);
 }
 
+/* fill nodes (terminated by index -1) for a dense row of values */
+static void dense_row2svm_nodes(struct svm_node *nodes, const double *row, int cols)
+{
+	int j;
+	for (j = 0; j < cols; ++j)
+	{
+		nodes[j].index = j;
+		nodes[j].value = row[j];
+	}
+	nodes[cols].index = -1;
+	nodes[cols].value = 0.0;
+}
+
 /* rely on built-in facility to control verbose output
  * in the versions of libsvm >= 2.89
  */
@@ -279,6 +292,77 @@ void svm_node_matrix_destroy(struct svm_node **matrix)
 	free(matrix);
 }
 
+/* Bulk conversion of dense data.  All arrays passed below must be
+ * C-contiguous arrays of doubles (assured on the Python side). */
+
+/* allocate and fill nodes for all rows of a 2D array in a single block,
+ * (cols + 1) nodes per row */
+struct svm_node *svm_node_block(PyObject *x)
+{
+	PyArrayObject *a = (PyArrayObject*) x;
+	int rows = (int) PyArray_DIM(a, 0);
+	int cols = (int) PyArray_DIM(a, 1);
+	const double *data = (const double *) PyArray_DATA(a);
+	struct svm_node *block = (struct svm_node *)malloc(
+		sizeof(struct svm_node) * rows * (cols + 1));
+	int i;
+	if (!block)
+		return NULL;
+	for (i = 0; i < rows; ++i)
+		dense_row2svm_nodes(block + i * (cols + 1), data + i * cols, cols);
+	return block;
+}
+
+/* point rows of a node matrix into a block allocated by svm_node_block */
+void svm_node_matrix_set_block(struct svm_node **matrix, struct svm_node *block,
+							   int rows, int cols)
+{
+	int i;
+	for (i = 0; i < rows; ++i)
+		matrix[i] = block + i * (cols + 1);
+}
+
+/* copy all values of an array into a double array */
+void double_array_set_all(double *array, PyObject *values)
+{
+	PyArrayObject *a = (PyArrayObject*) values;
+	memcpy(array, PyArray_DATA(a), sizeof(double) * PyArray_SIZE(a));
+}
+
+/* predict labels and decision values for all rows of a 2D array.
+ * values must have one row per sample with a column per decision value */
+void svm_predict_values_block(const struct svm_model *model, PyObject *x,
+							  PyObject *labels, PyObject *values)
+{
+	PyArrayObject *a = (PyArrayObject*) x;
+	int rows = (int) PyArray_DIM(a, 0);
+	int cols = (int) PyArray_DIM(a, 1);
+	int nvalues = (int) PyArray_DIM((PyArrayObject*) values, 1);
+	const double *data = (const double *) PyArray_DATA(a);
+	double *labels_ = (double *) PyArray_DATA((PyArrayObject*) labels);
+	double *values_ = (double *) PyArray_DATA((PyArrayObject*) values);
+	/* libsvm might write a decision value even if none was expected */
+	double *decvalues = (double *)malloc(sizeof(double) * (nvalues + 1));
+	struct svm_node *nodes = (struct svm_node *)malloc(
+		sizeof(struct svm_node) * (cols + 1));
+	int i, j;
+	for (i = 0; i < rows; ++i)
+	{
+		dense_row2svm_nodes(nodes, data + i * cols, cols);
+#if LIBSVM_VERSION >= 300
+		/* label is returned right away */
+		labels_[i] = svm_predict_values(model, nodes, decvalues);
+#else
+		svm_predict_values(model, nodes, decvalues);
+		labels_[i] = svm_predict(model, nodes);
+#endif
+		for (j = 0; j < nvalues; ++j)
+			values_[i * nvalues + j] = decvalues[j];
+	}
+	free(nodes);
+	free(decvalues);
+}
+
 void svm_destroy_model_helper(svm_model *model_ptr)
 {
 #if LIBSVM_VERSION >= 300
@@ -131,6 +131,15 @@ class SMLR(Classifier):
              doc="""Seed to be used to initialize random generator, might be
              used to replicate the run""")
 
+    warm_start = Parameter(False, constraints='bool',
+             doc="""Whether to start the stepwise regression from the weights
+             of the previous training instead of from zero.  This speeds up
+             consecutive trainings on similar data (e.g. cross-validation
+             folds, permutations, or a sequence of `lm` values).  Weights
+             are reused only if the set of labels matches and either the
+             number of features is unchanged, or features can be matched by
+             their `origids` feature attribute (e.g. in RFE).""")
+
     unsparsify = Parameter(False, constraints='bool',
              doc="""***EXPERIMENTAL*** Whether to unsparsify the weights via
              regression. Note that it likely leads to worse classifier
@@ -166,6 +175,12 @@ class SMLR(Classifier):
         """Just the weights, without the biases"""
         self.__biases = None
         """The biases, will remain none if has_bias is False"""
+        self.__last_fit = None
+        """Labels, feature ids and weights of the last training to warm
+        start from"""
+        self.__precomputed = None
+        """Storage for training data and its statistics while reused
+        across trainings (see `regularization_path`)"""
 
 
     ##REF: Name was automagically refactored
@@ -331,34 +346,8 @@ class SMLR(Classifier):
         Y = labels
         M = len(self._ulabels)
 
-        # get the dataset information into easy vars
-        X = dataset.samples
-
-        # see if we are adding a bias term
-        if self.params.has_bias:
-            if __debug__:
-                debug("SMLR_", "hstacking 1s for bias")
-
-            # append the bias term to the features
-            X = np.hstack((X, np.ones((X.shape[0], 1), dtype=X.dtype)))
-
         if self.params.implementation.upper() == 'C':
             _stepwise_regression = _cStepwiseRegression
-            #
-            # TODO: avoid copying to non-contig arrays, use strides in ctypes?
-            if not (X.flags['C_CONTIGUOUS'] and X.flags['ALIGNED']):
-                if __debug__:
-                    debug("SMLR_",
-                          "Copying data to get it C_CONTIGUOUS/ALIGNED")
-                X = np.array(X, copy=True, dtype=np.double, order='C')
-
-            # currently must be double for the C code
-            if X.dtype != np.double:
-                if __debug__:
-                    debug("SMLR_", "Converting data to double")
-                # must cast to double
-                X = X.astype(np.double)
-
         # set the feature dimensions
         elif self.params.implementation.upper() == 'PYTHON':
             _stepwise_regression = self._python_stepwise_regression
@@ -367,25 +356,38 @@ class SMLR(Classifier):
                   "Unknown implementation %s of stepwise_regression" %
                   self.params.implementation)
 
-        # set the feature dimensions
-        ns, nd = X.shape
-
         # decide the size of weights based on num classes estimated
         if self.params.fit_all_weights:
             c_to_fit = M
         else:
             c_to_fit = M - 1
 
-        # Precompute what we can
-        auto_corr = ((M - 1.) / (2. * M)) * (np.sum(X * X, 0))
-        XY = np.dot(X.T, Y[:, :c_to_fit])
+        if self.__precomputed:
+            # same data as in the previous training
+            X, auto_corr, XY = self.__precomputed
+        else:
+            X = self._get_training_samples(dataset)
+            # Precompute what we can
+            auto_corr = ((M - 1.) / (2. * M)) * (np.sum(X * X, 0))
+            XY = np.dot(X.T, Y[:, :c_to_fit])
+            if self.__precomputed is not None:
+                self.__precomputed = (X, auto_corr, XY)
         lambda_over_2_auto_corr = (self.params.lm/2.)/auto_corr
 
+        # set the feature dimensions
+        ns, nd = X.shape
+
         # set starting values
-        w = np.zeros((nd, c_to_fit), dtype=np.double)
-        Xw = np.zeros((ns, c_to_fit), dtype=np.double)
-        E = np.ones((ns, c_to_fit), dtype=np.double)
-        S = M * np.ones(ns, dtype=np.double)
+        w = self._get_initial_weights(dataset, nd, c_to_fit)
+        if w.any():
+            Xw = np.dot(X, w)
+            E = np.exp(Xw)
+            # not fitted classes contribute exp(0)
+            S = np.sum(E, axis=1) + (M - c_to_fit)
+        else:
+            Xw = np.zeros((ns, c_to_fit), dtype=np.double)
+            E = np.ones((ns, c_to_fit), dtype=np.double)
+            S = M * np.ones(ns, dtype=np.double)
 
         # set verbosity
         if __debug__:
@@ -417,6 +419,13 @@ class SMLR(Classifier):
                 "More than %d iterations without convergence" %
                 self.params.maxiter)
 
+        if self.params.warm_start:
+            self.__last_fit = (
+                self._ulabels,
+                dataset.fa.origids if 'origids' in dataset.fa else None,
+                dataset.nfeatures,
+                w.copy())
+
         # see if unsparsify the weights
         if self.params.unsparsify:
             # unsparsify
@@ -465,6 +474,113 @@ class SMLR(Classifier):
                   "min:max(data)=%f:%f, got min:max(w)=%f:%f" %
                   (np.min(X), np.max(X), np.min(w), np.max(w)))
 
+    def _get_training_samples(self, dataset):
+        """Return samples (with the bias column) ready for the regression
+        """
+        # get the dataset information into easy vars
+        X = dataset.samples
+
+        # see if we are adding a bias term
+        if self.params.has_bias:
+            if __debug__:
+                debug("SMLR_", "hstacking 1s for bias")
+
+            # append the bias term to the features
+            X = np.hstack((X, np.ones((X.shape[0], 1), dtype=X.dtype)))
+
+        if self.params.implementation.upper() == 'C':
+            #
+            # TODO: avoid copying to non-contig arrays, use strides in ctypes?
+            if not (X.flags['C_CONTIGUOUS'] and X.flags['ALIGNED']):
+                if __debug__:
+                    debug("SMLR_",
+                          "Copying data to get it C_CONTIGUOUS/ALIGNED")
+                X = np.array(X, copy=True, dtype=np.double, order='C')
+
+            # currently must be double for the C code
+            if X.dtype != np.double:
+                if __debug__:
+                    debug("SMLR_", "Converting data to double")
+                # must cast to double
+                X = X.astype(np.double)
+        return X
+
+
+    def _get_initial_weights(self, dataset, nd, c_to_fit):
+        """Starting weights: zeros or those of the previous training
+        """
+        w = np.zeros((nd, c_to_fit), dtype=np.double)
+        if not self.params.warm_start or self.__last_fit is None:
+            return w
+        ulabels, origids, nfeatures_last, w_last = self.__last_fit
+        if w_last.shape[1] != c_to_fit \
+           or not np.array_equal(ulabels, self._ulabels):
+            if __debug__:
+                debug("SMLR_", "Labels do not match, no warm start")
+            return w
+        nfeatures = dataset.nfeatures
+        if origids is not None and 'origids' in dataset.fa:
+            # match features by their ids (e.g. after feature selection)
+            index = dict((f, i) for i, f in enumerate(origids))
+            rows = np.array([index.get(f, -1) for f in dataset.fa.origids],
+                            dtype=int)
+            found = rows >= 0
+            w[:nfeatures][found] = w_last[rows[found]]
+        elif nfeatures == nfeatures_last:
+            w[:nfeatures] = w_last[:nfeatures]
+        else:
+            if __debug__:
+                debug("SMLR_", "Features do not match, no warm start")
+            return w
+        if nd > nfeatures and len(w_last) > nfeatures_last:
+            # both have biases
+            w[-1] = w_last[-1]
+        if __debug__:
+            debug("SMLR_", "Warm start from %d non-zero weights"
+                  % np.sum(w != 0))
+        return w
+
+
+    def regularization_path(self, dataset, lms):
+        """Train on a sequence of penalty values, each warm started
+        from the solution for the previous (larger) one.
+
+        The training samples and their statistics are computed only
+        once.  Afterwards the classifier remains trained with the
+        smallest value, which is also assigned to the `lm` parameter.
+
+        Parameters
+        ----------
+        dataset : Dataset
+          Training dataset.
+        lms : sequence of float
+          Values of the penalty term lambda.  They are processed in
+          descending order.
+
+        Returns
+        -------
+        list of tuples
+          (lm, weights, biases) for each lm in descending order, where
+          biases are None if `has_bias` is False.
+        """
+        path = []
+        warm_start = self.params.warm_start
+        self.params.warm_start = True
+        # trigger storage of precomputed values
+        self.__precomputed = ()
+        try:
+            for lm in sorted(lms, reverse=True):
+                self.params.lm = lm
+                self.train(dataset)
+                biases = self.__biases
+                path.append((lm, self.__weights.copy(),
+                             biases.copy() if biases is not None else None))
+        finally:
+            self.params.warm_start = warm_start
+            self.__precomputed = None
+        return path
+
+
     def _unsparsify_weights(self, samples, weights):
         """Unsparsify weights via least squares regression."""
         # allocate for the new weights
@@ -12,15 +12,19 @@ from __future__ import with_statement   # Let's start using with
 
 __docformat__ = 'restructuredtext'
 
+import copy
 import warnings
 
 import numpy as np
 
 from mvpa2.base import externals, warning
+from mvpa2.base.parallel import SerialExecutor, get_executor, get_nproc, \
+     get_blocks
 from mvpa2.base.state import ClassWithCollections, ConditionalAttribute
 from mvpa2.generators.permutation import AttributePermutator
 from mvpa2.base.types import is_datasetlike
 from mvpa2.datasets import Dataset
+from mvpa2.misc.support import get_rng
 
 if __debug__:
     from mvpa2.base import debug
@@ -120,6 +124,97 @@ class Nonparametric(object):
                          np.vectorize(lambda v: (self._dist_samples >= v).mean()))
 
 
+class FeaturewiseNonparametric(object):
+    """Non-parametric distributions for many elements at once.
+
+    Equivalent to a sequence of `Nonparametric` distributions, one per
+    column of `dist_samples`, but all columns are sorted once upon
+    construction and cdf values for all elements are obtained with a
+    vectorized binary search instead of a Python loop over elements.
+    Indexing returns the `Nonparametric` for a single element, so
+    instances can be used wherever a list of those is expected.
+    """
+
+    def __init__(self, dist_samples, correction='clip'):
+        """
+        Parameters
+        ----------
+        dist_samples : ndarray
+          (nsamples x nelements) array of samples to be used to assess
+          the distribution of each element.
+        correction : {'clip'} or None, optional
+          See `Nonparametric`.
+        """
+        dist_samples = np.asanyarray(dist_samples)
+        if dist_samples.ndim == 1:
+            dist_samples = dist_samples[:, np.newaxis]
+        # NaNs are sorted to the end and never count as <= or >= any value
+        self._sorted = np.sort(dist_samples, axis=0)
+        self._nvalid = np.sum(~np.isnan(self._sorted), axis=0)
+        self._correction = correction
+
+    def __len__(self):
+        return self._sorted.shape[1]
+
+    def __getitem__(self, i):
+        return Nonparametric(self._sorted[:, i], correction=self._correction)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def _count_below(self, x, strict):
+        """Number of samples (strictly) below x per element
+
+        Binary search, vectorized across all elements
+        """
+        sorted_ = self._sorted
+        nsamples, nelements = sorted_.shape
+        cols = np.arange(nelements)
+        lo = np.zeros(nelements, dtype=int)
+        hi = np.empty(nelements, dtype=int)
+        hi.fill(nsamples)
+        while True:
+            active = lo < hi
+            if not np.any(active):
+                break
+            mid = (lo + hi) // 2
+            # clip so inactive elements do not index past the end
+            v = sorted_[np.minimum(mid, nsamples - 1), cols]
+            below = v < x if strict else v <= x
+            lo = np.where(active & below, mid + 1, lo)
+            hi = np.where(active & ~below, mid, hi)
+        return lo
+
+    def _cdf(self, counts):
+        res = counts / float(self._sorted.shape[0])
+        if self._correction == 'clip':
+            nsamples = self._sorted.shape[0]
+            np.clip(res, 1.0/(nsamples+2), (nsamples+1.0)/(nsamples+2), res)
+        elif self._correction is None:
+            pass
+        else:
+            raise ValueError, \
+                  '%r is incorrect value for correction parameter of %s' \
+                  % (self._correction, self.__class__.__name__)
+        return res
+
+    def cdf(self, x):
+        """Returns the cdf values at `x` (one value per element).
+        """
+        x = np.asanyarray(x).reshape((-1,))
+        return self._cdf(self._count_below(x, strict=False))
+
+    def rcdf(self, x):
+        """Returns the reverse cdf values at `x` (one value per element).
+        """
+        x = np.asanyarray(x).reshape((-1,))
+        counts = self._nvalid - self._count_below(x, strict=True)
+        # NaN in x must not be counted as matched by all valid samples
+        counts[np.isnan(x)] = 0
+        return self._cdf(counts)
+
+
 def _pvalue(x, cdf_func, rcdf_func, tail, return_tails=False, name=None):
     """Helper function to return p-value(x) given cdf and tail
 
@@ -293,6 +388,65 @@ class NullDist(ClassWithCollections):
     tail = property(fget=lambda x:x.__tail, fset=_set_tail)
 
 
+class _DistSamplesSink(object):
+    """Collects results of permutations into a preallocated array
+
+    The array is allocated (possibly memory-mapped) upon the first result,
+    so no list of all results has to be converted into an array at the
+    end.  Without a known number of results they get accumulated in a list.
+    """
+
+    def __init__(self, count, filename=None):
+        self._count = count
+        self._filename = filename
+        self._out = None
+        self._list = []
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def _allocate(self, shape, dtype):
+        shape = (self._count,) + tuple(shape)
+        if self._filename is not None:
+            self._out = np.lib.format.open_memmap(
+                self._filename, mode='w+', dtype=dtype, shape=shape)
+        else:
+            self._out = np.empty(shape, dtype=dtype)
+
+    def append(self, samples):
+        samples = np.asanyarray(samples)
+        if self._count is None:
+            self._list.append(samples)
+        else:
+            if self._out is None:
+                self._allocate(samples.shape, samples.dtype)
+            self._out[self._n] = samples
+        self._n += 1
+
+    def extend(self, samples):
+        """Store a block of results (as returned by `get`)"""
+        if not len(samples):
+            return
+        if self._count is None:
+            self._list.extend(samples)
+        else:
+            if self._out is None:
+                self._allocate(samples.shape[1:], samples.dtype)
+            self._out[self._n:self._n + len(samples)] = samples
+        self._n += len(samples)
+
+    def get(self):
+        """Array of all results -- a view of the stored ones"""
+        if self._out is None:
+            return np.asanyarray(self._list)
+        if self._filename is not None:
+            self._out.flush()
+        # trailing space of skipped permutations remains unused
+        return self._out[:self._n]
+
+
+
 class MCNullDist(NullDist):
     """Null-hypothesis distribution is estimated from randomly permuted data labels.
 
@@ -326,7 +480,8 @@ class MCNullDist(NullDist):
                       'measure has failed to evaluated at them')
 
     def __init__(self, permutator, dist_class=Nonparametric, measure=None,
-                 **kwargs):
+                 batch_size=None, nproc=1, backend=None,
+                 dist_samples_file=None, **kwargs):
         """Initialize Monte-Carlo Permutation Null-hypothesis testing
 
         Parameters
@@ -341,12 +496,39 @@ class MCNullDist(NullDist):
         measure : Measure or None
           Optional measure that is used to compute results on permuted
           data. If None, a measure needs to be passed to ``fit()``.
+        batch_size : int or None
+          If given, permuted datasets are passed to the measure's
+          ``call_batch()`` in groups of this size, so that measures capable
+          of it can share work across permutations: `OneWayAnova`
+          evaluates them in a single vectorized pass, while GNB and M1NN
+          searchlights deduce neighborhoods only once.  Other measures are
+          simply called on each permuted dataset in turn.
+        nproc : None or int
+          How many workers to distribute the permutations across.  If None
+          -- all available cores.  Requires the permutator to have a
+          `count` attribute.  Each block of permutations gets its own
+          random number generator seeded from the permutator's `rng` (or
+          the global one), so results are reproducible for a given seed
+          and `nproc`, but differ from the ones of a serial run.
+        backend : None or str or Executor
+          Parallel backend to use in case of nproc > 1 (see
+          :mod:`~mvpa2.base.parallel`).
+        dist_samples_file : None or str
+          Filename of a .npy file to store the samples of the distribution
+          in as they are computed.  The memory-mapped array is then used
+          for fitting and as `dist_samples` conditional attribute.  If
+          None, samples are stored in an array allocated upon the first
+          result.
         """
         NullDist.__init__(self, **kwargs)
 
         self._dist_class = dist_class
         self._dist = []                 # actual distributions
         self._measure = measure
+        self._batch_size = batch_size
+        self._nproc = nproc
+        self._backend = backend
+        self._dist_samples_file = dist_samples_file
 
         self.__permutator = permutator
 
@@ -356,6 +538,15 @@ class MCNullDist(NullDist):
         prefixes_ = ["%s" % self.__permutator]
         if self._dist_class != Nonparametric:
             prefixes_.insert(0, 'dist_class=%r' % (self._dist_class,))
+        if self._batch_size is not None:
+            prefixes_.append('batch_size=%r' % (self._batch_size,))
+        if self._nproc != 1:
+            prefixes_.append('nproc=%r' % (self._nproc,))
+        if self._backend is not None:
+            prefixes_.append('backend=%r' % (self._backend,))
+        if self._dist_samples_file is not None:
+            prefixes_.append('dist_samples_file=%r'
+                             % (self._dist_samples_file,))
         return super(MCNullDist, self).__repr__(
             prefixes=prefixes_ + prefixes)
 
@@ -372,9 +563,6 @@ class MCNullDist(NullDist):
         ds: `Dataset` which gets permuted and used to compute the
           measure/transfer error multiple times.
         """
-        # TODO: place exceptions separately so we could avoid circular imports
-        from mvpa2.base.learner import LearnerError
-
         # prefer the already assigned measure over anything the was passed to
         # the function.
         # XXX that is a bit awkward but is necessary to keep the code changes
@@ -383,37 +571,22 @@ class MCNullDist(NullDist):
             measure = self._measure
             measure.untrain()
 
-        dist_samples = []
-        """Holds the values for randomized labels."""
-
         # estimate null-distribution
         # TODO this really needs to be more clever! If data samples are
         # shuffled within a class it really makes no difference for the
         # classifier, hence the number of permutations to estimate the
         # null-distribution of transfer errors can be reduced dramatically
         # when the *right* permutations (the ones that matter) are done.
-        skipped = 0                     # # of skipped permutations
-        for p, permuted_ds in enumerate(self.__permutator.generate(ds)):
-            # new permutation all the time
-            # but only permute the training data and keep the testdata constant
-            #
-            if __debug__:
-                debug('STATMC', "Doing %i permutations: %i" \
-                      % (self.__permutator.count, p+1), cr=True)
-
-            # compute and store the measure of this permutation
-            # assume it has `TransferError` interface
-            try:
-                res = measure(permuted_ds)
-                dist_samples.append(res.samples)
-            except LearnerError, e:
-                if __debug__:
-                    debug('STATMC', " skipped", cr=True)
-                warning('Failed to obtain value from %s due to %s.  Measurement'
-                        ' was skipped, which could lead to unstable and/or'
-                        ' incorrect assessment of the null_dist' % (measure, e))
-                skipped += 1
-                continue
+        nproc = get_nproc(self._nproc, self._backend)
+        if nproc > 1:
+            dist_samples, skipped = self._fit_parallel(measure, ds, nproc)
+        else:
+            dist_samples = _DistSamplesSink(
+                getattr(self.__permutator, 'count', None),
+                filename=self._dist_samples_file)
+            skipped = self._compute(measure, ds, self.__permutator,
+                                    dist_samples)
+            dist_samples = dist_samples.get()
 
         self.ca.skipped = skipped
 
@@ -425,8 +598,7 @@ class MCNullDist(NullDist):
                 'Failed to obtain any value from %s. %d measurements were '
                 'skipped. Check above warnings, and your code/data'
                 % (measure, skipped))
-        # store samples as (npermutations x nsamples x nfeatures)
-        dist_samples = np.asanyarray(dist_samples)
+        # samples are (npermutations x nsamples x nfeatures)
         # for the ca storage use a dataset with
         # (nsamples x nfeatures x npermutations) to make it compatible with the
         # result dataset of the measure
@@ -443,9 +615,13 @@ class MCNullDist(NullDist):
         if nshape == 1:
             dist_samples = dist_samples[:, np.newaxis]
 
-        # fit per each element.
-        # XXX could be more elegant? may be use np.vectorize?
         dist_samples_rs = dist_samples.reshape((shape[0], -1))
+        if self._dist_class is Nonparametric:
+            # fit all elements at once
+            self._dist = FeaturewiseNonparametric(dist_samples_rs)
+            return
+
+        # fit per each element.
         dist = []
         for samples in dist_samples_rs.T:
             params = self._dist_class.fit(samples)
@@ -456,6 +632,118 @@ class MCNullDist(NullDist):
         self._dist = dist
 
 
+    def _compute(self, measure, ds, permutator, dist_samples):
+        """Compute the measure for all permutations into `dist_samples`
+
+        Returns the number of skipped permutations.
+        """
+        # TODO: place exceptions separately so we could avoid circular imports
+        from mvpa2.base.learner import LearnerError
+
+        skipped = 0                     # # of skipped permutations
+        count = getattr(permutator, 'count', None)
+        for batch in self._generate_batches(ds, permutator):
+            if __debug__:
+                debug('STATMC', "Doing %s permutations: %i" \
+                      % (count, len(dist_samples) + skipped + len(batch)),
+                      cr=True)
+            if len(batch) > 1 and hasattr(measure, 'call_batch'):
+                try:
+                    res = measure.call_batch(batch)
+                    for r in res:
+                        dist_samples.append(r.samples)
+                    continue
+                except LearnerError:
+                    # go through them one by one to skip only failing ones
+                    pass
+
+            for permuted_ds in batch:
+                # compute and store the measure of this permutation
+                # assume it has `TransferError` interface
+                try:
+                    res = measure(permuted_ds)
+                    dist_samples.append(res.samples)
+                except LearnerError, e:
+                    if __debug__:
+                        debug('STATMC', " skipped", cr=True)
+                    warning('Failed to obtain value from %s due to %s.  '
+                            'Measurement was skipped, which could lead to '
+                            'unstable and/or incorrect assessment of the '
+                            'null_dist' % (measure, e))
+                    skipped += 1
+        return skipped
+
+
+    def _fit_parallel(self, measure, ds, nproc):
+        """Distribute the permutations across workers of the executor"""
+        permutator = self.__permutator
+        count = getattr(permutator, 'count', None)
+        if count is None:
+            raise ValueError("Parallel estimation of the null distribution "
+                             "requires the permutator to have a 'count' "
+                             "attribute (got %s)" % permutator)
+        executor = get_executor(self._backend, nproc=nproc)
+        # workers in other processes do not share the state of the RNGs
+        isolated = not executor.shares_state \
+                   and not isinstance(executor, SerialExecutor)
+        # few blocks per worker to balance the load, but with the
+        # layout determined only by nproc so results are reproducible
+        counts = [len(b) for b in get_blocks(np.arange(count), nproc,
+                                             nblocks=min(count, 4 * nproc))]
+        # every block gets its own RNG streams, derived from the permutator's
+        # RNG (or the global one)
+        seeds = get_rng(getattr(permutator, 'rng', None)).randint(
+            0, 2**31 - 1, size=(len(counts), 2))
+        tasks = [((measure, ds, c, tuple(s), isolated), {})
+                 for c, s in zip(counts, seeds)]
+        if __debug__:
+            debug('STATMC', "Distributing %d permutations in %d blocks "
+                  "across %d workers of %s"
+                  % (count, len(counts), nproc, executor))
+
+        dist_samples = _DistSamplesSink(count,
+                                        filename=self._dist_samples_file)
+        skipped = 0
+        for block_samples, block_skipped in executor.map(self._fit_block,
+                                                         tasks):
+            # the preallocated array gets filled as blocks arrive, so
+            # there is no need to hold the results of all of them
+            dist_samples.extend(block_samples)
+            skipped += block_skipped
+        return dist_samples.get(), skipped
+
+
+    def _fit_block(self, measure, ds, count, seeds, isolated):
+        """Compute the measure for `count` permutations (in a worker)"""
+        permutator = copy.copy(self.__permutator)
+        permutator.count = count
+        if hasattr(permutator, 'rng'):
+            permutator.rng = np.random.RandomState(seeds[0])
+        if isolated:
+            # anything relying on the global RNG (e.g. a permutator within
+            # the measure) must not repeat the draws of the other workers
+            np.random.seed(seeds[1])
+        else:
+            # do not interfere with other tasks running on the same measure
+            measure = copy.deepcopy(measure)
+        dist_samples = _DistSamplesSink(count)
+        skipped = self._compute(measure, ds, permutator, dist_samples)
+        return dist_samples.get(), skipped
+
+
+    def _generate_batches(self, ds, permutator):
+        """Yield lists of permuted datasets of (up to) ``batch_size``"""
+        batch_size = self._batch_size or 1
+        batch = []
+        for permuted_ds in permutator.generate(ds):
+            batch.append(permuted_ds)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if len(batch):
+            yield batch
+
+
     def _cdf(self, x, cdf_func):
         """Return value of the cumulative distribution function at `x`.
         """
@@ -480,7 +768,11 @@ class MCNullDist(NullDist):
                   % (len(self._dist), len(x))
 
         # extract cdf values per each element
-        if cdf_func == 'cdf':
+        if isinstance(self._dist, FeaturewiseNonparametric):
+            if not cdf_func in ('cdf', 'rcdf'):
+                raise ValueError
+            cdfs = getattr(self._dist, cdf_func)(x)
+        elif cdf_func == 'cdf':
             cdfs = [ dist.cdf(v) for v, dist in zip(x, self._dist) ]
         elif cdf_func == 'rcdf':
             cdfs = [ _auto_rcdf(dist)(v) for v, dist in zip(x, self._dist) ]
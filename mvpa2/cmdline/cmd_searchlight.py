@@ -59,12 +59,24 @@ searchlight_opts_grp = ('options for searchlight setup', [
         spatio-temporal searchlights.""")),
     (('--nproc',), dict(type=int, default=1,
         help="""Use the specific number or worker processes for computing.""")),
-    (('--multiproc-backend',), dict(choices=('native', 'hdf5'),
+    (('--multiproc-backend',), dict(
+        choices=('pprocess', 'multiprocessing', 'joblib', 'futures',
+                 'threads', 'serial', 'native', 'hdf5'),
+        help="""parallel backend to use for computing in case of --nproc > 1.
+        'threads' is only beneficial for measures releasing the GIL. By
+        default 'pprocess' is used if available, and 'multiprocessing'
+        otherwise. For backward compatibility 'native' and 'hdf5' are
+        accepted as well and are interpreted as --results-backend.""")),
+    (('--results-backend',), dict(choices=('native', 'hdf5', 'shared'),
         default='native',
         help="""Specifies the way results are provided back from a processing
         block in case of --nproc > 1. 'native' is pickling/unpickling of
         results, while 'hdf5' uses HDF5 based file storage. 'hdf5' might be more
-        time and memory efficient in some cases.""")),
+        time and memory efficient in some cases. With 'shared' results are
+        written directly into an array in shared memory.""")),
+    (('--share-dataset',), dict(action='store_true',
+        help="""place the dataset into shared memory once in case of
+        --nproc > 1, instead of passing a copy to every worker""")),
     (('--aggregate-fx',), dict(type=script2obj,
         help="""use a custom result aggregation function for the searchlight
              """)),
@@ -214,11 +226,18 @@ def run(args):
 
     from mvpa2.measures.searchlight import Searchlight
 
+    backend, results_backend = args.multiproc_backend, args.results_backend
+    if backend in ('native', 'hdf5'):
+        # old meaning of --multiproc-backend
+        backend, results_backend = None, backend
+
     sl = Searchlight(measure,
                      queryengine=qe,
                      roi_ids=roi_ids,
                      nproc=args.nproc,
-                     results_backend=args.multiproc_backend,
+                     backend=backend,
+                     results_backend=results_backend,
+                     share_dataset=args.share_dataset,
                      results_fx=aggregate_fx,
                      enable_ca=args.enable_ca,
                      disable_ca=args.disable_ca)
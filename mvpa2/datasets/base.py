@@ -25,6 +25,44 @@ if __debug__:
     from mvpa2.base import debug
 
 
+def _append_to_mapper(pmapper, mapper):
+    """Append a mapper to an existing one (turned into a chain if necessary)
+    """
+    # otherwise we have a mapper already, but is it a chain?
+    if not isinstance(pmapper, ChainMapper):
+        pmapper = ChainMapper([pmapper])
+
+    # is a chain mapper
+    # merge slicer?
+    lastmapper = pmapper[-1]
+    if isinstance(lastmapper, StaticFeatureSelection):
+        try:
+            # try whether mappers can be merged
+            lastmapper += mapper
+        except TypeError:
+            # append new one if not
+            pmapper.append(mapper)
+    else:
+        pmapper.append(mapper)
+    return pmapper
+
+
+def _get_feature_selection(slicearg, dshape):
+    """Mapper matching the selection of features from a dataset"""
+    subsetmapper = StaticFeatureSelection(slicearg, dshape=dshape)
+    # do not-act forward mapping to charge the output shape of the
+    # slice mapper without having it to train on a full dataset (which
+    # is most likely more expensive)
+    subsetmapper.forward(np.zeros((1,) + dshape, dtype='bool'))
+    return subsetmapper
+
+
+def _get_sliced_mapper(pmapper, slicearg, dshape):
+    """Copy of a mapper extended by the selection of features"""
+    return _append_to_mapper(copy.copy(pmapper),
+                             _get_feature_selection(slicearg, dshape))
+
+
 class Dataset(AttrDataset):
     __doc__ = AttrDataset.__doc__
 
@@ -56,24 +94,7 @@ class Dataset(AttrDataset):
         if not 'mapper' in self.a:
             self.a['mapper'] = mapper
             return
-
-        pmapper = self.a.mapper
-        # otherwise we have a mapper already, but is it a chain?
-        if not isinstance(pmapper, ChainMapper):
-            self.a.mapper = ChainMapper([pmapper])
-
-        # is a chain mapper
-        # merge slicer?
-        lastmapper = self.a.mapper[-1]
-        if isinstance(lastmapper, StaticFeatureSelection):
-            try:
-                # try whether mappers can be merged
-                lastmapper += mapper
-            except TypeError:
-                # append new one if not
-                self.a.mapper.append(mapper)
-        else:
-            self.a.mapper.append(mapper)
+        self.a.mapper = _append_to_mapper(self.a.mapper, mapper)
 
     def select(self, sadict=None, fadict=None, strict=True):
         """Helper to select samples/features given dictionaries describing selection
@@ -145,15 +166,14 @@ class Dataset(AttrDataset):
             # slice samples and feature axis at the same time. Moreover, the
             # mvpa2.base.dataset.Dataset has no clue about mappers and should
             # be fully functional without them.
-            subsetmapper = StaticFeatureSelection(
-                args[1],
-                dshape=self.samples.shape[1:])
-            # do not-act forward mapping to charge the output shape of the
-            # slice mapper without having it to train on a full dataset (which
-            # is most likely more expensive)
-            subsetmapper.forward(np.zeros((1,) + self.shape[1:], dtype='bool'))
-            # mapper is ready to use -- simply store
-            ds._append_mapper(subsetmapper)
+            if self.lazy_slicing:
+                # build it only once accessed
+                ds.a['mapper'].set_lazy(_get_sliced_mapper, self.a.mapper,
+                                        args[1], self.samples.shape[1:])
+            else:
+                # mapper is ready to use -- simply store
+                ds._append_mapper(
+                    _get_feature_selection(args[1], self.samples.shape[1:]))
 
         return ds
 
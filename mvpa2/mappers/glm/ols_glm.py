@@ -0,0 +1,55 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the PyMVPA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""GLMMapper implementation based on a native mass-univariate OLS fit."""
+
+__docformat__ = 'restructuredtext'
+
+import numpy as np
+
+from mvpa2.datasets import Dataset
+from mvpa2.mappers.glm import GLMMapper
+from mvpa2.misc.ols import ols_fit, ols_statistics
+
+class OLSGLMMapper(GLMMapper):
+    """Native GLMMapper implementation
+
+    The design is solved once and the model is fitted to all features with
+    matrix operations (see :func:`~mvpa2.misc.ols.ols_fit`), hence no
+    3rd-party package is required (except SciPy for p-values).
+    """
+    def __init__(self, regs, results='params', ar1=False, chunk_size=None,
+                 **kwargs):
+        """
+        Parameters
+        ----------
+        regs : list
+          Names of sample attributes to be extracted from an input dataset and
+          used as design matrix columns.
+        results : str or array, optional
+          Name of a statistic of the fit (e.g. 'params', 'tvalues'), or a
+          contrast vector for a t-test or a contrast matrix for an F-test.
+          By default parameter estimates are returned.
+        ar1 : bool, optional
+          If True, prewhiten for AR(1) noise.
+        chunk_size : int, optional
+          Number of features to fit at once.  All features by default.
+        """
+        GLMMapper.__init__(self, regs, **kwargs)
+        self.result_expr = results
+        self.ar1 = ar1
+        self.chunk_size = chunk_size
+
+    def _fit_model(self, ds, X, reg_names):
+        fit = ols_fit(X, ds.samples, chunk_size=self.chunk_size, ar1=self.ar1)
+        samples, descr = ols_statistics(fit, self.result_expr)
+        out = Dataset(samples, sa={'descr': descr})
+        if isinstance(self.result_expr, basestring) \
+           and len(out) == len(reg_names):
+            out.sa[self.get_space()] = reg_names
+        return fit, out
@@ -12,7 +12,8 @@ __docformat__ = 'restructuredtext'
 
 from mvpa2.base import externals
 if externals.exists('statsmodels', raise_=True):
-    from mvpa2.measures.statsmodels_adaptor import UnivariateStatsModels
+    from mvpa2.measures.statsmodels_adaptor import UnivariateStatsModels, \
+         _is_native_res
     import statsmodels.api as sm
 
 import numpy as np
@@ -39,7 +40,8 @@ class StatsmodelsGLMMapper(GLMMapper):
         model_gen : callable, optional
           See UnivariateStatsModels documentation for details on the
           specification of the model fitting procedure. By default an
-          OLS model is used.
+          OLS model is used, fitted to all features at once unless
+          `results` is a callable.
         results : str or array, optional
           See UnivariateStatsModels documentation for details on the
           specification of model fit results. By default parameter
@@ -48,7 +50,10 @@ class StatsmodelsGLMMapper(GLMMapper):
         GLMMapper.__init__(self, regs, **kwargs)
         self.result_expr = results
         if model_gen is None:
-            model_gen=lambda y, x: sm.OLS(y, x)
+            if _is_native_res(results):
+                model_gen = 'ols'
+            else:
+                model_gen=lambda y, x: sm.OLS(y, x)
         self.model_gen = model_gen
 
     def _fit_model(self, ds, X, reg_names):
@@ -13,15 +13,29 @@ __docformat__ = 'restructuredtext'
 import numpy as np
 from mvpa2.base import externals
 from mvpa2.base.param import Parameter
-from mvpa2.base.constraints import EnsureChoice
+from mvpa2.base.constraints import EnsureChoice, EnsureInt, EnsureRange, \
+     EnsureNone
 from mvpa2.base.types import is_datasetlike
 from mvpa2.mappers.projection import ProjectionMapper
+from mvpa2.mappers.svd import randomized_product_svd
 
 from mvpa2.base import warning
 if __debug__:
     from mvpa2.base import debug
 
 
+def _sample_space_svd(target, source):
+    """SVD of target.T * source for fewer samples than dimensions
+
+    Both matrices are reduced to (samples x samples) triangular factors by
+    QR decompositions, so only a small matrix has to be decomposed.  Only
+    the (up to number of samples) non-trivial components are returned.
+    """
+    qs, rs = np.linalg.qr(source.T)
+    qt, rt = np.linalg.qr(target.T)
+    U, s, Vh = np.linalg.svd(np.dot(rt, rs.T))
+    return np.dot(qt, U), s, np.dot(Vh, qs.T)
+
 
 class ProcrusteanMapper(ProjectionMapper):
     """Mapper to project from one space to another using Procrustean
@@ -55,9 +69,29 @@ class ProcrusteanMapper(ProjectionMapper):
                  doc="""Cutoff for 'small' singular values to regularize the
                      inverse. See :class:`~numpy.linalg.lstsq` for more
                      information.""")
-    svd = Parameter('numpy', constraints=EnsureChoice('numpy', 'scipy', 'dgesvd'),
+    svd = Parameter('numpy', constraints=EnsureChoice('numpy', 'scipy', 'dgesvd',
+                                                      'randomized', 'gram'),
                  doc="""Implementation of SVD to use. dgesvd requires ctypes to
-                 be available.""")
+                 be available.  'randomized' computes only `svd_rank`
+                 components using random projections of the data (see
+                 :func:`~mvpa2.mappers.svd.randomized_product_svd`), which
+                 is much faster for many dimensions.  'gram' works in
+                 the space of the samples whenever there are fewer samples than
+                 dimensions, which is much faster in that case.  Both yield a
+                 transformation which is exact only within the subspace spanned
+                 by the (first `svd_rank` components of the) training data, and
+                 discards anything orthogonal to it.  With reflection=False
+                 'numpy' is used instead of them.""")
+    svd_rank = Parameter(None,
+                 constraints=EnsureInt() & EnsureRange(min=1) | EnsureNone(),
+                 doc="""Number of components to compute with the 'randomized'
+                 SVD.  If None, all components are computed exactly (as with
+                 'gram'), so it has to be set to benefit from the random
+                 projections.""")
+    svd_oversampling = Parameter(10,
+                 constraints=EnsureInt() & EnsureRange(min=0),
+                 doc="""Number of random projections in addition to `svd_rank`
+                 for the 'randomized' SVD.""")
     def __init__(self, space='targets', **kwargs):
         ProjectionMapper.__init__(self, space=space, **kwargs)
 
@@ -150,16 +184,29 @@ class ProcrusteanMapper(ProjectionMapper):
         else:
             # Orthogonal transformation
             # figure out optimal rotation
-            if params.svd == 'numpy':
+            svd = params.svd
+            if svd in ('randomized', 'gram') and not params.reflection:
+                # making sure it is a rotation requires all components
+                svd = 'numpy'
+            if svd == 'randomized' and params.svd_rank is None:
+                # all components are needed
+                svd = 'gram'
+            if svd == 'gram' and sn < source.shape[1]:
+                U, s, Vh = _sample_space_svd(target, source)
+            elif svd == 'randomized':
+                U, s, Vh = randomized_product_svd(
+                    target, source, params.svd_rank,
+                    oversampling=params.svd_oversampling)
+            elif svd in ('numpy', 'gram'):
                 U, s, Vh = np.linalg.svd(np.dot(target.T, source),
                                full_matrices=False)
-            elif params.svd == 'scipy':
+            elif svd == 'scipy':
                 # would raise exception if not present
                 externals.exists('scipy', raise_=True)
                 import scipy
                 U, s, Vh = scipy.linalg.svd(np.dot(target.T, source),
                                full_matrices=False)
-            elif params.svd == 'dgesvd':
+            elif svd == 'dgesvd':
                 from mvpa2.support.lapack_svd import svd as dgesvd
                 U, s, Vh = dgesvd(np.dot(target.T, source),
                                     full_matrices=True, algo='svd')
@@ -14,18 +14,146 @@ import numpy as np
 #import scipy.linalg as spl
 
 from mvpa2.base.dochelpers import borrowdoc
+from mvpa2.base.param import Parameter
+from mvpa2.base.constraints import EnsureChoice, EnsureInt, EnsureRange, \
+     EnsureNone
 from mvpa2.mappers.base import accepts_dataset_as_samples
 from mvpa2.mappers.projection import ProjectionMapper
 from mvpa2.featsel.helpers import ElementSelector
+from mvpa2.misc.support import get_rng
 
 if __debug__:
     from mvpa2.base import debug
 
 
+def randomized_svd(X, rank, oversampling=10, n_iter=2, rng=0):
+    """Truncated SVD of a matrix using random projections
+
+    The range of the matrix is approximated by projecting it onto a few
+    random vectors, refined by power iterations, and only the much smaller
+    projection of the matrix onto that range gets decomposed.  See Halko,
+    Martinsson and Tropp (2011), *Finding structure with randomness:
+    probabilistic algorithms for constructing approximate matrix
+    decompositions*.
+
+    Parameters
+    ----------
+    X : array
+      2D matrix to decompose.
+    rank : int
+      Number of components to compute.
+    oversampling : int
+      Number of random projections used in addition to `rank`.  More
+      projections improve the accuracy of the approximation.
+    n_iter : int
+      Number of power iterations, which improve the accuracy whenever
+      singular values decay slowly.
+    rng : None or int or RandomState
+      Random number generator (see `get_rng`).  By default a fixed seed is
+      used, so results are reproducible and the global random state is
+      left untouched.
+
+    Returns
+    -------
+    U, s, Vh
+      As returned by `numpy.linalg.svd` with full_matrices=False, but with
+      only the `rank` largest components.
+    """
+    X = np.asarray(X)
+    return _randomized_svd(lambda Y: np.dot(X, Y),
+                           lambda Y: np.dot(X.T, Y),
+                           X.shape, rank, oversampling, n_iter, rng)
+
+
+def randomized_product_svd(A, B, rank, oversampling=10, n_iter=2, rng=0):
+    """Truncated SVD of ``np.dot(A.T, B)`` without computing the product
+
+    Same as `randomized_svd` of ``np.dot(A.T, B)``, but the matrix is only
+    multiplied with the (few) random projections by multiplying with `B`
+    and `A.T` in turn.  That way neither memory nor time grows with the
+    product of the numbers of columns of `A` and `B`, which is considerably
+    cheaper whenever they have many more columns than rows.
+
+    Parameters
+    ----------
+    A, B : array
+      2D matrices with the same number of rows.
+    rank, oversampling, n_iter, rng
+      See `randomized_svd`.
+    """
+    A, B = np.asarray(A), np.asarray(B)
+    return _randomized_svd(lambda Y: np.dot(A.T, np.dot(B, Y)),
+                           lambda Y: np.dot(B.T, np.dot(A, Y)),
+                           (A.shape[1], B.shape[1]),
+                           rank, oversampling, n_iter, rng)
+
+
+def _randomized_svd(dot, dot_t, shape, rank, oversampling, n_iter, rng):
+    """Randomized SVD of a matrix given by its products with other matrices
+
+    `dot` and `dot_t` compute the product of the matrix and of its
+    transpose with another matrix.
+    """
+    m, n = shape
+    rank = min(rank, m, n)
+    nprojections = min(rank + oversampling, m, n)
+    Q = np.linalg.qr(dot(get_rng(rng).normal(size=(n, nprojections))))[0]
+    for i in xrange(n_iter):
+        # orthonormalize in between to not lose the smaller components to
+        # round-off errors
+        Q = np.linalg.qr(dot_t(Q))[0]
+        Q = np.linalg.qr(dot(Q))[0]
+    U, s, Vh = np.linalg.svd(dot_t(Q).T, full_matrices=False)
+    return np.dot(Q, U[:, :rank]), s[:rank], Vh[:rank]
+
+
+def gram_svd(X):
+    """Thin SVD of a matrix with fewer rows than columns via its Gram matrix
+
+    Eigendecomposition of the (rows x rows) Gram matrix is considerably
+    cheaper than the SVD of the full matrix whenever there are many more
+    columns than rows (e.g. samples and features).
+
+    Returns
+    -------
+    U, s, Vh
+      As returned by `numpy.linalg.svd` with full_matrices=False, but only
+      components with non-zero singular values.
+    """
+    X = np.asarray(X)
+    evals, evecs = np.linalg.eigh(np.dot(X, X.T))
+    # descending order as for the SVD
+    evals, evecs = evals[::-1], evecs[:, ::-1]
+    if len(evals):
+        nonzero = evals > evals[0] * max(X.shape) * np.finfo(evals.dtype).eps
+        evals, evecs = evals[nonzero], evecs[:, nonzero]
+    s = np.sqrt(evals)
+    return evecs, s, np.dot(evecs.T, X) / s[:, None]
+
+
 class SVDMapper(ProjectionMapper):
     """Mapper to project data onto SVD components estimated from some dataset.
     """
 
+    svd = Parameter('numpy',
+                    constraints=EnsureChoice('numpy', 'randomized', 'gram'),
+                    doc="""Implementation of SVD to use. 'randomized' computes
+                    only the first `rank` components using random projections
+                    (see `randomized_svd`).  'gram' decomposes the Gram matrix
+                    of the samples whenever there are fewer samples than
+                    features (see `gram_svd`), and yields only components
+                    with non-zero singular values.""")
+
+    rank = Parameter(None,
+                     constraints=EnsureInt() & EnsureRange(min=1) | EnsureNone(),
+                     doc="""Number of components to compute with the
+                     'randomized' SVD.  If None, all of them.""")
+
+    oversampling = Parameter(10,
+                             constraints=EnsureInt() & EnsureRange(min=0),
+                             doc="""Number of random projections in addition to
+                             `rank` for the 'randomized' SVD.""")
+
     @borrowdoc(ProjectionMapper)
     def __init__(self, **kwargs):
         """Initialize the SVDMapper
@@ -52,7 +180,17 @@ class SVDMapper(ProjectionMapper):
         X = self._demean_data(X)
 
         # singular value decomposition
-        U, SV, Vh = np.linalg.svd(X, full_matrices=0)
+        params = self.params
+        if params.svd == 'randomized':
+            rank = min(X.shape) if params.rank is None else params.rank
+            U, SV, Vh = randomized_svd(X, rank,
+                                       oversampling=params.oversampling)
+            Vh = np.asmatrix(Vh)
+        elif params.svd == 'gram' and X.shape[0] < X.shape[1]:
+            U, SV, Vh = gram_svd(X)
+            Vh = np.asmatrix(Vh)
+        else:
+            U, SV, Vh = np.linalg.svd(X, full_matrices=0)
         #U, SV, Vh = spl.svd(X, full_matrices=0)
 
         # store the final matrix with the new basis vectors to project the
@@ -20,6 +20,7 @@ from mvpa2.measures.searchlight import BaseSearchlight
 from mvpa2.base import externals, warning
 from mvpa2.base.dochelpers import borrowkwargs, _repr_attrs
 from mvpa2.generators.splitters import Splitter
+from mvpa2.measures.anova import _same_array
 
 #from mvpa2.base.param import Parameter
 #from mvpa2.base.state import ConditionalAttribute
@@ -131,7 +132,7 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
     """
 
     # TODO: implement parallelization (see #67) and then uncomment
-    __init__doc__exclude__ = ['nproc']
+    __init__doc__exclude__ = ['nproc', 'backend']
 
     def __init__(self, generator, queryengine, errorfx=mean_mismatch_error,
                  indexsum=None,
@@ -213,6 +214,39 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
         self.__pb = None
 
 
+    def _call_batch(self, dss):
+        """Searchlights on datasets differing only in sample attributes
+
+        Datasets sharing their samples and feature attributes, e.g. with
+        permuted targets as generated to estimate a null distribution, are
+        processed with a single training of the query engine, and the
+        neighborhoods (as well as their sparse representation) are deduced
+        only once for all of them.
+        """
+        ds0 = dss[0]
+        for ds in dss[1:]:
+            if not _same_array(ds.samples, ds0.samples) \
+               or set(ds.fa.keys()) != set(ds0.fa.keys()) \
+               or np.any([not _same_array(ds.fa[k].value, ds0.fa[k].value)
+                          for k in ds0.fa.keys()]):
+                return None
+
+        self.queryengine.train(ds0)
+        roi_ids = self._get_roi_ids(ds0)
+
+        reuse_neighbors, roi_fids = self.__reuse_neighbors, self.__roi_fids
+        self.__reuse_neighbors = True
+        try:
+            return [self._finalize_results(
+                        ds, roi_ids, self._sl_call(ds, roi_ids, self.nproc))
+                    for ds in dss]
+        finally:
+            self.__reuse_neighbors = reuse_neighbors
+            if not reuse_neighbors:
+                # neighbors are not to be kept beyond this batch
+                self.__roi_fids = roi_fids
+
+
     def _compute_pb_stats(self, labels_numeric,
                           X, shape):
         #
@@ -446,15 +480,16 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
 
         # 4. Lets deduce all neighbors... might need to be RF into the
         #    parallel part later on
-        # TODO: needs OPT since this is the step consuming 50% of time
-        #       or more allow to cache them entirely so this would
+        # TODO: allow to cache them entirely so this would
         #       not be an unnecessary burden during permutation testing
+        roi_fids_csr = None
         if not self.reuse_neighbors or self.__roi_fids is None:
             if __debug__:
                 debug('SLC',
                       'Phase 4. Deducing neighbors information for %i ROIs'
                       % (nrois,))
-            roi_fids = [qe.query_byid(f) for f in roi_ids]
+            roi_fids_csr = qe.query_batch(roi_ids)
+            roi_fids = np.split(roi_fids_csr[1], roi_fids_csr[0][1:-1])
 
         else:
             if __debug__:
@@ -494,9 +529,12 @@ class SimpleStatBaseSearchlight(BaseSearchlight):
                           'Phase 4b. Converting neighbors to sparse matrix '
                           'representation')
                 # convert to "sparse representation" where column j contains
-                # 1s only at the roi_fids[j] indices
-                roi_fids = inds_to_coo(roi_fids,
-                                       shape=(dataset.nfeatures, nroi_fids))
+                # 1s only at the roi_fids[j] indices, which is exactly the
+                # CSC layout for the indices we got
+                indptr, indices = roi_fids_csr
+                roi_fids = sps.csc_matrix(
+                    (np.ones(len(indices), dtype=int), indices, indptr),
+                    shape=(dataset.nfeatures, nroi_fids))
             indexsum_fx = lastdim_columnsums_spmatrix
         elif indexsum == 'fancy':
             indexsum_fx = lastdim_columnsums_fancy_indexing
@@ -13,6 +13,9 @@ __docformat__ = 'restructuredtext'
 import numpy as np
 
 from mvpa2.base import externals
+from mvpa2.base.param import Parameter
+from mvpa2.base.constraints import EnsureChoice, EnsureInt, EnsureNone, \
+     EnsureRange
 from mvpa2.measures.base import FeaturewiseMeasure
 from mvpa2.base.dataset import vstack
 from mvpa2.datasets.base import Dataset
@@ -29,6 +32,18 @@ from mvpa2.datasets.base import Dataset
 # and may be some others
 
 
+def _same_array(a, b):
+    """Whether two arrays are views of the very same data"""
+    return a is b or (a.__array_interface__ == b.__array_interface__)
+
+
+def _get_membership(groups, ngroups):
+    """Groups x samples indicator matrix for integer group ids"""
+    membership = np.zeros((ngroups, len(groups)), dtype=np.bool)
+    membership[groups, np.arange(len(groups))] = True
+    return membership
+
+
 class OneWayAnova(FeaturewiseMeasure):
     """`FeaturewiseMeasure` that performs a univariate ANOVA.
 
@@ -43,8 +58,23 @@ class OneWayAnova(FeaturewiseMeasure):
     The sensitivity map is returned as a single-sample dataset. If SciPy is
     available the associated p-values will also be computed and are available
     from the 'fprob' feature attribute.
+
+    Sums for all groups are computed at once via a product with a group
+    membership matrix, optionally in chunks of features to limit the
+    amount of temporary storage.
     """
 
+    accumulation_dtype = Parameter(None,
+             constraints=EnsureChoice(None, 'float32', 'float64'),
+             doc="""Data type to accumulate sums of squares in.  By default
+             float64 for integer data and the data type of floating point
+             data otherwise.  float32 halves the memory demand.""")
+
+    chunk_size = Parameter(None,
+             constraints=EnsureNone() | (EnsureInt() & EnsureRange(min=1)),
+             doc="""Number of features to process at once.  If None, all
+             features are processed in a single chunk.""")
+
     def __init__(self, space='targets', **kwargs):
         """
         Parameters
@@ -74,36 +104,112 @@ class OneWayAnova(FeaturewiseMeasure):
 
         # number of groups
         targets_sa = dataset.sa[self.get_space()]
-        labels = targets_sa.value
         ul = targets_sa.unique
+        groups = np.searchsorted(ul, targets_sa.value)
 
         na = len(ul)
-        alldata = dataset.samples
-
-        # total squares of sums
-        # determine data-dtype for derived "sum of" measurements, which we need
-        # to have as float for proper divisions
-        so_dtype = np.float if np.issubdtype(alldata.dtype, np.integer) else alldata.dtype
         bign = dataset.nsamples
 
-        sostot = np.sum(alldata, axis=0, dtype=so_dtype)
+        sos, sstot, sostot = self._get_group_sums(
+            dataset.samples, _get_membership(groups, na))
+
+        # between group sum of squares
+        sos *= sos
+        sos /= np.bincount(groups, minlength=na)[:, None]
+        ssbn = sos.sum(axis=0)
+        ssbn -= sostot
+
+        return self._fscores_dataset(ssbn, sstot, na, bign)
+
+    def _get_sums_dtype(self, alldata):
+        """Data type for derived "sum of" measurements"""
+        if self.params.accumulation_dtype is not None:
+            return np.dtype(self.params.accumulation_dtype)
+        # which we need to have as float for proper divisions
+        return np.float if np.issubdtype(alldata.dtype, np.integer) \
+                        else alldata.dtype
+
+    def _get_group_sums(self, alldata, membership, ntotal=None):
+        """Sums per group and total sums of squares for all features
+
+        Parameters
+        ----------
+        alldata : array
+          Samples x features.
+        membership : array
+          Groups x samples indicator matrix.
+        ntotal : int, optional
+          Number of leading groups partitioning all samples, from which
+          the total sums are deduced.  All groups by default.
+
+        Returns
+        -------
+        sos : array
+          Sums for each group (groups x features).
+        sstot : array
+          Total sum of squares.
+        sostot : array
+          Squared total sums over the number of samples.
+        """
+        so_dtype = self._get_sums_dtype(alldata)
+        membership = membership.astype(so_dtype)
+        bign, nfeatures = alldata.shape
+        chunk_size = self.params.chunk_size or max(nfeatures, 1)
+
+        sos = np.empty((len(membership), nfeatures), dtype=so_dtype)
+        sstot = np.empty(nfeatures, dtype=so_dtype)
+        for start in xrange(0, nfeatures, chunk_size):
+            sl = slice(start, start + chunk_size)
+            d = np.asanyarray(alldata[:, sl], dtype=so_dtype)
+            sos[:, sl] = np.dot(membership, d)
+            sstot[sl] = np.sum(d * d, axis=0)
+
+        # total squares of sums
+        sostot = sos[:ntotal].sum(axis=0)
         sostot *= sostot
         sostot /= bign
 
         # total sum of squares
-        sstot = np.sum(alldata * alldata, axis=0, dtype=so_dtype) - sostot
+        sstot -= sostot
+        return sos, sstot, sostot
 
-        # between group sum of squares
-        ssbn = np.zeros(dataset.nfeatures, dtype=so_dtype)
-        for l in ul:
-            # all samples for the respective label
-            d = alldata[labels == l]
-            sos = np.sum(d, axis=0, dtype=so_dtype)
-            sos *= sos
-            sos /= len(d)  # inplace so we don't demand new temp storage
-            ssbn += sos
+    def _call_batch(self, dss):
+        # only datasets sharing the samples, e.g. as yielded by
+        # AttributePermutator, can be processed at once
+        alldata = dss[0].samples
+        if np.any([not _same_array(ds.samples, alldata) for ds in dss[1:]]):
+            return None
+
+        space = self.get_space()
+        labels = np.array([ds.sa[space].value for ds in dss])
+        ul = dss[0].sa[space].unique
+        # all datasets must have the same set of labels
+        if np.any([not np.array_equal(ds.sa[space].unique, ul)
+                   for ds in dss[1:]]):
+            return None
+
+        na = len(ul)
+        nbatch, bign = labels.shape
 
+        # (nbatch * nlabels x nsamples) group membership, so group sums for
+        # all datasets are obtained with a single matrix product
+        groups = np.searchsorted(ul, labels) + (na * np.arange(nbatch))[:, None]
+        membership = np.zeros((nbatch * na, bign), dtype=np.bool)
+        membership[groups.ravel(), np.tile(np.arange(bign), nbatch)] = 1
+        # total sum of squares is the same for all datasets
+        sos, sstot, sostot = self._get_group_sums(alldata, membership,
+                                                  ntotal=na)
+        sos *= sos
+        sos /= np.bincount(groups.ravel(), minlength=nbatch * na)[:, None]
+
+        # between group sum of squares
+        ssbn = sos.reshape((nbatch, na, -1)).sum(axis=1)
         ssbn -= sostot
+
+        return [self._fscores_dataset(s, sstot, na, bign) for s in ssbn]
+
+    def _fscores_dataset(self, ssbn, sstot, na, bign):
+        """Compute F-scores from between and total group sums of squares"""
         # within
         sswn = sstot - ssbn
 
@@ -142,26 +248,44 @@ class CompoundOneWayAnova(OneWayAnova):
     returned dataset.
     """
 
+    def _call_batch(self, dss):
+        # no batched implementation of compound comparisons
+        return None
+
     def _call(self, dataset):
         """Computes feature-wise f-scores using compound comparisons."""
 
         targets_sa = dataset.sa[self.get_space()]
-        orig_labels = targets_sa.value
-        labels = orig_labels.copy()
+        ul = targets_sa.unique
+        groups = np.searchsorted(ul, targets_sa.value)
+        bign = dataset.nsamples
+
+        # sums of all groups (and the total ones) are shared by all
+        # one-vs-rest comparisons
+        sos, sstot, sostot = self._get_group_sums(
+            dataset.samples, _get_membership(groups, len(ul)))
+        counts = np.bincount(groups, minlength=len(ul))
+        total = sos.sum(axis=0)
 
-        # Lets create a very shallow copy of a dataset with just
-        # samples and targets_attr
-        dataset_mod = Dataset(dataset.samples,
-                              sa={self.get_space(): labels})
         results = []
-        for ul in targets_sa.unique:
-            labels[orig_labels == ul] = 1
-            labels[orig_labels != ul] = 2
-            f_ds = OneWayAnova._call(self, dataset_mod)
+        for i, l in enumerate(ul):
+            # between group sum of squares for the label and the rest
+            if len(ul) == 2:
+                # the rest is exactly the other group
+                rest = sos[1 - i].copy()
+            else:
+                rest = total - sos[i]
+            rest *= rest
+            rest /= bign - counts[i]
+            ssbn = sos[i] * sos[i]
+            ssbn /= counts[i]
+            ssbn += rest
+            ssbn -= sostot
+            f_ds = self._fscores_dataset(ssbn, sstot, 2, bign)
             if 'fprob' in f_ds.fa:
                 # rename the fprob attribute to something label specific
                 # to survive final aggregation stage
-                f_ds.fa['fprob_' + str(ul)] = f_ds.fa.fprob
+                f_ds.fa['fprob_' + str(l)] = f_ds.fa.fprob
                 del f_ds.fa['fprob']
             results.append(f_ds)
 
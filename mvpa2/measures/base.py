@@ -19,6 +19,7 @@ has to be in some iterable container.
 
 __docformat__ = 'restructuredtext'
 
+import time
 import numpy as np
 import mvpa2.support.copy as copy
 
@@ -178,6 +179,54 @@ class Measure(Learner):
         return result
 
 
+    def call_batch(self, dss):
+        """Compute the measure for a sequence of datasets.
+
+        Datasets typically differ only in some sample attributes
+        (e.g. permuted targets) while sharing the samples.  Measures
+        which can exploit this implement ``_call_batch()``, which computes
+        results for all datasets in a single pass.  Otherwise, or if the
+        measure has a null distribution estimator assigned or has to be
+        trained on every dataset, the measure is simply called on every
+        dataset in turn.  Training is done as by calling the measure on
+        the first dataset.
+
+        Returns
+        -------
+        list of Dataset
+        """
+        dss = list(dss)
+        if not len(dss) or self.__null_dist is not None or self.force_train \
+           or not (self.is_trained or self.auto_train):
+            # calling it takes care of (re)training, or of failing if it
+            # is not trained
+            return [self(ds) for ds in dss]
+
+        t0 = time.time()
+        if not self.is_trained:
+            if __debug__:
+                debug('LRN', "Auto-training %s on %s", (self, dss[0]))
+            self.train(dss[0])
+        for ds in dss:
+            self._precall(ds)
+        results = self._call_batch(dss)
+        if results is None:
+            results = [self._call(ds, **self._get_call_kwargs(ds))
+                       for ds in dss]
+        results = [self._postcall(ds, res) for ds, res in zip(dss, results)]
+        self.ca.calling_time = time.time() - t0
+        return results
+
+
+    def _call_batch(self, dss):
+        """Implement to compute raw results for many datasets at once.
+
+        Should return a list of result datasets (one per input dataset),
+        or None if the given datasets cannot be processed in a batch.
+        """
+        return None
+
+
     @property
     def null_dist(self):
         """Return Null Distribution estimator"""
@@ -26,7 +26,7 @@ class CorrCoef(FeaturewiseMeasure):
     """Indicate that this measure is always trained."""
 
     def __init__(self, pvalue=False, attr='targets',
-                        corr_backend=None, **kwargs):
+                        corr_backend=None, chunk_size=None, **kwargs):
         """Initialize
 
         Parameters
@@ -36,17 +36,26 @@ class CorrCoef(FeaturewiseMeasure):
           instead of pure correlation coefficient
         attr : str
           What attribut to correlate with
-        corr_backend: None or 'builtin' or 'scipy' (default: None)
-          Which function to use to compute correlations.
-          None means 'scipy' if pvalue else 'builtin'.
+        corr_backend: None or 'vectorized' or 'builtin' or 'scipy' (default: None)
+          Which function to use to compute correlations.  'vectorized'
+          (the default for None) computes correlations of all features
+          at once, and analytic p-values (requires SciPy) in bulk.
+          'builtin' and 'scipy' compute them per feature.
+        chunk_size : None or int
+          Number of features to process at once with the 'vectorized'
+          backend, to limit the amount of temporary storage.  If None,
+          all features are processed at once.
         """
         # init base classes first
 
         FeaturewiseMeasure.__init__(self, **kwargs)
 
+        if not corr_backend in (None, 'vectorized', 'builtin', 'scipy'):
+            raise ValueError("Unknown corr_backend %r" % (corr_backend,))
         self.__pvalue = int(pvalue)
         self.__attr = attr
         self.__corr_backend = corr_backend
+        self.__chunk_size = chunk_size
 
 
     def _call(self, dataset):
@@ -54,11 +63,12 @@ class CorrCoef(FeaturewiseMeasure):
         backend = self.__corr_backend
 
         if backend is None:
-            # if p values needed, use scipy
-            # otherwise
-            backend = ['builtin', 'scipy'][self.__pvalue]
+            backend = 'vectorized'
 
-        if backend == 'builtin':
+        if backend == 'vectorized':
+            if self.__pvalue:
+                externals.exists('scipy', raise_=True)
+        elif backend == 'builtin':
             if self.__pvalue:
                 raise ValueError("Not supported: 'builtin' and pvalue=True")
             pearsonr = lambda x, y:(pearson_correlation(x, y),)
@@ -75,6 +85,14 @@ class CorrCoef(FeaturewiseMeasure):
 
         samples = dataset.samples
         pvalue_index = self.__pvalue
+
+        if backend == 'vectorized':
+            result = pearson_correlation_attr(samples, attrdata,
+                                              chunk_size=self.__chunk_size)
+            if pvalue_index:
+                result = pearson_correlation_pvalue(result, len(attrdata))
+            return Dataset(result[np.newaxis])
+
         result = np.empty((dataset.nfeatures,), dtype=float)
 
         for ifeature in xrange(dataset.nfeatures):
@@ -95,6 +113,80 @@ class CorrCoef(FeaturewiseMeasure):
 
         return Dataset(result[np.newaxis])
 
+def pearson_correlation_attr(x, y, chunk_size=None):
+    """Pearson correlations of all columns of a matrix with a vector
+
+    Correlations are computed as products of centered data, processing
+    `chunk_size` columns at a time.  Like `CorrCoef` with the 'scipy'
+    backend, a correlation of a constant column with a constant vector
+    is reported as 1, while undefined correlations otherwise are 0.
+
+    Parameters
+    ----------
+    x : np.ndarray
+      PxM array
+    y : np.ndarray
+      P-length vector
+    chunk_size : None or int
+      Number of columns to process at once.  All by default.
+
+    Returns
+    -------
+    r : np.ndarray
+      M-length vector of correlations.
+    """
+    yd = np.asarray(y, dtype=float)
+    yd = yd - yd.mean()
+    yss = np.sqrt(np.dot(yd, yd))
+
+    nfeatures = x.shape[1]
+    chunk_size = chunk_size or max(nfeatures, 1)
+    r = np.empty(nfeatures, dtype=float)
+    for start in xrange(0, nfeatures, chunk_size):
+        sl = slice(start, start + chunk_size)
+        xd = np.asarray(x[:, sl], dtype=float)
+        xd = xd - xd.mean(axis=0)
+        xss = np.sqrt(np.sum(xd * xd, axis=0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r_ = np.dot(yd, xd) / (xss * yss)
+        undefined = ~np.isfinite(r_)
+        if np.any(undefined):
+            # constant terms correlate perfectly
+            r_[undefined] = np.logical_and(xss[undefined] == 0.0,
+                                           yss == 0.0) * (len(yd) > 0)
+        r[sl] = r_
+    # guard against rounding errors
+    np.clip(r, -1.0, 1.0, out=r)
+    return r
+
+
+def pearson_correlation_pvalue(r, n):
+    """Two-tailed p-values of Pearson correlations under the t-distribution
+
+    Equivalent to the p-values reported by `scipy.stats.pearsonr`, but for
+    many correlations at once.
+
+    Parameters
+    ----------
+    r : np.ndarray
+      Correlation coefficients.
+    n : int
+      Number of observations each correlation was computed from.
+    """
+    from scipy.special import betainc
+    r = np.asanyarray(r, dtype=float)
+    df = n - 2
+    if df <= 0:
+        # no degrees of freedom -- as in pearsonr
+        return np.ones(r.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_squared = r * r * (df / ((1.0 - r) * (1.0 + r)))
+        p = betainc(0.5 * df, 0.5, df / (df + t_squared))
+    # perfect correlations
+    p[np.abs(r) == 1.0] = 0.0
+    return p
+
+
 def pearson_correlation(x, y=None):
     '''Computes pearson correlations on matrices
 
@@ -16,12 +16,15 @@ if __debug__:
 import numpy as np
 import tempfile, os
 import time
+from itertools import chain
 
 import mvpa2
 from mvpa2.base import externals, warning
 from mvpa2.base.types import is_datasetlike
 from mvpa2.base.dochelpers import borrowkwargs, _repr_attrs
 from mvpa2.base.progress import ProgressBar
+from mvpa2.base.parallel import Executor, get_executor, get_nproc, \
+     get_blocks, share_array, share_dataset, release_shared
 if externals.exists('h5py'):
     # Is optionally required for passing searchlight
     # results via storing/reloading hdf5 files
@@ -37,6 +40,17 @@ from mvpa2.mappers.base import ChainMapper
 
 from mvpa2.support.due import due, Doi
 
+
+class _SharedResult(object):
+    """Placeholder for a ROI result stored in a shared results array
+
+    Carries everything but the samples, which are stored in columns
+    `start:stop` of the array.
+    """
+    def __init__(self, start, stop, sa, fa, a):
+        self.start, self.stop = start, stop
+        self.sa, self.fa, self.a = sa, fa, a
+
 class BaseSearchlight(Measure):
     """Base class for searchlights.
 
@@ -58,7 +72,7 @@ class BaseSearchlight(Measure):
 
 
     def __init__(self, queryengine, roi_ids=None, nproc=None,
-                 **kwargs):
+                 backend=None, **kwargs):
         """
         Parameters
         ----------
@@ -71,20 +85,24 @@ class BaseSearchlight(Measure):
           feature attribute of the input dataset, whose non-zero values
           determine the feature ids. By default all features will be used.
         nproc : None or int
-          How many processes to use for computation.  Requires `pprocess`
-          external module.  If None -- all available cores will be used.
+          How many processes to use for computation.  If None -- all
+          available cores will be used if `backend` is specified or
+          `pprocess` is available.
+        backend : None or str or Executor
+          Parallel backend to use in case of nproc > 1 (see
+          :mod:`~mvpa2.base.parallel`): 'pprocess', 'multiprocessing',
+          'joblib', 'futures' (`concurrent.futures`), 'threads' (for
+          measures which release the GIL) or 'serial'.  If None --
+          'pprocess' if available, and 'multiprocessing' otherwise.
         **kwargs
           In addition this class supports all keyword arguments of its
           base-class :class:`~mvpa2.measures.base.Measure`.
       """
         Measure.__init__(self, **kwargs)
 
-        if nproc is not None and nproc > 1 and not externals.exists('pprocess'):
-            raise RuntimeError("The 'pprocess' module is required for "
-                               "multiprocess searchlights. Please either "
-                               "install python-pprocess, or reduce `nproc` "
-                               "to 1 (got nproc=%i) or set to default None"
-                               % nproc)
+        if backend is not None and not isinstance(backend, Executor):
+            # verify early that the backend is known and available
+            get_executor(backend, nproc=1)
 
         self._queryengine = queryengine
         if roi_ids is not None and not isinstance(roi_ids, str) \
@@ -93,6 +111,7 @@ class BaseSearchlight(Measure):
                   "Cannot run searchlight on an empty list of roi_ids"
         self.__roi_ids = roi_ids
         self.nproc = nproc
+        self.backend = backend
 
 
     def __repr__(self, prefixes=None):
@@ -104,7 +123,7 @@ class BaseSearchlight(Measure):
             prefixes = []
         return super(BaseSearchlight, self).__repr__(
             prefixes=prefixes
-            + _repr_attrs(self, ['queryengine', 'roi_ids', 'nproc']))
+            + _repr_attrs(self, ['queryengine', 'roi_ids', 'nproc', 'backend']))
 
 
     @due.dcite(
@@ -118,21 +137,21 @@ class BaseSearchlight(Measure):
     def _call(self, dataset):
         """Perform the ROI search.
         """
-        # local binding
-        nproc = self.nproc
-
-        if nproc is None and externals.exists('pprocess'):
-            import pprocess
-            try:
-                nproc = pprocess.get_number_of_cores() or 1
-            except AttributeError:
-                warning("pprocess version %s has no API to figure out maximal "
-                        "number of cores. Using 1"
-                        % externals.versions['pprocess'])
-                nproc = 1
+        nproc = get_nproc(self.nproc, self.backend)
         # train the queryengine
         self._queryengine.train(dataset)
 
+        roi_ids = self._get_roi_ids(dataset)
+
+        # pass to subclass
+        results = self._sl_call(dataset, roi_ids, nproc)
+
+        return self._finalize_results(dataset, roi_ids, results)
+
+
+    def _get_roi_ids(self, dataset):
+        """Ids of the ROI centers within a dataset (the queryengine is trained)
+        """
         # decide whether to run on all possible center coords or just a provided
         # subset
         if isinstance(self.__roi_ids, str):
@@ -149,10 +168,12 @@ class BaseSearchlight(Measure):
                              set(roi_ids).difference(qe_ids)))
         else:
             roi_ids = self._queryengine.ids
+        return roi_ids
 
-        # pass to subclass
-        results = self._sl_call(dataset, roi_ids, nproc)
 
+    def _finalize_results(self, dataset, roi_ids, results):
+        """Assign the mapper of `dataset` to the raw results of `_sl_call`
+        """
         if 'mapper' in dataset.a:
             # since we know the space we can stick the original mapper into the
             # results as well
@@ -271,6 +292,7 @@ class Searchlight(BaseSearchlight):
                  results_fx=None,
                  tmp_prefix='tmpsl',
                  nblocks=None,
+                 share_dataset=False,
                  **kwargs):
         """
         Parameters
@@ -288,11 +310,19 @@ class Searchlight(BaseSearchlight):
           Called with all the results computed in a block for possible
           post-processing which needs to be done in parallel instead of serial
           aggregation in results_fx.
-        results_backend : ('native', 'hdf5'), optional
+        results_backend : ('native', 'hdf5', 'shared'), optional
           Specifies the way results are provided back from a processing block
           in case of nproc > 1. 'native' is pickling/unpickling of results by
-          pprocess, while 'hdf5' would use h5save/h5load functionality.
+          the parallel backend, while 'hdf5' would use h5save/h5load
+          functionality.
           'hdf5' might be more time and memory efficient in some cases.
+          With 'shared', samples of the results are written by the workers
+          directly into a preallocated array in shared memory, shaped and
+          typed after the results of the first ROI.  Results of object
+          dtype, and any result not fitting into that array (of a different
+          shape or dtype, or of a block for which results_postproc_fx
+          changes the number of results), are passed back as with
+          'native'.
         results_fx : callable, optional
           Function to process/combine results of each searchlight
           block run.  By default it would simply append them all into
@@ -301,11 +331,21 @@ class Searchlight(BaseSearchlight):
           care of assigning roi_* ca's
         tmp_prefix : str, optional
           If specified -- serves as a prefix for temporary files storage
-          if results_backend == 'hdf5'.  Thus can specify the directory to use
-          (trailing file path separator is not added automagically).
+          if results_backend == 'hdf5', or shared memory files.  Thus can
+          specify the directory to use (trailing file path separator is not
+          added automagically).
         nblocks : None or int
-          Into how many blocks to split the computation (could be larger than
-          nproc).  If None -- nproc is used.
+          Into how many equally sized blocks to split the computation (could
+          be larger than nproc).  If None -- blocks of progressively
+          decreasing sizes are formed, so that the workers which are done
+          early could pick up remaining blocks while the others are still
+          busy (e.g. with larger ROIs).
+        share_dataset : bool, optional
+          In case of nproc > 1, place samples and feature attributes of the
+          dataset into shared memory once, so the workers access them
+          instead of receiving their own copies.  Only of benefit for the
+          backends which need to pickle the tasks (e.g. 'joblib'), since
+          forked workers share the memory of the parent process anyway.
         **kwargs
           In addition this class supports all keyword arguments of its
           base-class :class:`~mvpa2.measures.searchlight.BaseSearchlight`.
@@ -314,13 +354,17 @@ class Searchlight(BaseSearchlight):
         self.datameasure = datameasure
         self.results_postproc_fx = results_postproc_fx
         self.results_backend = results_backend.lower()
+        if self.results_backend not in ('native', 'hdf5', 'shared'):
+            raise ValueError("Unknown results_backend %r"
+                             % results_backend)
         if self.results_backend == 'hdf5':
             # Assure having hdf5
             externals.exists('h5py', raise_=True)
-        self.results_fx = Searchlight._concat_results \
-                          if results_fx is None else results_fx
+        # default one is assigned at call time to keep instance picklable
+        self.results_fx = results_fx
         self.tmp_prefix = tmp_prefix
         self.nblocks = nblocks
+        self.share_dataset = share_dataset
         if isinstance(add_center_fa, str):
             self.__add_center_fa = add_center_fa
         elif add_center_fa:
@@ -338,50 +382,81 @@ class Searchlight(BaseSearchlight):
             + _repr_attrs(self, ['results_postproc_fx'])
             + _repr_attrs(self, ['results_backend'], default='native')
             + _repr_attrs(self, ['results_fx', 'nblocks'])
+            + _repr_attrs(self, ['share_dataset'], default=False)
             )
 
 
     def _sl_call(self, dataset, roi_ids, nproc):
         """Classical generic searchlight implementation
         """
-        assert(self.results_backend in ('native', 'hdf5'))
+        # shared memory to be released at the end
+        shared = []
+        results_out = None
         # compute
         if nproc is not None and nproc > 1:
-            # split all target ROIs centers into `nproc` equally sized blocks
-            nproc_needed = min(len(roi_ids), nproc)
-            nblocks = nproc_needed \
-                      if self.nblocks is None else self.nblocks
-            roi_blocks = np.array_split(roi_ids, nblocks)
-
-            # the next block sets up the infrastructure for parallel computing
-            # this can easily be changed into a ParallelPython loop, if we
-            # decide to have a PP job server in PyMVPA
-            import pprocess
-            p_results = pprocess.Map(limit=nproc_needed)
+            executor = get_executor(self.backend, nproc=nproc)
+            # should we maybe deepcopy the measure to have a unique and
+            # independent one per process?  We must if they all run within
+            # the same process
+            copy_measure = copy.deepcopy if executor.shares_state \
+                           else copy.copy
+            p_results = []
+            if self.results_backend == 'shared':
+                # compute the first ROI right away to figure out the
+                # shape of the results to be stored
+                p_results = [self._proc_block(roi_ids[:1], dataset,
+                                              copy_measure(self.__datameasure))]
+                results_out = self.__get_shared_results_out(
+                                p_results[0], len(roi_ids))
+                if results_out is not None:
+                    shared.append(results_out[0])
+                roi_ids_left = roi_ids[1:]
+            else:
+                roi_ids_left = roi_ids
+            # ids are split into consecutive blocks, so block's results
+            # start at its offset in the list of all ids
+            roi_blocks = get_blocks(roi_ids_left, nproc, nblocks=self.nblocks)
+            offsets = np.cumsum([len(roi_ids) - len(roi_ids_left)]
+                                + [len(b) for b in roi_blocks])
             if __debug__:
-                debug('SLC', "Starting off %s child processes for nblocks=%i"
-                      % (nproc_needed, nblocks))
-            compute = p_results.manage(
-                        pprocess.MakeParallel(self._proc_block))
-            for iblock, block in enumerate(roi_blocks):
-                # should we maybe deepcopy the measure to have a unique and
-                # independent one per process?
-                seed = mvpa2.get_random_seed()
-                compute(block, dataset, copy.copy(self.__datameasure),
-                        seed=seed, iblock=iblock)
+                debug('SLC', "Starting off %s for nblocks=%i"
+                      % (executor, len(roi_blocks)))
+            ds = dataset
+            if self.share_dataset:
+                ds, shared_ds = share_dataset(dataset, prefix=self.tmp_prefix)
+                shared += shared_ds
+            # seeds are provided to guarantee that child processes do not
+            # all reuse the same state of numpy's RNG
+            p_results = chain(p_results, executor.map(
+                self._proc_block,
+                [((block, ds, copy_measure(self.__datameasure)),
+                  dict(seed=mvpa2.get_random_seed(), iblock=iblock,
+                       results_out=None if results_out is None
+                                   else (results_out[0], offset,
+                                         results_out[1])))
+                 for iblock, (block, offset)
+                 in enumerate(zip(roi_blocks, offsets))]))
         else:
             # otherwise collect the results in an 1-item list
             p_results = [
                     self._proc_block(roi_ids, dataset, self.__datameasure)]
 
         # Finally collect and possibly process results
-        # p_results here is either a generator from pprocess.Map or a list.
+        # p_results here is either a generator from the executor or a list.
         # In case of a generator it allows to process results as they become
         # available
-        result_ds = self.results_fx(sl=self,
-                                    dataset=dataset,
-                                    roi_ids=roi_ids,
-                                    results=self.__handle_all_results(p_results))
+        results_fx = Searchlight._concat_results \
+                     if self.results_fx is None else self.results_fx
+        try:
+            result_ds = results_fx(
+                sl=self,
+                dataset=dataset,
+                roi_ids=roi_ids,
+                results=self.__handle_all_results(
+                    p_results,
+                    None if results_out is None else results_out[0]))
+        finally:
+            release_shared(shared)
 
         # Assure having a dataset (for paranoid ones)
         if not is_datasetlike(result_ds):
@@ -400,7 +475,31 @@ class Searchlight(BaseSearchlight):
         return result_ds
 
 
-    def _proc_block(self, block, ds, measure, seed=None, iblock='main'):
+    def __get_shared_results_out(self, results, nrois):
+        """Allocate shared array for the results of all ROIs
+
+        Returns None if `results` of a single ROI could not be shared.
+        """
+        if len(results) != 1:
+            warning("results_postproc_fx changed the number of results. "
+                    "Falling back to results_backend='native'")
+            return None
+        res = results[0]
+        samples = res.samples if is_datasetlike(res) \
+                  else Dataset(np.atleast_1d(res)).samples
+        if samples.dtype.hasobject:
+            warning("Results of dtype object cannot be shared. Falling back "
+                    "to results_backend='native'")
+            return None
+        nsamples, nfeatures = samples.shape
+        out = share_array(shape=(nsamples, nrois * nfeatures),
+                          dtype=samples.dtype, readonly=False,
+                          prefix=self.tmp_prefix)
+        return out, nfeatures
+
+
+    def _proc_block(self, block, ds, measure, seed=None, iblock='main',
+                    results_out=None):
         """Little helper to capture the parts of the computation that can be
         parallelized
 
@@ -414,6 +513,10 @@ class Searchlight(BaseSearchlight):
           Critical for generating non-colliding temp filenames in case
           of hdf5 backend.  Otherwise RNGs of different processes might
           collide in their temporary file names leading to problems.
+        results_out
+          Shared array, index of the block's first ROI among all ROIs,
+          and number of features in each ROI result, in case of 'shared'
+          results_backend.
         """
         if seed is not None:
             mvpa2.seed(seed)
@@ -498,10 +601,15 @@ class Searchlight(BaseSearchlight):
             results = self.results_postproc_fx(results)
         if self.results_backend == 'native':
             pass                        # nothing special
+        elif self.results_backend == 'shared':
+            if results_out is not None:
+                results = self.__store_shared_results(results, len(block),
+                                                      *results_out)
         elif self.results_backend == 'hdf5':
             # store results in a temporary file and return a filename
-            results_file = tempfile.mktemp(prefix=self.tmp_prefix,
-                                           suffix='-%s.hdf5' % iblock)
+            fd, results_file = tempfile.mkstemp(prefix=self.tmp_prefix,
+                                                suffix='-%s.hdf5' % iblock)
+            os.close(fd)
             if __debug__:
                 debug('SLC', "Storing results into %s" % results_file)
             h5save(results_file, results)
@@ -513,13 +621,46 @@ class Searchlight(BaseSearchlight):
         return results
 
 
+    def __store_shared_results(self, results, nrois, out, offset, nfeatures):
+        """Store samples of the results into the shared array
+
+        Returns placeholders for the results, or the results themselves
+        for those which do not fit into the array.
+        """
+        if len(results) != nrois:
+            # results do not correspond to the ROIs of the block
+            return results
+        stored = []
+        for i, res in enumerate(results):
+            res_ds = res if is_datasetlike(res) \
+                     else Dataset(np.atleast_1d(res))
+            if res_ds.shape != (len(out), nfeatures) \
+                    or res_ds.samples.dtype != out.dtype:
+                stored.append(res)
+                continue
+            res = res_ds
+            start = (offset + i) * nfeatures
+            out[:, start:start + nfeatures] = res.samples
+            stored.append(_SharedResult(start, start + nfeatures,
+                                        dict(res.sa), dict(res.fa),
+                                        dict(res.a)))
+        return stored
+
+
     def __set_datameasure(self, datameasure):
         """Set the datameasure"""
         self.untrain()
         self.__datameasure = datameasure
 
-    def __handle_results(self, results):
-        if self.results_backend == 'hdf5':
+    def __handle_results(self, results, results_out=None):
+        if results_out is not None:
+            # restore datasets from the placeholders (if not the results
+            # computed in the main process)
+            return [Dataset(results_out[:, r.start:r.stop],
+                            sa=r.sa, fa=r.fa, a=r.a)
+                    if isinstance(r, _SharedResult) else r
+                    for r in results]
+        elif self.results_backend == 'hdf5':
             # 'results' must be just a filename
             assert(isinstance(results, str))
             if __debug__:
@@ -533,12 +674,12 @@ class Searchlight(BaseSearchlight):
         else:
             return results
 
-    def __handle_all_results(self, results):
+    def __handle_all_results(self, results, results_out=None):
         """Helper generator to decorate passing the results out to
         results_fx
         """
         for r in results:
-            yield self.__handle_results(r)
+            yield self.__handle_results(r, results_out)
 
 
     datameasure = property(fget=lambda self: self.__datameasure,
@@ -24,6 +24,7 @@ if externals.exists('statsmodels', raise_=True):
 
 from mvpa2.measures.base import FeaturewiseMeasure
 from mvpa2.datasets.base import Dataset
+from mvpa2.misc.ols import ols_fit, ols_statistics, ols_result_names
 
 __all__ = [ 'UnivariateStatsModels', 'GLM' ]
 
@@ -121,20 +122,37 @@ class UnivariateStatsModels(FeaturewiseMeasure):
     >>> print res
     <Dataset: 2x2@float64>
 
+    Instead of a model generator, 'ols' can be passed to fit all features at
+    once with a native mass-univariate OLS implementation (or 'ar1' to
+    additionally prewhiten for AR(1) noise).  It supports all of the above,
+    except for custom extractors, and yields identical results to those of
+    StatsModels' OLS.
+
+    >>> usm = UnivariateStatsModels(exog, 'ols', res=[1,0],
+    ...                             add_constant=True)
+    >>> res = usm(endog)
+    >>> print res.sa.descr
+    ['tvalue' 'pvalue' 'effect' 'sd' 'df' 'zvalue']
+
     """
 
     is_trained = True
 
     def __init__(self, exog, model_gen, res='params', add_constant=True,
-                 **kwargs):
+                 chunk_size=None, **kwargs):
         """
         Parameters
         ----------
         exog : array-like
           Column ordered (observations in rows) design matrix.
-        model_gen : callable
+        model_gen : callable or {'ols', 'ar1'}
           Callable that returns a StatsModels model when called like
-          ``model_gen(endog, exog)``.
+          ``model_gen(endog, exog)``.  'ols' selects a native fit of an OLS
+          model to all features at once, 'ar1' additionally prewhitens
+          for AR(1) noise (see :func:`~mvpa2.misc.ols.ols_fit`).  Native
+          fits only provide the results named in
+          :data:`~mvpa2.misc.ols.ols_result_names` (and 'rho' for 'ar1'),
+          and contrasts.
         res : {'params', 'tvalues', ...} or 1d array or 2d array or callable
           Variable of interest that should be reported as feature-wise
           measure. If a str, the corresponding attribute of the model fit result
@@ -150,8 +168,19 @@ class UnivariateStatsModels(FeaturewiseMeasure):
         add_constant : bool, optional
           If True, a constant will be added to the design matrix that is
           passed to ``exog``.
+        chunk_size : int, optional
+          Number of features to fit at once with a native model.  All
+          features by default.
         """
         FeaturewiseMeasure.__init__(self, **kwargs)
+        if isinstance(model_gen, basestring):
+            if not model_gen in ('ols', 'ar1'):
+                raise ValueError("Unknown native model %r" % (model_gen,))
+            if not (_is_native_res(res)
+                    or (model_gen == 'ar1' and res == 'rho')):
+                raise ValueError("Result %r is not available from a native "
+                                 "OLS fit and requires StatsModels models"
+                                 % (res,))
         self._exog = exog
         if add_constant:
             self._exog = sm.add_constant(exog)
@@ -159,6 +188,7 @@ class UnivariateStatsModels(FeaturewiseMeasure):
         if isinstance(res, (np.ndarray, list, tuple)):
             self._res = np.atleast_1d(res)
         self._model_gen = model_gen
+        self._chunk_size = chunk_size
 
 
     def __fitmodel1d(self, Y):
@@ -191,8 +221,19 @@ class UnivariateStatsModels(FeaturewiseMeasure):
 
 
     def _call(self, dataset):
+        if isinstance(self._model_gen, basestring):
+            # single fit for all features
+            fit = ols_fit(self._exog, dataset.samples,
+                          chunk_size=self._chunk_size,
+                          ar1=self._model_gen == 'ar1')
+            results, descr = ols_statistics(fit, self._res)
+            return Dataset(results, sa={'descr': descr}, fa=dataset.fa)
+
         # compute the regression once per feature
         results = np.apply_along_axis(self.__fitmodel1d, 0, dataset.samples)
+        if results.ndim == 1:
+            # a single value per feature, as a row like ols_statistics gives
+            results = results[np.newaxis]
         # figure out potential description of the results
         sa = None
         res = self._res
@@ -226,5 +267,15 @@ class GLM(UnivariateStatsModels):
                               design,
                               res=voi,
                               add_constant=False,
-                              model_gen=lambda y, x: sm.OLS(y, x),
+                              # fit all features at once if possible
+                              model_gen='ols' if _is_native_res(voi)
+                                        else lambda y, x: sm.OLS(y, x),
                               **kwargs)
+
+
+def _is_native_res(res):
+    """Whether results can be extracted from a native OLS fit"""
+    if isinstance(res, basestring):
+        # anything else (e.g. 'rsquared', 'resid') is left to StatsModels
+        return res in ols_result_names
+    return isinstance(res, (np.ndarray, list, tuple))
@@ -10,7 +10,11 @@
 
 import numpy as np
 from numpy import array
+import os
 import sys
+import types
+import hashlib
+import tempfile
 import itertools
 
 from mvpa2.base import warning
@@ -55,6 +59,10 @@ class IdentityNeighborhood(object):
         coordinate = np.asanyarray(coordinate)
         return [tuple(coordinate)]
 
+    def get_increments(self, ndim):
+        """Increments to get from a coordinate to all its neighbors"""
+        return np.zeros((1, ndim), dtype=int)
+
 
 class Sphere(object):
     """N-Dimensional hypersphere.
@@ -169,6 +177,28 @@ class Sphere(object):
                       <= self._radius])
 
 
+    def get_increments(self, ndim):
+        """Increments to get from a coordinate to all its neighbors
+
+        Parameters
+        ----------
+        ndim : int
+          Dimensionality of the space
+
+        Returns
+        -------
+        ndarray
+          (nneighbors x ndim) array of integer offsets
+        """
+        if self._increments is None or self._increments_ndim != ndim:
+            if __debug__:
+                debug('NBH',
+                      "Recomputing neighborhood increments for %dD Sphere"
+                      % ndim)
+            self._increments = self._get_increments(ndim)
+            self._increments_ndim = ndim
+        return self._increments
+
     def train(self, dataset):
         # XXX YOH:  yeap -- BUT if you care about my note above on extracting
         #     somehow sizes -- some dataset.a might come handy may be?
@@ -204,13 +234,7 @@ class Sphere(object):
             coordinate = coordinate[None]
         # XXX This might go into _train ...
         ndim = len(coordinate)
-        if self._increments is None  or self._increments_ndim != ndim:
-            if __debug__:
-                debug('NBH',
-                      "Recomputing neighborhood increments for %dD Sphere"
-                      % ndim)
-            self._increments = self._get_increments(ndim)
-            self._increments_ndim = ndim
+        increments = self.get_increments(ndim)
 
         if __debug__:
             if coordinate.dtype.char not in np.typecodes['AllInteger']:
@@ -221,9 +245,9 @@ class Sphere(object):
             #    raise ValueError("Sphere object has not been trained yet, use "
             #                     "train(dataset) first. ")
 
-        if len(self._increments):
+        if len(increments):
             # function call
-            coord_array = (coordinate + self._increments)
+            coord_array = (coordinate + increments)
         else:
             # if no increments -- no neighbors -- empty list
             return []
@@ -368,6 +392,26 @@ class QueryEngineInterface(object):
         """
         raise NotImplementedError
 
+
+    def query_batch(self, ids=None):
+        """Return feature ids of neighbors for multiple feature ids at once
+
+        Parameters
+        ----------
+        ids : None or sequence of int
+          Feature ids to query neighbors for.  If None -- all ids known
+          to the engine.
+
+        Returns
+        -------
+        indptr, indices : ndarray
+          Neighbors of ``ids[i]`` are ``indices[indptr[i]:indptr[i+1]]``,
+          i.e. the layout of a CSR sparse matrix with a row per id.
+        """
+        if ids is None:
+            ids = self.ids
+        return _neighbors_to_csr([self.query_byid(i) for i in ids])
+
     #
     # aliases
     #
@@ -471,6 +515,8 @@ class IndexQueryEngine(QueryEngine):
         """Precrafted indexes to cover ':' situation within ix_"""
         self._searcharray = None
         """Actual searcharray"""
+        self._batch_index = None
+        """Dense grid of feature ids and neighbors offsets for query_batch"""
         self.sorted = sorted
         """Either to sort the query results"""
 
@@ -486,6 +532,7 @@ class IndexQueryEngine(QueryEngine):
     def _train(self, dataset):
         # local binding
         qattrs = self._queryattrs
+        self._batch_index = None
         # in addition to the base class functionality we need to store the
         # order of the query-spaces
         self._spaceorder = qattrs.keys()
@@ -594,6 +641,165 @@ class IndexQueryEngine(QueryEngine):
             return res
 
 
+    def _get_batch_index(self):
+        """Prepare the dense grid of feature ids and linear offsets
+
+        Returns None if the spaces do not allow for it (non-integer
+        coordinates, neighborhoods not providing increments, or a
+        grid which would be too large).
+        """
+        if self._batch_index is not None:
+            return self._batch_index
+        coords, increments = [], []
+        for space in self._spaceorder:
+            qattr = np.asanyarray(self._queryattrs[space])
+            if not qattr.dtype.char in np.typecodes['AllInteger']:
+                return None
+            if qattr.ndim == 1:
+                qattr = qattr[:, None]
+            ndim = qattr.shape[1]
+            qobj = self._queryobjs[space]
+            if qobj is None:
+                incr = np.zeros((1, ndim), dtype=int)
+            elif hasattr(qobj, 'get_increments'):
+                incr = np.asanyarray(qobj.get_increments(ndim), dtype=int)
+                if not len(incr):
+                    incr = np.zeros((0, ndim), dtype=int)
+            else:
+                return None
+            coords.append(qattr)
+            increments.append(incr)
+        coords = np.hstack(coords)
+        # all combinations of increments across the spaces
+        increments_all = increments[0]
+        for incr in increments[1:]:
+            increments_all = np.hstack(
+                (np.repeat(increments_all, len(incr), axis=0),
+                 np.tile(incr, (len(increments_all), 1))))
+
+        # the grid covers only the bounding box of all coordinates
+        mins = coords.min(axis=0)
+        extents = coords.max(axis=0) - mins + 1
+        if np.prod(extents.astype(float)) > max(2**25, 8 * len(coords)):
+            return None
+        grid = np.zeros(extents, dtype=int)
+        grid[tuple((coords - mins).T)] = np.arange(1, len(coords) + 1)
+        strides = np.cumprod(np.r_[extents[1:], 1][::-1])[::-1]
+        self._batch_index = (grid.ravel(), coords - mins, extents,
+                             increments_all, np.dot(increments_all, strides),
+                             np.dot(coords - mins, strides))
+        return self._batch_index
+
+
+    @borrowdoc(QueryEngineInterface)
+    def query_batch(self, ids=None):
+        if ids is None:
+            ids = self.ids
+        batch_index = self._get_batch_index()
+        if batch_index is None:
+            return super(IndexQueryEngine, self).query_batch(ids)
+        grid, coords, extents, increments, offsets, linear = batch_index
+        ids = np.asanyarray(ids, dtype=int)
+        indptr = np.zeros(len(ids) + 1, dtype=int)
+        if not len(increments):
+            return indptr, np.zeros(0, dtype=int)
+        indices = []
+        # process in chunks to limit the memory demand
+        chunk_size = max(1, 2**22 // len(increments))
+        for start in xrange(0, len(ids), chunk_size):
+            ids_ = ids[start:start + chunk_size]
+            # neighbors outside the grid are invalid
+            valid = np.ones((len(ids_), len(increments)), dtype=bool)
+            for dim, extent in enumerate(extents):
+                c = coords[ids_, dim][:, None] + increments[:, dim]
+                valid &= (c >= 0) & (c < extent)
+            neighbors = grid[np.where(valid, linear[ids_][:, None] + offsets,
+                                      0)]
+            neighbors[~valid] = 0
+            if self.sorted:
+                # unknown ones (0s) come first
+                neighbors.sort(axis=1)
+            known = neighbors > 0
+            indptr[start + 1:start + len(ids_) + 1] = known.sum(axis=1)
+            indices.append(neighbors[known] - 1)
+        np.cumsum(indptr, out=indptr)
+        return indptr, np.hstack(indices) if len(indices) \
+                       else np.zeros(0, dtype=int)
+
+
+def _update_content_hash(h, obj, _memo=None):
+    """Update hash `h` with the content of `obj` (not its identity)
+
+    Arrays are hashed by their data, containers by their elements, functions
+    by their module, name, code, default arguments and the values they
+    closed over, and all other objects by the state they
+    would be pickled with (e.g. vertices and faces of a surface), so that the
+    result is the same across processes.
+    """
+    if _memo is None:
+        _memo = set()
+    update = h.update
+    if isinstance(obj, np.ndarray):
+        update('ndarray:%s:%s:' % (obj.dtype.str, obj.shape))
+        if obj.dtype.hasobject:
+            _update_content_hash(h, obj.tolist(), _memo)
+        else:
+            update(np.ascontiguousarray(obj).tostring())
+    elif obj is None or isinstance(obj, (basestring, bool, int, long,
+                                         float, complex, np.generic)):
+        update('%s:%r;' % (type(obj).__name__, obj))
+    elif isinstance(obj, (list, tuple)):
+        update('%s:%d:' % (type(obj).__name__, len(obj)))
+        for x in obj:
+            _update_content_hash(h, x, _memo)
+    elif isinstance(obj, (set, frozenset)):
+        update('set:%d:' % len(obj))
+        for x in sorted(obj):
+            _update_content_hash(h, x, _memo)
+    elif isinstance(obj, dict):
+        update('dict:%d:' % len(obj))
+        for k, v in sorted(obj.iteritems()):
+            _update_content_hash(h, k, _memo)
+            _update_content_hash(h, v, _memo)
+    elif isinstance(obj, (type, types.ClassType, types.BuiltinFunctionType)):
+        update('%s.%s;' % (obj.__module__, obj.__name__))
+    elif isinstance(obj, types.MethodType):
+        _update_content_hash(h, obj.im_func, _memo)
+        _update_content_hash(h, obj.im_self, _memo)
+    elif isinstance(obj, types.CodeType):
+        update(obj.co_code)
+        _update_content_hash(h, obj.co_consts, _memo)
+    else:
+        if id(obj) in _memo:
+            # do not recurse into cyclic references
+            update('ref:%s;' % obj.__class__.__name__)
+            return
+        _memo.add(id(obj))
+        if isinstance(obj, types.FunctionType):
+            update('function:%s.%s:' % (obj.__module__, obj.__name__))
+            _update_content_hash(h, obj.func_code, _memo)
+            _update_content_hash(h, obj.func_defaults, _memo)
+            # values of the variables the function closed over
+            for cell in obj.func_closure or ():
+                try:
+                    contents = cell.cell_contents
+                except ValueError:
+                    # not assigned yet
+                    update('cell;')
+                    continue
+                _update_content_hash(h, contents, _memo)
+            return
+        reduced = obj.__reduce_ex__(2)
+        if isinstance(reduced, basestring):
+            # module-level singleton
+            update('global:%s;' % reduced)
+            return
+        update('object:%s.%s:' % (obj.__class__.__module__,
+                                  obj.__class__.__name__))
+        # arguments to reconstruct the object, and its state
+        _update_content_hash(h, reduced[1:3], _memo)
+
+
 class CachedQueryEngine(QueryEngineInterface):
     """Provides caching facility for query engines.
 
@@ -613,29 +819,115 @@ class CachedQueryEngine(QueryEngineInterface):
 
     :func:`query` relies on hashid of the queries, so there might be a
     collision! Thus consider it EXPERIMENTAL for now.
+
+    If `cache_dir` is provided, neighborhoods of all ids are computed at
+    once upon training and stored on disk, keyed by the content of the
+    query engine (e.g. the vertices and faces of a surface, or a voxel
+    selection) and the values of the relevant feature attributes.
+    Subsequent trainings (also in other processes) on a dataset with the
+    same feature attributes memory-map the stored neighborhoods instead of
+    computing them.
     """
 
-    def __init__(self, queryengine):
+    def __init__(self, queryengine, cache_dir=None, cache_key=None):
         """
         Parameters
         ----------
         queryengine : QueryEngine
           Results of which engine to cache
+        cache_dir : str, optional
+          Directory to persistently store neighborhoods in.
+        cache_key : str, optional
+          Identifies the configuration of `queryengine` for the stored
+          neighborhoods, instead of a hash of its content.  It must differ
+          for query engines that would yield different neighborhoods.
         """
         super(CachedQueryEngine, self).__init__()
         self._queryengine = queryengine
+        self.cache_dir = cache_dir
+        self.cache_key = cache_key
+        self._engine_hash = None
+        """Hash of the untrained query engine"""
         self._trained_ds_fa_hash = None
         """Will give information about either dataset's FA were changed
         """
         self._lookup_ids = None
         self._lookup = None
+        self._csr = None
+        """(ids, indptr, indices) of the persistently cached neighborhoods"""
+        self._csr_lookup = None
+        """(sorted ids, their positions) in the cached neighborhoods"""
 
     def __repr__(self, prefixes=None):
         if prefixes is None:
             prefixes = []
         return super(CachedQueryEngine, self).__repr__(
             prefixes=prefixes
-            + _repr_attrs(self, ['queryengine']))
+            + _repr_attrs(self, ['queryengine'])
+            + _repr_attrs(self, ['cache_dir', 'cache_key']))
+
+
+    def _get_cache_key(self, dataset):
+        """Hash of the query engine setup and the relevant feature attributes
+        """
+        qe = self._queryengine
+        if self._engine_hash is None:
+            if self.cache_key is not None:
+                self._engine_hash = 'key:%s' % self.cache_key
+            else:
+                h = hashlib.sha1()
+                try:
+                    _update_content_hash(h, qe)
+                except TypeError, e:
+                    raise ValueError("Cannot hash the content of %s (%s); "
+                                     "provide cache_key explicitly"
+                                     % (qe, e))
+                self._engine_hash = h.hexdigest()
+        spaces = getattr(qe, '_queryobjs', None)
+        if spaces is None:
+            # no knowledge about what is relevant -- take them all
+            spaces = dataset.fa.keys()
+        h = hashlib.sha1()
+        h.update(self._engine_hash)
+        h.update(str(dataset.nfeatures))
+        for space in sorted(spaces):
+            if not space in dataset.fa:
+                continue
+            value = np.asanyarray(dataset.fa[space].value)
+            h.update('%s:%s:%s' % (space, value.dtype.str, value.shape))
+            if value.dtype.hasobject:
+                h.update(repr(value.tolist()))
+            else:
+                h.update(np.ascontiguousarray(value).tostring())
+        return h.hexdigest()
+
+
+    def _load_or_build_cache(self, dataset):
+        """Memory-map stored neighborhoods or compute and store them"""
+        key = self._get_cache_key(dataset)
+        filenames = [os.path.join(self.cache_dir,
+                                  'nbhood-%s-%s.npy' % (key, part))
+                     for part in ('ids', 'indptr', 'indices')]
+        if all(os.path.exists(f) for f in filenames):
+            if __debug__:
+                debug('NBH', "Loading neighborhoods from %s" % filenames[0])
+            return tuple(np.load(f, mmap_mode='r') for f in filenames)
+
+        if __debug__:
+            debug('NBH', "Computing neighborhoods for %s to be stored in %s"
+                  % (self._queryengine, self.cache_dir))
+        ids = np.asanyarray(self._queryengine.ids)
+        csr = (ids,) + tuple(self._queryengine.query_batch(ids))
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        for a, f in zip(csr, filenames):
+            # store atomically since other processes might be loading it
+            fd, tmpname = tempfile.mkstemp(dir=self.cache_dir,
+                                           suffix='.npy')
+            with os.fdopen(fd, 'wb') as tmpfile:
+                np.save(tmpfile, a)
+            os.rename(tmpname, f)
+        return csr
 
 
     def train(self, dataset):
@@ -653,10 +945,17 @@ class CachedQueryEngine(QueryEngineInterface):
         if self._trained_ds_fa_hash is None:
             # First time is called
             self._trained_ds_fa_hash = ds_fa_hash
+            if self.cache_dir is not None and self._engine_hash is None:
+                # hash the engine before training, so that its trained
+                # state does not enter the key
+                self._get_cache_key(dataset)
             self._queryengine.train(dataset)     # train the queryengine
             self._lookup_ids = [None] * dataset.nfeatures # lookup for query_byid
             self._lookup = {}           # generic lookup
             self.ids = self.queryengine.ids # used in GNBSearchlight??
+            if self.cache_dir is not None:
+                self._csr = self._load_or_build_cache(dataset)
+                self._csr_lookup = None
         elif self._trained_ds_fa_hash != ds_fa_hash:
             raise ValueError, \
                   "Feature attributes of %s (idhash=%r) were changed from " \
@@ -670,15 +969,72 @@ class CachedQueryEngine(QueryEngineInterface):
         """Forgetting that CachedQueryEngine was already trained
         """
         self._trained_ds_fa_hash = None
+        self._csr = None
+        self._csr_lookup = None
+
+
+    def _get_csr_positions(self, ids):
+        """Positions of ids within the persistently cached neighborhoods
+
+        Raises
+        ------
+        ValueError
+          If any of the ids is not among the cached ones.
+        """
+        cached_ids = self._csr[0]
+        if self._csr_lookup is None:
+            # ids of the query engine need not be sorted (e.g. keys of a
+            # dict), so look them up through their sorted order
+            order = np.argsort(cached_ids, kind='mergesort')
+            self._csr_lookup = (np.asarray(cached_ids[order]), order)
+        sorted_ids, order = self._csr_lookup
+        ids = np.asanyarray(ids, dtype=int).ravel()
+        if not len(ids):
+            return np.zeros(0, dtype=int)
+        if len(order):
+            pos = np.minimum(np.searchsorted(sorted_ids, ids), len(order) - 1)
+            missing = sorted_ids[pos] != ids
+        else:
+            pos = np.zeros(len(ids), dtype=int)
+            missing = np.ones(len(ids), dtype=bool)
+        if np.any(missing):
+            raise ValueError("Ids %s are not among the neighborhoods cached "
+                             "in %s" % (ids[missing][:5].tolist(),
+                                        self.cache_dir))
+        return order[pos]
 
 
     @borrowdoc(QueryEngineInterface)
     def query_byid(self, fid):
         v = self._lookup_ids[fid]
         if v is None:
-            self._lookup_ids[fid] = v = self._queryengine.query_byid(fid)
+            if self._csr is not None:
+                _, indptr, indices = self._csr
+                i = self._get_csr_positions([fid])[0]
+                v = indices[indptr[i]:indptr[i + 1]].tolist()
+            else:
+                v = self._queryengine.query_byid(fid)
+            self._lookup_ids[fid] = v
         return v
 
+
+    @borrowdoc(QueryEngineInterface)
+    def query_batch(self, ids=None):
+        if self._csr is None:
+            return super(CachedQueryEngine, self).query_batch(ids)
+        if ids is None:
+            ids = self.ids
+        _, indptr, indices = self._csr
+        pos = self._get_csr_positions(ids)
+        starts = indptr[pos]
+        sizes = indptr[pos + 1] - starts
+        out_indptr = np.zeros(len(pos) + 1, dtype=int)
+        np.cumsum(sizes, out=out_indptr[1:])
+        # positions within indices of all the neighbors to be selected
+        selection = np.repeat(starts - out_indptr[:-1], sizes) \
+                    + np.arange(out_indptr[-1])
+        return out_indptr, np.asarray(indices[selection])
+
     @borrowdoc(QueryEngineInterface)
     def query(self, **kwargs):
         def to_hashable(x):
@@ -723,6 +1079,15 @@ class CachedQueryEngine(QueryEngineInterface):
 
 
 
+def _neighbors_to_csr(neighbors):
+    """Convert a list of neighbors lists into CSR (indptr, indices) pair"""
+    indptr = np.zeros(len(neighbors) + 1, dtype=int)
+    np.cumsum([len(n) for n in neighbors], out=indptr[1:])
+    indices = np.fromiter(itertools.chain(*neighbors), dtype=int,
+                          count=indptr[-1])
+    return indptr, indices
+
+
 def scatter_neighborhoods(neighbor_gen, coords, deterministic=False):
     """Scatter neighborhoods over a coordinate list.
 
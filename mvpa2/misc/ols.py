@@ -0,0 +1,327 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the PyMVPA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Mass-univariate ordinary least squares fits.
+
+A linear model with a design shared by all features (e.g. the voxels of a
+first-level fMRI GLM) is fitted to all of them at once: the pseudo-inverse of
+the design is computed a single time and parameter estimates, residual
+variances, as well as t- and F-contrasts are derived with matrix operations
+for all features.  Attribute names follow those of the regression results
+in StatsModels, so both can be used interchangeably for common statistics.
+"""
+
+__docformat__ = 'restructuredtext'
+
+import numpy as np
+
+if __debug__:
+    from mvpa2.base import debug
+
+__all__ = ['ols_fit', 'ols_statistics', 'OLSResults', 'ContrastResults',
+           'ols_result_names']
+
+ols_result_names = ('params', 'bse', 'tvalues', 'pvalues', 'ssr', 'scale',
+                    'df_resid', 'df_model', 'nobs')
+"""Statistics of an OLSResults that are named as in StatsModels"""
+
+
+def _ar1_whiten(a, rho):
+    """Prewhiten the rows of `a` for an AR(1) process with coefficient `rho`
+    """
+    w = np.empty(a.shape)
+    w[0] = np.sqrt(1 - rho ** 2) * a[0]
+    w[1:] = a[1:] - rho * a[:-1]
+    return w
+
+
+def _ar1_coefficients(resid):
+    """AR(1) coefficients of residuals (one per column)"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rho = np.sum(resid[1:] * resid[:-1], axis=0) \
+              / np.sum(resid * resid, axis=0)
+    rho[~np.isfinite(rho)] = 0
+    return rho
+
+
+class _DesignFit(object):
+    """Pseudo-inverse and normalized covariance of a design"""
+    def __init__(self, X):
+        self.X = X
+        self.pinv = np.linalg.pinv(X)
+        self.normalized_cov = np.dot(self.pinv, self.pinv.T)
+        self.rank = np.linalg.matrix_rank(X)
+
+    def fit(self, Y):
+        """Return parameter estimates and residuals"""
+        params = np.dot(self.pinv, Y)
+        resid = Y - np.dot(self.X, params)
+        return params, resid
+
+
+class ContrastResults(object):
+    """Statistics of a t- or F-contrast for all features
+
+    Attributes of t-contrasts are `effect`, `sd`, `tvalue`, `pvalue`,
+    `zvalue` and `df_denom`.  Those of F-contrasts are `fvalue`,
+    `pvalue`, `df_num` and `df_denom`.
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class OLSResults(object):
+    """Results of a mass-univariate OLS fit
+
+    All per-feature statistics are arrays with features on the last axis.
+
+    Attributes
+    ----------
+    params : array
+      Parameter estimates (regressors x features).
+    ssr : array
+      Sum of squared residuals.
+    scale : array
+      Residual variance (`ssr` over `df_resid`).
+    df_resid : int
+      Residual degrees of freedom.
+    df_model : int
+      Model degrees of freedom (the rank of the design minus one).
+    nobs : int
+      Number of observations.
+    rho : array or None
+      AR(1) coefficients used to prewhiten the data of each feature.
+    """
+    def __init__(self, params, ssr, df_resid, nobs, rank,
+                 normalized_cov, cov_index, rho=None):
+        self.params = params
+        self.ssr = ssr
+        self.df_resid = df_resid
+        self.df_model = rank - 1
+        self.nobs = nobs
+        self.rho = rho
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.scale = ssr / df_resid
+        # normalized covariance of the parameters might differ across
+        # (groups of) features in case of prewhitening, so all of them are
+        # stored along with the index of the one to use for each feature
+        self._normalized_cov = normalized_cov
+        self._cov_index = cov_index
+
+
+    def _get_cov_groups(self):
+        """Yield normalized covariances with indices of the features"""
+        if len(self._normalized_cov) == 1:
+            yield self._normalized_cov[0], slice(None)
+        else:
+            for i, cov in enumerate(self._normalized_cov):
+                yield cov, self._cov_index == i
+
+
+    @property
+    def bse(self):
+        """Standard errors of the parameter estimates"""
+        variances = np.array([np.diag(cov)
+                              for cov in self._normalized_cov]).T
+        return np.sqrt(variances[:, self._cov_index] * self.scale)
+
+
+    @property
+    def tvalues(self):
+        """t-statistics of the parameter estimates"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.params / self.bse
+
+
+    @property
+    def pvalues(self):
+        """Two-tailed p-values of the parameter estimates"""
+        from scipy import stats
+        return 2 * stats.t.sf(np.abs(self.tvalues), self.df_resid)
+
+
+    def t_test(self, contrast):
+        """Test a contrast vector of the parameters
+
+        Parameters
+        ----------
+        contrast : array
+          Weights for all parameters.
+
+        Returns
+        -------
+        ContrastResults
+        """
+        from scipy import stats
+        contrast = np.asanyarray(contrast, dtype=float)
+        if contrast.ndim != 1 or len(contrast) != len(self.params):
+            raise ValueError("Contrast needs a weight for each of the %i "
+                             "parameters" % len(self.params))
+        effect = np.dot(contrast, self.params)
+        var = np.empty(effect.shape)
+        for cov, idx in self._get_cov_groups():
+            var[idx] = np.dot(contrast, np.dot(cov, contrast))
+        sd = np.sqrt(var * self.scale)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tvalue = effect / sd
+        df = self.df_resid
+        return ContrastResults(
+            effect=effect, sd=sd, tvalue=tvalue,
+            pvalue=2 * stats.t.sf(np.abs(tvalue), df),
+            zvalue=stats.norm.ppf(stats.t.cdf(tvalue, df)),
+            df_denom=df)
+
+
+    def f_test(self, r_matrix):
+        """Test a contrast matrix of the parameters
+
+        Parameters
+        ----------
+        r_matrix : array
+          Contrasts x parameters matrix.
+
+        Returns
+        -------
+        ContrastResults
+        """
+        from scipy import stats
+        r_matrix = np.atleast_2d(np.asanyarray(r_matrix, dtype=float))
+        if r_matrix.shape[1] != len(self.params):
+            raise ValueError("Contrasts need a weight for each of the %i "
+                             "parameters" % len(self.params))
+        df_num = np.linalg.matrix_rank(r_matrix)
+        effects = np.dot(r_matrix, self.params)
+        fvalue = np.empty(effects.shape[1:])
+        for cov, idx in self._get_cov_groups():
+            icov = np.linalg.pinv(np.dot(r_matrix, np.dot(cov, r_matrix.T)))
+            e = effects[:, idx]
+            fvalue[idx] = np.sum(e * np.dot(icov, e), axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fvalue /= df_num * self.scale
+        return ContrastResults(
+            fvalue=fvalue,
+            pvalue=stats.f.sf(fvalue, df_num, self.df_resid),
+            df_num=df_num, df_denom=self.df_resid)
+
+
+def ols_fit(X, Y, chunk_size=None, ar1=False, ar1_precision=2):
+    """Fit a linear model with a common design to all columns of `Y`
+
+    Parameters
+    ----------
+    X : array
+      Design matrix (observations x regressors).
+    Y : array
+      Data (observations x features).
+    chunk_size : int or None
+      Number of features to process at once, to limit the amount of
+      temporary storage.  All features by default.
+    ar1 : bool
+      If True, data and design are prewhitened for an AR(1) model of
+      the noise, with coefficients estimated from the residuals of an
+      initial OLS fit.  Similar to other mass-univariate implementations
+      coefficients are rounded, and the model is refitted once for all
+      features sharing the same coefficient.
+    ar1_precision : int
+      Number of decimals to round AR(1) coefficients to.
+
+    Returns
+    -------
+    OLSResults
+    """
+    X = np.asanyarray(X, dtype=float)
+    if X.ndim == 1:
+        X = X[:, None]
+    nobs, nfeatures = Y.shape
+    if len(X) != nobs:
+        raise ValueError("Design has %i observations, but data has %i"
+                         % (len(X), nobs))
+    chunk_size = chunk_size or max(nfeatures, 1)
+    design = _DesignFit(X)
+    df_resid = nobs - design.rank
+
+    params = np.empty((X.shape[1], nfeatures))
+    ssr = np.empty(nfeatures)
+    rho = np.zeros(nfeatures) if ar1 else None
+    for start in xrange(0, nfeatures, chunk_size):
+        sl = slice(start, start + chunk_size)
+        y = np.asanyarray(Y[:, sl], dtype=float)
+        params[:, sl], resid = design.fit(y)
+        ssr[sl] = np.sum(resid * resid, axis=0)
+        if ar1:
+            rho[sl] = _ar1_coefficients(resid)
+
+    if not ar1:
+        return OLSResults(params, ssr, df_resid, nobs, design.rank,
+                          [design.normalized_cov],
+                          np.zeros(nfeatures, dtype=int))
+
+    # refit with prewhitened design for each (rounded) coefficient
+    rho = np.clip(np.round(rho, ar1_precision), -0.99, 0.99)
+    urho, cov_index = np.unique(rho, return_inverse=True)
+    if __debug__:
+        debug('STAT', "Refitting OLS for %i AR(1) coefficients"
+              % len(urho))
+    normalized_cov = []
+    for i, r in enumerate(urho):
+        wdesign = _DesignFit(_ar1_whiten(X, r))
+        normalized_cov.append(wdesign.normalized_cov)
+        features = np.where(cov_index == i)[0]
+        for start in xrange(0, len(features), chunk_size):
+            idx = features[start:start + chunk_size]
+            y = _ar1_whiten(np.asanyarray(Y[:, idx], dtype=float), r)
+            params[:, idx], resid = wdesign.fit(y)
+            ssr[idx] = np.sum(resid * resid, axis=0)
+    return OLSResults(params, ssr, df_resid, nobs, design.rank,
+                      normalized_cov, cov_index, rho=rho)
+
+
+def ols_statistics(fit, res):
+    """Extract statistics of interest from an OLS fit
+
+    Parameters
+    ----------
+    fit : OLSResults
+    res : str or 1d array or 2d array
+      Name of an attribute of the fit (one of `ols_result_names`, or 'rho'
+      for a prewhitened fit), or contrast vector for a t-test, or contrast
+      matrix for an F-test.
+
+    Returns
+    -------
+    samples : array
+      Statistics (rows) for all features (columns).
+    descr : list
+      Description of each row.
+    """
+    nfeatures = fit.params.shape[1]
+    if isinstance(res, basestring):
+        if not res in ols_result_names + ('rho',):
+            raise ValueError("Unknown statistic %r of an OLS fit (known are "
+                             "%s)" % (res, ', '.join(ols_result_names)))
+        samples = getattr(fit, res)
+        if np.ndim(samples) < 2:
+            samples = np.resize(samples, (1, nfeatures))
+        return samples, [res] * len(samples)
+    res = np.asanyarray(res)
+    if res.ndim == 1:
+        tstats = fit.t_test(res)
+        descr = ['tvalue', 'pvalue', 'effect', 'sd', 'df', 'zvalue']
+        samples = [tstats.tvalue, tstats.pvalue, tstats.effect, tstats.sd,
+                   np.repeat(float(tstats.df_denom), nfeatures),
+                   tstats.zvalue]
+    elif res.ndim == 2:
+        fstats = fit.f_test(res)
+        descr = ['fvalue', 'pvalue', 'df_num', 'df_denom']
+        samples = [fstats.fvalue, fstats.pvalue,
+                   np.repeat(float(fstats.df_num), nfeatures),
+                   np.repeat(float(fstats.df_denom), nfeatures)]
+    else:
+        raise ValueError("Test specification (via `res`) has to be 1d or 2d "
+                         "array")
+    return np.array(samples), descr
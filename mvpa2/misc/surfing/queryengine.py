@@ -21,10 +21,10 @@ __docformat__ = 'restructuredtext'
 
 import numpy as np
 
-from mvpa2.base.dochelpers import _repr_attrs, borrowkwargs
+from mvpa2.base.dochelpers import _repr_attrs, borrowkwargs, borrowdoc
 
 from mvpa2.base.dataset import AttrDataset
-from mvpa2.misc.neighborhood import QueryEngineInterface
+from mvpa2.misc.neighborhood import QueryEngineInterface, _neighbors_to_csr
 
 from mvpa2.misc.surfing import volgeom, surf_voxel_selection
 from mvpa2.base import warning
@@ -174,16 +174,42 @@ class SurfaceQueryEngine(QueryEngineInterface):
             by 'vertex_id'
         '''
         self._check_trained()
+        self._check_vertex_id(vertex_id)
 
+        nearby_nodes = self.surface.circlearound_n2d(vertex_id,
+                                                    self.radius,
+                                                    self.distance_metric)
+
+        return self._nearby_feature_ids(vertex_id, nearby_nodes)
+
+    @borrowdoc(QueryEngineInterface)
+    def query_batch(self, ids=None):
+        self._check_trained()
+        if ids is None:
+            ids = self.ids
+        ids = list(ids)
+        for vertex_id in ids:
+            self._check_vertex_id(vertex_id)
+
+        # distances are computed for blocks of center nodes at once
+        block_size = 1000
+        neighbors = []
+        for start in xrange(0, len(ids), block_size):
+            block = ids[start:start + block_size]
+            n2ds = self.surface.circlearound_n2ds(block, self.radius,
+                                                  self.distance_metric)
+            neighbors.extend(self._nearby_feature_ids(vertex_id, n2d)
+                             for vertex_id, n2d in zip(block, n2ds))
+        return _neighbors_to_csr(neighbors)
+
+    def _check_vertex_id(self, vertex_id):
         if vertex_id < 0 or vertex_id >= self.surface.nvertices or \
                         round(vertex_id) != vertex_id:
             raise KeyError('vertex_id should be integer in range(%d)' %
                                                 self.surface.nvertices)
 
-        nearby_nodes = self.surface.circlearound_n2d(vertex_id,
-                                                    self.radius,
-                                                    self.distance_metric)
-
+    def _nearby_feature_ids(self, vertex_id, nearby_nodes):
+        '''Feature ids for the nodes near vertex_id'''
         v2f = self._vertex2feature_map
         return sum((v2f[node] for node in nearby_nodes), [])
 
@@ -272,16 +298,16 @@ class SurfaceRingQueryEngine(SurfaceQueryEngine):
             by 'vertex_id'
         '''
         self._check_trained()
-
-        if vertex_id < 0 or vertex_id >= self.surface.nvertices or \
-                        round(vertex_id) != vertex_id:
-            raise KeyError('vertex_id should be integer in range(%d)' %
-                                                self.surface.nvertices)
+        self._check_vertex_id(vertex_id)
 
         nearby_nodes = self.surface.circlearound_n2d(vertex_id,
                                                     self.radius,
                                                     self.distance_metric)
 
+        return self._nearby_feature_ids(vertex_id, nearby_nodes)
+
+    def _nearby_feature_ids(self, vertex_id, nearby_nodes):
+        '''Feature ids for the nodes in the ring around vertex_id'''
         v2f = self._vertex2feature_map
         # Sorting nodes based on distance to center node to work around
         # the problem with add_center_fa in Searchlight
@@ -691,7 +717,8 @@ def disc_surface_queryengine(radius, volume, white_surf, pial_surf,
                              results_backend=None,
                              tmp_prefix='tmpvoxsel',
                              output_modality='surface',
-                             node_voxel_mapping='maximal'):
+                             node_voxel_mapping='maximal', backend=None,
+                             nblocks=None):
     """
     Voxel selection wrapper for multiple center nodes on the surface
 
@@ -746,9 +773,9 @@ def disc_surface_queryengine(radius, volume, white_surf, pial_surf,
         Feature attributes from a dataset that should be returned if the
         queryengine is called with a dataset.
     nproc: int or None
-        Number of parallel threads. None means as many threads as the
-        system supports. The pprocess is required for parallel threads; if
-        it cannot be used, then a single thread is used.
+        Number of parallel processes. None means as many processes as the
+        system supports if `backend` is specified or pprocess is
+        available, and a single process otherwise.
     outside_node_margin: float or None (default)
         By default nodes outside the volume are skipped; using this
         parameters allows for a marign. If this value is a float (possibly
@@ -759,19 +786,25 @@ def disc_surface_queryengine(radius, volume, white_surf, pial_surf,
     results_backend : 'native' or 'hdf5' or None (default).
         Specifies the way results are provided back from a processing block
         in case of nproc > 1. 'native' is pickling/unpickling of results by
-        pprocess, while 'hdf5' would use h5save/h5load functionality.
-        'hdf5' might be more time and memory efficient in some cases.
-        If None, then 'hdf5' if used if available, else 'native'.
+        the parallel backend, while 'hdf5' would use h5save/h5load
+        functionality. If None, then 'native' is used.
     tmp_prefix : str, optional
-        If specified -- serves as a prefix for temporary files storage
-        if results_backend == 'hdf5'.  Thus can specify the directory to use
-        (trailing file path separator is not added automagically).
+        Serves as a prefix for temporary files storage if
+        results_backend == 'hdf5', and for shared memory files.  Thus can
+        specify the directory to use (trailing file path separator is not
+        added automagically).
     output_modality: 'surface' or 'volume' (default: 'surface')
         Indicates whether the output is surface-based
     node_voxel_mapping: 'minimal' or 'maximal'
         If 'minimal' then each voxel is associated with at most one node.
         If 'maximal' it is associated with as many nodes that contain the
         voxel (default: 'maximal')
+    backend : None or str or Executor
+        Parallel backend to use in case of nproc > 1 (see
+        surf_voxel_selection.voxel_selection).
+    nblocks : None or int
+        Number of blocks of center nodes for nproc > 1 (see
+        surf_voxel_selection.voxel_selection).
 
     Returns
     -------
@@ -802,7 +835,8 @@ def disc_surface_queryengine(radius, volume, white_surf, pial_surf,
                                 outside_node_margin=outside_node_margin,
                                 results_backend=results_backend,
                                 tmp_prefix=tmp_prefix,
-                                node_voxel_mapping=node_voxel_mapping)
+                                node_voxel_mapping=node_voxel_mapping,
+                                backend=backend, nblocks=nblocks)
 
 
     qe = modality2class[output_modality](voxsel, add_fa=add_fa)
@@ -26,6 +26,7 @@ __docformat__ = 'restructuredtext'
 
 
 import time
+import copy
 import collections
 import operator
 import datetime
@@ -35,6 +36,8 @@ import os
 import numpy as np
 
 from mvpa2.base import warning, externals
+from mvpa2.base.parallel import SharedArray, get_executor, get_nproc, \
+     get_blocks, share_array, release_shared
 
 from mvpa2.misc.surfing import volgeom, volsurf, volume_mask_dict
 from mvpa2.support.nibabel import surf
@@ -110,6 +113,82 @@ class VoxelSelector(object):
         self._surf = distance_surf                     # } save input
         self._n2v = n2v                       # }
         self._outside_node_margin = outside_node_margin
+        self._n2d_cache = {} # distances computed by precompute_distances
+
+    def copy(self):
+        '''Copy sharing the surface and node to voxel mapping, but with
+        its own state to optimize the radius'''
+        out = copy.copy(self)
+        out._optimizer = _RadiusOptimizer(self._initradius_mm)
+        out._n2d_cache = {}
+        return out
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_n2d_cache'] = {}
+        # the adjacency matrix of the surface is not pickled with it, but
+        # should not be recomputed in every worker process
+        state['_surf_nbrs'] = self._surf.__dict__.get('_nbr_csr')
+        return state
+
+    def __setstate__(self, state):
+        nbrs = state.pop('_surf_nbrs', None)
+        self.__dict__.update(state)
+        if nbrs is not None:
+            self._surf._nbr_csr = nbrs
+
+    def precompute_distances(self, srcs):
+        '''Computes distances around a block of center nodes at once
+
+        Parameters
+        ----------
+        srcs: list of int
+            Indices of center nodes that are to be used next as searchlight
+            centers.
+
+        Notes
+        -----
+        Distances are computed with the surface's circlearound_n2ds for
+        the initial searchlight radius (and, for nodes outside the volume,
+        for outside_node_margin), which is much faster than computing them
+        for each center node separately. Distances computed earlier are
+        discarded.
+        '''
+        surf_ = self._surf
+        metric = self._distance_metric
+        margin = self._outside_node_margin
+        n2v = self._n2v
+
+        cache = dict()
+        self._n2d_cache = cache
+
+        srcs = list(srcs)
+        if not np.issubdtype(np.asarray(srcs).dtype, np.integer):
+            # center nodes given by their coordinates
+            return
+
+        radius_mm = self._initradius_mm
+        if radius_mm != 0:
+            n2ds = surf_.circlearound_n2ds(srcs, radius_mm, metric)
+            cache.update(((src, radius_mm), n2d)
+                         for src, n2d in zip(srcs, n2ds))
+
+        if margin is not None and margin is not True \
+                and not math.isinf(margin):
+            outside = [src for src in srcs if n2v.get(src) is None]
+            if outside:
+                n2ds = surf_.circlearound_n2ds(outside, margin, metric)
+                cache.update(((src, margin), n2d)
+                             for src, n2d in zip(outside, n2ds))
+
+    def _circlearound_n2d(self, src, radius):
+        '''Distances from src to surrounding nodes, taken from those
+        computed by precompute_distances if available'''
+        n2d = self._n2d_cache.get((src, radius))
+        if n2d is None:
+            n2d = self._surf.circlearound_n2d(src, radius,
+                                              self._distance_metric)
+        return n2d
 
     def _select_approx(self, voxprops, count=None):
         '''
@@ -215,7 +294,6 @@ class VoxelSelector(object):
             Each of voxprops[key] should be list-like of equal length.
         '''
         optimizer = self._optimizer
-        dist_surf = self._surf
         n2v = self._n2v
         outside_node_margin = self._outside_node_margin
 
@@ -235,9 +313,8 @@ class VoxelSelector(object):
                             skip = False
                             break
                 else:
-                    node_distances = dist_surf.circlearound_n2d(src,
-                                                radius=outside_node_margin,
-                                                metric=self._distance_metric)
+                    node_distances = self._circlearound_n2d(src,
+                                                outside_node_margin)
 
                     if __debug__:
                         debug("SVS", "")
@@ -271,8 +348,7 @@ class VoxelSelector(object):
                 # multiple nodes occupy exactly the same spatial location
                 around_n2d = {src:0.}
             else:
-                around_n2d = dist_surf.circlearound_n2d(src, radius_mm,
-                                               self._distance_metric)
+                around_n2d = self._circlearound_n2d(src, radius_mm)
 
             allvxdist = self.nodes2voxel_attributes(around_n2d, n2v)
 
@@ -394,7 +470,8 @@ def voxel_selection(vol_surf_mapping, radius, source_surf=None, source_surf_node
                     distance_metric='dijkstra',
                     eta_step=10, nproc=None,
                     outside_node_margin=None,
-                    results_backend=None, tmp_prefix='tmpvoxsel'):
+                    results_backend=None, tmp_prefix='tmpvoxsel',
+                    backend=None, nblocks=None):
 
     """
     Voxel selection for multiple center nodes on the surface
@@ -417,9 +494,9 @@ def voxel_selection(vol_surf_mapping, radius, source_surf=None, source_surf_node
     eta_step: int
         Report progress every eta_step (default: 10).
     nproc: int or None
-        Number of parallel threads. None means as many threads as the
-        system supports. The pprocess is required for parallel threads; if
-        it cannot be used, then a single thread is used.
+        Number of parallel processes. None means as many processes as the
+        system supports if `backend` is specified or pprocess is
+        available, and a single process otherwise.
     outside_node_margin: float or True or None (default)
         By default nodes outside the volume are skipped; using this
         parameter allows for a marign. If this value is a float (possibly
@@ -430,13 +507,22 @@ def voxel_selection(vol_surf_mapping, radius, source_surf=None, source_surf_node
     results_backend : 'native' or 'hdf5' or None (default).
         Specifies the way results are provided back from a processing block
         in case of nproc > 1. 'native' is pickling/unpickling of results by
-        pprocess, while 'hdf5' would use h5save/h5load functionality.
-        'hdf5' might be more time and memory efficient in some cases.
-        If None, then 'hdf5' if used if available, else 'native'.
+        the parallel backend, while 'hdf5' would use h5save/h5load
+        functionality. If None, then 'native' is used.
     tmp_prefix : str, optional
-        If specified -- serves as a prefix for temporary files storage
-        if results_backend == 'hdf5'.  Thus can specify the directory to use
-        (trailing file path separator is not added automagically).
+        Serves as a prefix for temporary files storage if
+        results_backend == 'hdf5', and for shared memory files.  Thus can
+        specify the directory to use (trailing file path separator is not
+        added automagically).
+    backend : None or str or Executor
+        Parallel backend to use in case of nproc > 1 (see
+        :mod:`~mvpa2.base.parallel`). By default 'pprocess' if available,
+        and 'multiprocessing' otherwise. Unless threads are used, the
+        surface and its adjacency matrix are placed in shared memory.
+    nblocks : None or int
+        Number of blocks of center nodes for nproc > 1. By default blocks
+        of decreasing size are used, so that workers which are done early
+        pick up the remaining blocks.
 
     Returns
     -------
@@ -510,33 +596,12 @@ def voxel_selection(vol_surf_mapping, radius, source_surf=None, source_surf_node
     # make a sparse_attributes instance when we know what the attributes are
     node2volume_attributes = None
 
-    attribute_mapper = voxel_selector.disc_voxel_indices_and_attributes
-
     srcs_order = [source_surf_nodes[node] for node in visitorder]
     src_trg_nodes = [(src, src2intermediate[src]) for src in srcs_order]
 
-    if nproc is not None and nproc > 1 and not externals.exists('pprocess'):
-        raise RuntimeError("The 'pprocess' module is required for "
-                           "multiprocess searchlights. Please either "
-                           "install python-pprocess, or reduce `nproc` "
-                           "to 1 (got nproc=%i) or set to default None"
-                           % nproc)
-
-    if nproc is None:
-        if externals.exists('pprocess'):
-            try:
-                import pprocess
-                nproc = pprocess.get_number_of_cores() or 1
-                if _debug() :
-                    debug("SVS", 'Using pprocess with %d cores' % nproc)
-            except:
-                if _debug():
-                    debug("SVS", 'pprocess not available')
-
-        if nproc is None:
-            # importing pprocess failed - so use a single core
-            nproc = 1
-            debug("SVS", 'Using %d cores - pprocess not available' % nproc)
+    nproc = get_nproc(nproc, backend)
+    if _debug():
+        debug("SVS", 'Using %d processes' % nproc)
 
     # get the the voxel selection parameters
     parameter_dict = vol_surf_mapping.get_parameter_dict()
@@ -546,91 +611,91 @@ def voxel_selection(vol_surf_mapping, radius, source_surf=None, source_surf_node
                                source_nvertices=source_surf.nvertices)
 
 
-    init_output = lambda: volume_mask_dict.VolumeMaskDictionary(
+    init_output = lambda source=intermediate_surf: \
+                    volume_mask_dict.VolumeMaskDictionary(
                                     vol_surf_mapping.volgeom,
-                                    intermediate_surf,
+                                    source,
                                     meta=parameter_dict)
 
     if nproc > 1:
+        if results_backend is None:
+            results_backend = 'native'
         if results_backend == 'hdf5':
             externals.exists('h5py', raise_=True)
-        elif results_backend is None:
-            if externals.exists('h5py') and externals.versions['hdf5'] >= '1.8.7':
-                results_backend = 'hdf5'
-            else:
-                results_backend = 'native'
         if _debug():
             debug('SVS', "Using '%s' backend" % (results_backend,))
 
         if not results_backend in ('native', 'hdf5'):
             raise ValueError('Illegal results backend %r' % results_backend)
 
-        import pprocess
-        n_srcs = len(src_trg_nodes)
-        blocks = np.array_split(np.arange(n_srcs), nproc)
+        executor = get_executor(backend, nproc=nproc)
+
+        shared = []
+        task_surf = intermediate_surf
+        if not executor.shares_state:
+            # compute adjacency once and pass surface to the workers
+            # by reference
+            task_surf, shared = _share_surface(intermediate_surf,
+                                               distance_metric,
+                                               prefix=tmp_prefix)
+            voxel_selector = VoxelSelector(radius, task_surf, n2v,
+                                   distance_metric,
+                                   outside_node_margin=outside_node_margin)
 
-        results = pprocess.Map(limit=nproc)
-        reducer = results.manage(pprocess.MakeParallel(_reduce_mapper))
+        n_srcs = len(src_trg_nodes)
+        blocks = get_blocks(np.arange(n_srcs), nproc, nblocks=nblocks)
 
         if __debug__:
-            debug('SVS', "Starting %d child processes", (len(blocks),))
+            debug('SVS', "Starting %s for %d blocks" % (executor, len(blocks)))
 
-        for i, block in enumerate(blocks):
-            empty_dict = init_output()
+        tasks = [((voxel_selector, init_output(task_surf),
+                   [src_trg_nodes[idx] for idx in block]),
+                  dict(eta_step=eta_step, proc_id='%d' % (i + 1,),
+                       results_backend=results_backend,
+                       tmp_prefix=tmp_prefix))
+                 for i, block in enumerate(blocks)]
 
-            src_trg = []
-            for idx in block:
-                src_trg.append(src_trg_nodes[idx])
+        try:
+            results = []
+            for i, result in enumerate(executor.map(_select_block, tasks)):
+                if result is None:
+                    continue
 
-            if _debug():
-                debug('SVS', "  starting block %d/%d: %d centers" %
-                            (i + 1, nproc, len(src_trg)), cr=True)
+                if results_backend == 'hdf5':
+                    result_fn = result
+                    result = h5load(result_fn)
+                    os.remove(result_fn)
 
-            reducer(empty_dict, attribute_mapper, src_trg,
-                    eta_step=eta_step, proc_id='%d' % (i + 1,),
-                    results_backend=results_backend, tmp_prefix=tmp_prefix)
-        if _debug():
-            debug('SVS', '')
-            debug('SVS', 'Started all %d child processes' % (len(blocks)))
-            tstart = time.time()
-
-        node2volume_attributes = None
-        for i, result in enumerate(results):
-            if result is None:
-                continue
-
-            if results_backend == 'hdf5':
-                result_fn = result
-                result = h5load(result_fn)
-                os.remove(result_fn)
-
-            if node2volume_attributes is None:
-                # first time we have actual results.
-                # Use as a starting point
-                node2volume_attributes = result
+                results.append(result)
                 if _debug():
-                    debug('SVS', '')
-                    debug('SVS', "Merging results from %d child "
-                                 "processes using '%s' backend" %
-                                 (len(blocks), results_backend))
-            else:
-                # merge new with current data
-                node2volume_attributes.merge(result)
+                    debug('SVS', "  received result block %d/%d" %
+                                 (i + 1, len(blocks)), cr=True)
+
             if _debug():
-                debug('SVS', "  merged result block %d/%d" % (i + 1, nproc),
-                                cr=True)
+                debug('SVS', '')
+                debug('SVS', "Merging results from %d blocks using '%s' "
+                             "backend" % (len(results), results_backend))
+                tstart = time.time()
+
+            node2volume_attributes = None
+            if results:
+                # results are merged into an instance with the original
+                # (not shared) surface
+                node2volume_attributes = init_output()
+                node2volume_attributes.merge(*results)
+            del results
+        finally:
+            release_shared(shared)
 
         if _debug():
             telapsed = time.time() - tstart
-            debug('SVS', "")
-            debug('SVS', 'Merged results from %d child processed - '
-                         'took %s' %
+            debug('SVS', 'Merged results from %d blocks - took %s' %
                          (len(blocks), seconds2prettystring(telapsed)))
 
     else:
         empty_dict = init_output()
         node2volume_attributes = _reduce_mapper(empty_dict,
-                                                attribute_mapper,
+                                                voxel_selector,
                                                 src_trg_nodes,
                                                 eta_step=eta_step)
         debug('SVS', "")
@@ -659,11 +724,55 @@ def voxel_selection(vol_surf_mapping, radius, source_surf=None, source_surf_node
                         len(visitorder))
     return node2volume_attributes
 
-def _reduce_mapper(node2volume_attributes, attribute_mapper,
+def _share_surface(s, distance_metric, prefix):
+    '''Helper: copy of a surface in shared memory
+
+    Vertices, faces and (for the Dijkstra distance metric) the adjacency
+    matrix of the surface are placed in shared memory, so that they are
+    computed only once and passed by reference to worker processes.
+
+    Returns
+    -------
+    shared_surf: surf.Surface
+    shared: list of SharedArray
+        Has to be passed to release_shared when not needed any longer.
+    '''
+    shared = []
+
+    def share(a):
+        a = share_array(a, prefix=prefix)
+        if isinstance(a, SharedArray):
+            shared.append(a)
+        return a
+
+    out = surf.Surface(s.vertices, s.faces, check=False)
+    # assigned directly, as the constructor converts to plain arrays
+    out._v = share(s.vertices)
+    out._f = share(s.faces)
+
+    if distance_metric[0].lower() == 'd' and externals.exists('scipy'):
+        nbrs = s.neighbor_matrix.copy()
+        nbrs.data = share(nbrs.data)
+        nbrs.indices = share(nbrs.indices)
+        nbrs.indptr = share(nbrs.indptr)
+        out._nbr_csr = nbrs
+
+    return out, shared
+
+def _select_block(voxel_selector, node2volume_attributes, src_trg_indices,
+                  **kwargs):
+    '''applies (a copy of) voxel_selector to a block of src_trg_indices
+    in a worker process. See _reduce_mapper'''
+    return _reduce_mapper(node2volume_attributes, voxel_selector.copy(),
+                          src_trg_indices, **kwargs)
+
+def _reduce_mapper(node2volume_attributes, voxel_selector,
                    src_trg_indices, eta_step=1, proc_id=None,
-                   results_backend='native', tmp_prefix='tmpvoxsel'):
+                   results_backend='native', tmp_prefix='tmpvoxsel',
+                   block_size=1000):
     '''applies voxel selection to a list of src_trg_indices
     results are added to node2volume_attributes.
+    distances are computed for blocks of block_size center nodes at once.
     '''
 
     if not src_trg_indices:
@@ -692,7 +801,13 @@ def _reduce_mapper(node2volume_attributes, attribute_mapper,
     bar = ProgressBar()
     n = len(src_trg_indices)
 
+    attribute_mapper = voxel_selector.disc_voxel_indices_and_attributes
+
     for i, (src, trg) in enumerate(src_trg_indices):
+        if i % block_size == 0:
+            voxel_selector.precompute_distances(
+                [t for _, t in src_trg_indices[i:i + block_size]])
+
         idxs, misc_attrs = attribute_mapper(trg)
 
         if idxs is not None:
@@ -725,7 +840,8 @@ def run_voxel_selection(radius, volume, white_surf, pial_surf,
                          nsteps=10, eta_step=1, nproc=None,
                          outside_node_margin=None,
                          results_backend=None, tmp_prefix='tmpvoxsel',
-                         node_voxel_mapping='maximal'):
+                         node_voxel_mapping='maximal', backend=None,
+                         nblocks=None):
 
     """
     Voxel selection wrapper for multiple center nodes on the surface
@@ -772,9 +888,9 @@ def run_voxel_selection(radius, volume, white_surf, pial_surf,
         After how many searchlights an estimate should be printed of the
         remaining time until completion of all searchlights
     nproc: int or None
-        Number of parallel threads. None means as many threads as the
-        system supports. The pprocess is required for parallel threads; if
-        it cannot be used, then a single thread is used.
+        Number of parallel processes. None means as many processes as the
+        system supports if `backend` is specified or pprocess is
+        available, and a single process otherwise.
     outside_node_margin: float or None (default)
         By default nodes outside the volume are skipped; using this
         parameter allows for a marign. If this value is a float (possibly
@@ -785,13 +901,13 @@ def run_voxel_selection(radius, volume, white_surf, pial_surf,
     results_backend : 'native' or 'hdf5' or None (default).
         Specifies the way results are provided back from a processing block
         in case of nproc > 1. 'native' is pickling/unpickling of results by
-        pprocess, while 'hdf5' would use h5save/h5load functionality.
-        'hdf5' might be more time and memory efficient in some cases.
-        If None, then 'hdf5' if used if available, else 'native'.
+        the parallel backend, while 'hdf5' would use h5save/h5load
+        functionality. If None, then 'native' is used.
     tmp_prefix : str, optional
-        If specified -- serves as a prefix for temporary files storage
-        if results_backend == 'hdf5'.  Thus can specify the directory to use
-        (trailing file path separator is not added automagically).
+        Serves as a prefix for temporary files storage if
+        results_backend == 'hdf5', and for shared memory files.  Thus can
+        specify the directory to use (trailing file path separator is not
+        added automagically).
     node_voxel_mapping: 'minimal' or 'maximal' or 'minimal_lowres'
         If 'minimal' then each voxel is associated with at most one node.
         If 'maximal' it is associated with as many nodes that contain the
@@ -799,6 +915,11 @@ def run_voxel_selection(radius, volume, white_surf, pial_surf,
         If 'minimal_lowres' then each voxel is associated with at most one
         node, and each node that is mapped onto has a corresponding node
         (at the same spatial location) in source_surf.
+    backend : None or str or Executor
+        Parallel backend to use in case of nproc > 1 (see voxel_selection).
+    nblocks : None or int
+        Number of blocks of center nodes for nproc > 1 (see
+        voxel_selection).
 
 
     Returns
@@ -827,7 +948,8 @@ def run_voxel_selection(radius, volume, white_surf, pial_surf,
                           eta_step=eta_step, nproc=nproc,
                           outside_node_margin=outside_node_margin,
                           results_backend=results_backend,
-                          tmp_prefix=tmp_prefix)
+                          tmp_prefix=tmp_prefix,
+                          backend=backend, nblocks=nblocks)
 
     return sel
 
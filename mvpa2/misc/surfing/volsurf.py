@@ -455,11 +455,23 @@ class VolSurfMapping(VolSurf):
         img = nb.Nifti1Image(rs, v.affine)
         return img
 
-    def _get_node_voxels_maximal_mapping(self):
-        '''Internal helper function to return all possible voxels associated
-        with each node. Each voxel can be associated with multiple nodes
+    def _get_node_voxels_maximal_csr(self):
+        '''Internal helper function to compute all possible voxels associated
+        with each node, for all nodes at once. Each voxel can be associated
+        with multiple nodes.
 
-        It returns a node to voxel mapping and a voxel to node mapping'''
+        Returns
+        -------
+        n2v: tuple of numpy.ndarray
+            (indptr, voxels, positions) so that the linear indices of voxels
+            associated with node i are voxels[indptr[i]:indptr[i+1]]
+            (in ascending order) with relative positions in the grey matter
+            positions[indptr[i]:indptr[i+1]].
+        v2n: tuple of numpy.ndarray
+            (voxels, indptr, nodes, positions) so that voxel voxels[k]
+            is associated with nodes[indptr[k]:indptr[k+1]] (in ascending
+            order) at positions[indptr[k]:indptr[k+1]].
+        '''
 
         nsteps = self.nsteps
         start_fr = self.start_fr
@@ -478,8 +490,7 @@ class VolSurfMapping(VolSurf):
             step = 0.
             start_fr = stop_fr = .5
 
-        center_ids = range(self._pial.nvertices)
-        nv = len(center_ids)  # number of nodes on the surface
+        nv = self._pial.nvertices  # number of nodes on the surface
 
         vg = self._volgeom
         same_surfaces = self.white_surface == self.pial_surface
@@ -487,24 +498,12 @@ class VolSurfMapping(VolSurf):
         surf_start = self.white_surface + start_mm
         surf_stop = self.pial_surface + stop_mm
 
-        # allocate space for output
-        # if n2v[i]=vs, then node i is associated with the voxels vs
-        #
-        # vs is a mapping from indices to relative position in grey matter
-        # where 0 means white surface and 1 means pial surface
-        # vs[k]=pos means that voxel with linear index k is
-        # associated with relative positions pos0
-        #
-        # CHECKME that I did not confuse (the order of) pial and white surface
-        #
-        # v2ns is a mapping from voxel indices to sets of nodes.
-
-        n2vs = dict()  # node to voxel indices mapping
-        v2ns = dict()
-
-        # by default, no voxels associated with each node
-        for j in xrange(nv):
-            n2vs[j] = None
+        # (node, voxel, position) triples for all steps, where position
+        # is the relative position in grey matter (0 means white surface
+        # and 1 means pial surface)
+        nodes = []
+        voxels = []
+        positions = []
 
         # different 'layers' (depths) in the grey matter
         for i in xrange(nsteps):
@@ -520,39 +519,76 @@ class VolSurfMapping(VolSurf):
             # linear indices of voxels containing nodes
             lin_vox = vg.xyz2lin(surf_xyz)
 
-            # which of these voxels are actually in the volume
-            is_vox_in_vol = vg.contains_lin(lin_vox)
+            # which of these voxels are actually in the volume.
+            # If a node is not in the volume, then no voxels are
+            # associated with it.
+            in_vol = np.nonzero(vg.contains_lin(lin_vox))[0]
 
             if same_surfaces:
                 # prevent division by zero - simply assign it whatever weight is here
-                grey_matter_pos = np.zeros(lin_vox.shape) + whiteweight
+                grey_matter_pos = np.zeros(len(in_vol)) + whiteweight
             else:
                 # coordinates of voxels
                 vol_xyz = vg.lin2xyz(lin_vox)
 
                 # compute relative position of each voxel in grey matter
-                grey_matter_pos = self.surf_project_weights_nodewise(vol_xyz)
+                grey_matter_pos = np.ravel(
+                        self.surf_project_weights_nodewise(vol_xyz))[in_vol]
+
+            nodes.append(in_vol)
+            voxels.append(lin_vox[in_vol])
+            positions.append(grey_matter_pos)
+
+        nodes = np.hstack(nodes).astype(np.int64)
+        voxels = np.hstack(voxels).astype(np.int64)
+        positions = np.hstack(positions).astype(np.float_)
 
-            for center_id in center_ids:  # for each node on the surface
-                # associate voxels with the present center node.
-                # If a node is not in the volume, then no voxels are
-                # associated with it.
+        # unique node-voxel pairs, keeping the position of the last step
+        keys = nodes * vg.nvoxels + voxels
+        _, last = np.unique(keys[::-1], return_index=True)
+        unq = len(keys) - 1 - last
 
-                if is_vox_in_vol[center_id]:
-                    # no voxels (yet) associated with this node - make space
-                    if n2vs[center_id] is None:
-                        n2vs[center_id] = dict()
+        # as keys are sorted, pairs are sorted by node and then voxel
+        nodes = nodes[unq]
+        voxels = voxels[unq]
+        positions = positions[unq]
+        n2v_indptr = np.searchsorted(nodes, np.arange(nv + 1))
 
-                    vox_id = lin_vox[center_id]
+        # sort by voxel and then node for the reverse mapping
+        order = np.lexsort((nodes, voxels))
+        v2n_voxels, v2n_start = np.unique(voxels[order], return_index=True)
+        v2n_indptr = np.append(v2n_start, len(order))
 
-                    # node to voxel mapping
-                    n2vs[center_id][vox_id] = grey_matter_pos[center_id]
+        return ((n2v_indptr, voxels, positions),
+                (v2n_voxels, v2n_indptr, nodes[order], positions[order]))
 
-                    # voxel to node mapping
-                    if not vox_id in v2ns:
-                        v2ns[vox_id] = set()
+    def _get_node_voxels_maximal_mapping(self):
+        '''Internal helper function to return all possible voxels associated
+        with each node. Each voxel can be associated with multiple nodes
+
+        It returns a node to voxel mapping and a voxel to node mapping'''
 
-                    v2ns[vox_id].add(center_id)
+        n2v, v2n = self._get_node_voxels_maximal_csr()
+
+        # if n2vs[i]=vs, then node i is associated with the voxels vs,
+        # or vs is None if there are no such voxels.
+        #
+        # vs is a mapping from indices to relative position in grey matter
+        # where 0 means white surface and 1 means pial surface
+        # vs[k]=pos means that voxel with linear index k is
+        # associated with relative positions pos0
+        #
+        # v2ns is a mapping from voxel indices to sets of nodes.
+        indptr, voxels, positions = [x.tolist() for x in n2v]
+        n2vs = dict()
+        for j in xrange(len(indptr) - 1):
+            a, b = indptr[j], indptr[j + 1]
+            n2vs[j] = dict(zip(voxels[a:b], positions[a:b])) if b > a \
+                            else None
+
+        voxels, indptr, nodes = [x.tolist() for x in v2n[:3]]
+        v2ns = dict((v, set(nodes[indptr[k]:indptr[k + 1]]))
+                    for k, v in enumerate(voxels))
 
         return n2vs, v2ns
 
@@ -669,44 +705,35 @@ class VolSurfMinimalMapping(VolSurfMapping):
 
     def get_node2voxels_mapping(self):
         # start out with the maximum mapping, then prune it
-        n2vs_max, v2ns_max = self._get_node_voxels_maximal_mapping()
+        n2v_max, v2n_max = self._get_node_voxels_maximal_csr()
+        n2v_indptr = n2v_max[0].tolist()
+        voxels, v2n_indptr, nodes, positions = v2n_max
 
+        nnodes = len(n2v_indptr) - 1
         if __debug__ and 'SVS' in debug.active:
-            nnodes = len(n2vs_max)
-            nvoxels_max = sum(map(len, v2ns_max.itervalues()))
+            nvoxels_max = len(nodes)
             nvoxels_max_per_node = float(nvoxels_max) / nnodes
             debug('SVS', 'Maximal node-to-voxel mapping: %d nodes, '
                             '%d voxels, %.2f voxels/node' %
                             (nnodes, nvoxels_max, nvoxels_max_per_node))
             debug('SVS', 'Starting injective pruning')
 
+        # for each voxel, get the node nearest to the intermediate surface
+        voxel_pos = np.repeat(np.arange(len(voxels)), np.diff(v2n_indptr))
+        order = np.lexsort((np.abs(positions - .5), voxel_pos))
+        nearest = order[v2n_indptr[:-1]]
 
         # initialize mapping
-        n2vs_min = dict((n, None if vs is None else dict())
-                                    for n, vs in n2vs_max.iteritems())
-        v2n_min = dict()
-
-        # helper function to compute distance to intermediate surface
-        dist_func = lambda (_, p): abs(p - .5)
-
-        for v, ns in v2ns_max.iteritems():
-            # get pairs os nodes and the voxel positions
-            ns_pos = [(n, n2vs_max[n].get(v)) for n in ns]
-
-            # get node nearest to intermediate surface
-            min_node, min_pos = min(ns_pos, key=dist_func)
-
-
-            if n2vs_min[min_node] is None:
-                n2vs_min[min_node] = dict()
-            assert(not v in n2vs_min[min_node]) # no duplicates
-            n2vs_min[min_node][v] = min_pos
+        n2vs_min = dict((n, None if n2v_indptr[n] == n2v_indptr[n + 1]
+                                 else dict())
+                                    for n in xrange(nnodes))
 
-            assert(not v in v2n_min)
-            v2n_min[v] = min_node
+        for v, n, pos in zip(voxels.tolist(), nodes[nearest].tolist(),
+                             positions[nearest].tolist()):
+            n2vs_min[n][v] = pos
 
         if __debug__ and 'SVS' in debug.active:
-            nvoxels_min = len(v2n_min)
+            nvoxels_min = len(voxels)
             nvoxels_min_per_node = float(nvoxels_min) / nnodes
             nvoxels_delta = nvoxels_max - nvoxels_min
             nvoxels_pruned_ratio = float(nvoxels_delta) / nvoxels_max
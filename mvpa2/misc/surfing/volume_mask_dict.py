@@ -21,11 +21,14 @@ and __getstate__ - have to flag somehow whether this mapping was present.
 
 __docformat__ = 'restructuredtext'
 
+import os
+import os.path as osp
 from collections import Mapping
+import cPickle as pickle
 
 import numpy as np
 
-from mvpa2.base import externals
+from mvpa2.base import externals, warning
 from mvpa2.misc.surfing import volgeom
 
 from mvpa2.support.utils import deprecated
@@ -153,8 +156,8 @@ class VolumeMaskDictionary(Mapping):
 
         self._src2nbr[src] = np.asarray(nbrs, dtype=np.int)
 
-        if self._lazy_nbr2src is not None:
-            self._add_target2source(src)
+        # inverse mapping is recomputed when needed
+        self._lazy_nbr2src = None
 
         if aux:
             n = len(nbrs)
@@ -307,23 +310,26 @@ class VolumeMaskDictionary(Mapping):
         return self._src2aux.keys()
 
     def _ensure_has_target2sources(self):
-        '''Helper function to ensure that inverse mapping is set properly'''
-        if not self._lazy_nbr2src:
-            self._lazy_nbr2src = dict()
-            for src in self.keys():
-                self._add_target2source(src)
+        '''Helper function to ensure that inverse mapping is set properly
+
+        The inverse mapping is stored as a tuple (targets, indptr, srcs, keys)
+        so that target targets[i] is contained in the masks with keys
+        keys[j] for j in srcs[indptr[i]:indptr[i+1]].
+        '''
+        if self._lazy_nbr2src is None:
+            keys, lengths, targets = _as_key_length_data(self._src2nbr)
+            targets = targets.astype(np.int_)
 
-    def _add_target2source(self, src, targets=None):
-        if targets is None:
-            targets = self[src]
+            contains = self.volgeom.contains_lin(targets)
+            if not np.all(contains):
+                raise ValueError("Target not in volume: %s" %
+                                 targets[np.logical_not(contains)][0])
 
-        contains = self.volgeom.contains_lin(np.asarray(targets))
-        for i, target in enumerate(targets):
-            if not contains[i]:
-                raise ValueError("Target not in volume: %s" % target)
-            if not target in self._lazy_nbr2src:
-                self._lazy_nbr2src[target] = set()
-            self._lazy_nbr2src[target].add(src)
+            srcs = np.repeat(np.arange(len(keys)), lengths)
+            order = np.argsort(targets, kind='mergesort')
+            unq_targets, start = np.unique(targets[order], return_index=True)
+            indptr = np.append(start, len(order))
+            self._lazy_nbr2src = (unq_targets, indptr, srcs[order], keys)
 
 
     def target2sources(self, nbr):
@@ -343,11 +349,13 @@ class VolumeMaskDictionary(Mapping):
             return map(self.target2sources, nbr)
 
         self._ensure_has_target2sources()
+        targets, indptr, srcs, keys = self._lazy_nbr2src
 
-        if not nbr in self._lazy_nbr2src:
+        i = np.searchsorted(targets, nbr)
+        if i == len(targets) or targets[i] != nbr:
             return None
 
-        return self._lazy_nbr2src[nbr]
+        return set(keys[j] for j in srcs[indptr[i]:indptr[i + 1]].tolist())
 
     def get_targets(self):
         """Return list of voxels that are in one or more masks
@@ -359,7 +367,7 @@ class VolumeMaskDictionary(Mapping):
         """
         self._ensure_has_target2sources()
 
-        return sorted(self._lazy_nbr2src.keys())
+        return self._lazy_nbr2src[0].tolist()
 
     def _check_has_keys(self, keys=None, raise_=True):
         """Check that a list of keys is present; if not raise an error
@@ -391,6 +399,32 @@ class VolumeMaskDictionary(Mapping):
                                             (n_missing, missing_keys.pop()))
         return has_missing
 
+    def _get_targets(self, keys=None):
+        '''Helper function to return linear voxel indices of masks
+
+        Parameters
+        ----------
+        keys: list or None
+            Indices of center ids for which the associated masks must be
+            used. If None, all keys are used.
+
+        Returns
+        -------
+        lin_vox: np.ndarray
+            Linear voxel indices in any of the masks, possibly with
+            repeats. If keys is None then these are unique and sorted.
+        '''
+        self._check_has_keys(keys)
+        self._ensure_has_target2sources()
+
+        if keys is None:
+            return self._lazy_nbr2src[0]
+
+        arrs = [self._src2nbr[key] for key in keys]
+        if not arrs:
+            return np.zeros((0,), dtype=np.int_)
+        return np.hstack(arrs).astype(np.int_)
+
 
     def get_mask(self, keys=None):
         """Return a mask for voxels that are included in one or more masks
@@ -413,15 +447,8 @@ class VolumeMaskDictionary(Mapping):
         to get the voxels that were associated with the searchlights in a
         subset of all nodes on a cortical surface.
         """
-        self._check_has_keys(keys)
-        self._ensure_has_target2sources()
-        m_lin = np.zeros((self.volgeom.nvoxels, 1), dtype=np.int8)
-
-        if keys is None:
-            keys = self.keys()
-
-        for key in keys:
-            m_lin[self[key]] = 1
+        m_lin = np.zeros((self.volgeom.nvoxels,), dtype=np.int8)
+        m_lin[self._get_targets(keys)] = 1
 
         return np.reshape(m_lin, self.volgeom.shape[:3])
 
@@ -476,16 +503,8 @@ class VolumeMaskDictionary(Mapping):
         to get the voxels that were associated with the searchlights in a
         subset of all nodes on a cortical surface.
         """
-        self._check_has_keys(keys=keys)
-
-        if keys is None:
-            keys = self.keys()
-
-        # get linear voxel indices
-        lin_vox_set = set.union(*(set(self[k]) for k in keys))
-
-        # convert to array
-        lin_vox_arr = np.asarray(list(lin_vox_set))
+        # get unique linear voxel indices
+        lin_vox_arr = np.unique(self._get_targets(keys))
 
         return map(tuple, self.volgeom.lin2ijk(lin_vox_arr))
 
@@ -530,7 +549,8 @@ class VolumeMaskDictionary(Mapping):
                              'not in dataset, first one is %s' %
                                 (len(not_in_ds), not_in_ds.pop()))
 
-        return np.asarray([d in sel_voxel_indices for d in ds_voxel_indices])
+        return np.asarray([d in set_sel_voxel_indices
+                           for d in ds_voxel_indices])
 
     def get_minimal_dataset(self, ds, keys=None):
         """For a dataset return only portion with features which were selected
@@ -591,7 +611,9 @@ class VolumeMaskDictionary(Mapping):
     @deprecated("should be used for testing compatibility only - "
                             "otherwise use ._getstate instead")
     def _getstate_legacy(self):
-        return self._getstate()
+        s = self._getstate()
+        return s[:3] + (_as_dict_with_arrays(s[3]),
+                        _as_dict_with_arrays(s[4]))
 
     def __getstate__(self):
         # Note: due to issues with saving self_nbr2src, it is not returned
@@ -720,59 +742,138 @@ class VolumeMaskDictionary(Mapping):
     # XXX:  shouldn't it be 'update'  mimicing dict.update?
     # YYY:  'update' does not raise an error if the key to be added is
     #       is already present; this method does.
-    def merge(self, other):
-        """Add masks from another instance
+    def merge(self, *others):
+        """Add masks from other instances
 
         Parameters
         ----------
-        other: VolumeMaskDictionary
-            The instance from which masks are added to the current one. The
-            keys in the current and other instance should be disjoint, and
+        *others: VolumeMaskDictionary
+            The instances from which masks are added to the current one. The
+            keys in the current and other instances should be disjoint, and
             auxiliary properties (if present) should have the same labels.
+            Merging several instances at once is faster than merging
+            them one by one.
         """
 
-        if not self.is_same_layout(other):
-            raise ValueError("Cannot merge %s with %s" % (self, other))
+        for other in others:
+            if not self.is_same_layout(other):
+                raise ValueError("Cannot merge %s with %s" % (self, other))
 
-        if not other:
+        # nothing to add from empty instances
+        others = [other for other in others if other]
+        if not others:
             # nothing to add, so we're done
             return
 
         aks = self.aux_keys()
-        if set(aks) != set(other.aux_keys()):
-            if len(self.keys()) == 0:
-                # current instance is empty, so use the keys from
-                # the other (necessarily non-empty because of the check above)
-                # instance
-                aks = other.aux_keys()
-            else:
+        if len(self.keys()) == 0:
+            # current instance is empty, so use the keys from
+            # the other (necessarily non-empty because of the check above)
+            # instance
+            aks = others[0].aux_keys()
+
+        keys = set(self.keys())
+        for other in others:
+            if set(aks) != set(other.aux_keys()):
                 raise ValueError('Different keys in merge: %s != %s' %
                                 (aks, other.aux_keys()))
 
-# TODO: optimization in case either one or both already have the
-#       inverse mapping from voxels to nodes
-#       For now simply set everything to empty.
-#        if self._lazy_nbr2src is None and not other._lazy_nbr2src is None:
-#            self._ensure_has_target2sources()
-#        elif other._lazy_nbr2src is None and not self._lazy_nbr2src is None:
-#            other._ensure_has_target2sources()
-#        elif not (other._lazy_nbr2src is None or self._lazy_nbr2src is None):
-#            for k, vs in other._lazy_nbr2src.iteritems():
-#                self._add_target2source(k, vs)
+            common = keys.intersection(other.keys())
+            if common:
+                raise ValueError('%s already in %s' % (common.pop(), self))
+            keys.update(other.keys())
 
         self._lazy_nbr2src = None
 
-        for k in other.keys():
-            idxs = other[k]
+        # concatenate the compact representations of all instances
+        self._src2nbr = _merge_array_dicts(
+                            [self._src2nbr] + [o._src2nbr for o in others],
+                            dtype=np.int)
+        for ak in aks:
+            self._src2aux[ak] = _merge_array_dicts(
+                            [self._src2aux.get(ak, {})]
+                            + [o._src2aux[ak] for o in others])
 
-            a_dict = dict()
-            for ak in aks:
-                a_dict[ak] = other.get_aux(k, ak)
+    def to_npy(self, dirname):
+        """Store masks in a directory as .npy files
 
-            if not a_dict:
-                a_dict = None
+        Voxel indices and auxiliary information for all masks are stored
+        as single arrays, and can be memory-mapped by from_npy.
 
-            self.add(k, idxs, a_dict)
+        Parameters
+        ----------
+        dirname: str
+            Directory to store the masks in. It is created if necessary.
+        """
+        if not osp.exists(dirname):
+            os.makedirs(dirname)
+        header_fn = osp.join(dirname, _NPY_HEADER)
+        if osp.lexists(header_fn):
+            # invalidate any previous content, and remove its arrays
+            # (there may have been more auxiliary labels)
+            with open(header_fn, 'rb') as f:
+                old_header = pickle.load(f)
+            os.unlink(header_fn)
+            prefixes = ['nbr'] + ['aux%d' % i
+                                  for i in xrange(len(old_header['aux']))]
+            for prefix in prefixes:
+                for suffix in ('_lengths.npy', '_data.npy'):
+                    fn = osp.join(dirname, prefix + suffix)
+                    if osp.lexists(fn):
+                        os.unlink(fn)
+
+        def save(prefix, d):
+            keys, lengths, data = _as_key_length_data(d)
+            np.save(osp.join(dirname, prefix + '_lengths.npy'), lengths)
+            np.save(osp.join(dirname, prefix + '_data.npy'), data)
+            return keys
+
+        aux = [(label, save('aux%d' % i, self._src2aux[label]))
+               for i, label in enumerate(self.aux_keys())]
+        header = dict(version=1, volgeom=self._volgeom, source=self._source,
+                      meta=self._meta, nbr_keys=save('nbr', self._src2nbr),
+                      aux=aux)
+
+        # the header is written last, so that partially stored directories
+        # cannot be loaded
+        with open(header_fn, 'wb') as f:
+            pickle.dump(header, f, protocol=2)
+
+    @classmethod
+    def from_npy(cls, dirname, mmap_mode='r'):
+        """Load masks stored in a directory by to_npy
+
+        Parameters
+        ----------
+        dirname: str
+            Directory the masks were stored in.
+        mmap_mode: {None, 'r', 'r+', 'c'}, optional
+            Mode to memory-map voxel indices and auxiliary information with
+            (see numpy.load). By default these are mapped read-only, so that
+            loading is instantaneous and memory can be shared by processes.
+
+        Returns
+        -------
+        vmd: VolumeMaskDictionary
+        """
+        header_fn = osp.join(dirname, _NPY_HEADER)
+        if not osp.lexists(header_fn):
+            raise ValueError("%s contains no masks stored by to_npy" %
+                             dirname)
+        with open(header_fn, 'rb') as f:
+            header = pickle.load(f)
+
+        def load(prefix, keys):
+            lengths = np.load(osp.join(dirname, prefix + '_lengths.npy'))
+            data = np.load(osp.join(dirname, prefix + '_data.npy'),
+                           mmap_mode=mmap_mode)
+            return _CSRDict(keys, lengths, data)
+
+        vmd = cls(header['volgeom'], header['source'], meta=header['meta'])
+        vmd._src2nbr = load('nbr', header['nbr_keys'])
+        vmd._src2aux = dict((label, load('aux%d' % i, keys))
+                            for i, (label, keys) in enumerate(header['aux']))
+        return vmd
 
     def xyz_target(self, ts=None):
         """Compute the x,y,z coordinates of one or more voxels
@@ -921,6 +1022,112 @@ class VolumeMaskDictionary(Mapping):
         return trgs[i / src_xyz.shape[0]]
 
 
+# name of the file with all but the arrays stored by to_npy()
+_NPY_HEADER = 'header.pkl'
+
+
+class _CSRDict(Mapping):
+    '''Helper: mapping from keys to consecutive parts of a single array
+
+    The value for the i-th key is data[indptr[i]:indptr[i+1]], so that
+    many (small) arrays are stored compactly, can be retrieved in
+    constant time, and can be memory-mapped. Values assigned later are
+    stored separately (and take precedence).
+    '''
+    def __init__(self, keys, lengths, data):
+        self._keys = list(keys)
+        self._key2idx = dict((k, i) for i, k in enumerate(self._keys))
+        if len(self._key2idx) != len(self._keys):
+            raise ValueError('duplicate keys')
+
+        lengths = np.asarray(lengths, dtype=np.int_).ravel()
+        if len(lengths) != len(self._keys):
+            raise ValueError('%d keys but %d lengths' %
+                             (len(self._keys), len(lengths)))
+        self._indptr = np.hstack(([0], np.cumsum(lengths))).tolist()
+
+        if data is None:
+            data = np.zeros((0,), dtype=np.int_)
+        if self._indptr[-1] != len(data):
+            raise ValueError('data size mismatch: expected %s, found %s' %
+                             (self._indptr[-1], len(data)))
+        self._data = data
+
+        self._extra = dict()
+
+    def __getitem__(self, key):
+        if key in self._extra:
+            return self._extra[key]
+        i = self._key2idx[key]
+        return self._data[self._indptr[i]:self._indptr[i + 1]]
+
+    def __setitem__(self, key, value):
+        self._extra[key] = value
+
+    def __contains__(self, key):
+        return key in self._key2idx or key in self._extra
+
+    def __iter__(self):
+        for key in self._keys:
+            yield key
+        for key in self._extra:
+            if not key in self._key2idx:
+                yield key
+
+    def __len__(self):
+        return len(self._keys) + \
+               sum(1 for key in self._extra if not key in self._key2idx)
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def key_length_data(self):
+        '''Return keys (list), lengths and data (arrays)'''
+        if self._extra:
+            # some values were assigned later, so concatenate
+            return _as_key_length_data(dict(self.iteritems()))
+        return (list(self._keys), np.diff(self._indptr), self._data)
+
+
+def _as_key_length_data(d):
+    '''Helper: keys (as list), value lengths and concatenated values
+    of a mapping with arrays'''
+    if isinstance(d, _CSRDict):
+        return d.key_length_data()
+
+    keys = list(d.keys())
+    arrs = [np.asarray(d[key]).ravel() for key in keys]
+    lengths = np.asarray(map(len, arrs), dtype=np.int_)
+    data = np.hstack(arrs) if arrs else np.zeros((0,), dtype=np.int_)
+    return keys, lengths, data
+
+
+def _as_dict_with_arrays(d):
+    '''Helper: converts compact mappings (also in _src2aux) to dicts'''
+    if isinstance(d, _CSRDict):
+        return dict(d.iteritems())
+    if d and all(isinstance(v, Mapping) for v in d.itervalues()):
+        return dict((k, _as_dict_with_arrays(v)) for k, v in d.iteritems())
+    return d
+
+
+def _merge_array_dicts(ds, dtype=None):
+    '''Helper: merges mappings with arrays and disjoint keys
+
+    Values are converted to dtype if given, otherwise to the type of values
+    in the first non-empty mapping.
+    '''
+    parts = [_as_key_length_data(d) for d in ds]
+
+    if dtype is None:
+        dtypes = [data.dtype for keys, _, data in parts if len(keys)]
+        dtype = dtypes[0] if dtypes else parts[0][2].dtype
+
+    keys = sum((part[0] for part in parts), [])
+    return _CSRDict(keys, np.hstack([part[1] for part in parts]),
+                    np.hstack([part[2].astype(dtype) for part in parts]))
+
+
 def _dict_with_arrays2array_tuple(d):
     '''Helper: converts to a more efficient tuple-based representation
 
@@ -941,7 +1148,10 @@ def _dict_with_arrays2array_tuple(d):
 
     if d is None:
         return None
-    if all(type(v) is dict for v in d.values()):
+    if isinstance(d, _CSRDict):
+        keys, lengths, data = d.key_length_data()
+        return np.asarray(keys), lengths, data
+    if all(isinstance(v, Mapping) for v in d.values()):
         # probably src2aux, so run recursively
         return dict((k, _dict_with_arrays2array_tuple(v))
                         for k, v in d.iteritems())
@@ -977,8 +1187,7 @@ def _dict_with_arrays2array_tuple(d):
             # allocate space for all data in d
             data = np.zeros((ntotal,), dtype=common_dtype)
 
-        idxs = np.arange(length) + pos
-        data[idxs] = v
+        data[pos:pos + length] = v
         pos += length
 
     return keys, lengths, data
@@ -1016,20 +1225,7 @@ def _array_tuple2dict_with_arrays(kld):
         keys, lengths, data = kld
 
         # keys must be python int or str, not numpy int or str
-        keys = keys.tolist()
-
-        # space for output
-        d = dict()
-
-        pos = 0
-        for key, length in zip(keys, lengths):
-            d[key] = data[pos + np.arange(length)]
-            pos += length
-
-        if pos != data.size:
-            raise ValueError('data size mismatch: expected %s, found %s' %
-                                    (data.size, pos))
-        return d
+        return _CSRDict(keys.tolist(), lengths, data)
 
 
 def from_any(s):
@@ -1038,14 +1234,18 @@ def from_any(s):
     Parameters
     ----------
     s: basestring or volume_mask_dict.VolumeMaskDictionary
-        if a string it is assumed to be a file name and loaded using h5load. If
-        a volume_mask_dict.VolumeMaskDictionary then it is returned.
+        if a string it is assumed to be a directory stored by
+        VolumeMaskDictionary.to_npy, or otherwise a file name that is loaded
+        using h5load. If a volume_mask_dict.VolumeMaskDictionary then it is
+        returned.
 
     Returns
     -------
     r: volume_mask_dict.VolumeMaskDictionary
     """
     if isinstance(s, basestring):
+        if osp.isdir(s):
+            return VolumeMaskDictionary.from_npy(s)
         vs = h5load(s)
         return from_any(vs)
     elif isinstance(s, VolumeMaskDictionary):
@@ -14,10 +14,12 @@ Created on Feb 11, 2012
 @author: nick
 '''
 
-import os, collections, datetime, time, heapq, math
+import os, collections, datetime, time, heapq, math, itertools
 
 import numpy as np
 
+from mvpa2.base import externals
+
 _COORD_EPS = 1e-14  # maximum allowed difference between coordinates
 # in order to be considered equal
 
@@ -228,36 +230,93 @@ class Surface(object):
 
         if not hasattr(self, '_nbrs'):
             nbrs = dict()
-            for i in xrange(self._nf):
-                fi = self._f[i]
+            p, q, d = self._edges
+            for i, j, dij in zip(p.tolist(), q.tolist(), d.tolist()):
+                if not i in nbrs:
+                    nbrs[i] = dict()
+                nbrs[i][j] = dij
 
-                for j in xrange(3):
-                    p = fi[j]
-                    q = fi[(j + 1) % 3]
+            self._nbrs = nbrs
 
-                    if p in nbrs and q in nbrs[p]:
-                        continue
+        return dict(self._nbrs)  # make a copy
+
+    @property
+    def _edges(self):
+        '''Node indices and (Euclidean) lengths of all edges.
+
+        Returns
+        -------
+        edges : tuple of np.ndarray
+            Three vectors (p, q, d) so that the edge from node p[i] to node
+            q[i] has length d[i]. Each edge is present in both directions
+            and sorted by p first and q second.
+        '''
+        if not hasattr(self, '_edges_'):
+            f, nv = self._f.astype(np.int64), self._nv
+            p = f.ravel()
+            q = f[:, [1, 2, 0]].ravel()
 
-                    pv = self._v[p]
-                    qv = self._v[q]
+            # unique edges in both directions
+            keys = np.unique(np.hstack((p * nv + q, q * nv + p)))
+            p = keys // nv
+            q = keys % nv
 
-                    # writing this out seems a bit quicker - but have to test
-                    sqdist = ((pv[0] - qv[0]) * (pv[0] - qv[0])
-                              + (pv[1] - qv[1]) * (pv[1] - qv[1])
-                              + (pv[2] - qv[2]) * (pv[2] - qv[2]))
+            d = np.sum((self._v[p] - self._v[q]) ** 2, 1) ** .5
+            self._edges_ = (p, q, d)
 
-                    dist = math.sqrt(sqdist)
-                    if not p in nbrs:
-                        nbrs[p] = dict()
-                    if not q in nbrs:
-                        nbrs[q] = dict()
+        return self._edges_
 
-                    nbrs[q][p] = dist
-                    nbrs[p][q] = dist
+    @property
+    def neighbor_matrix(self):
+        '''Sparse matrix with the (Euclidean) distances between neighbours.
 
-            self._nbrs = nbrs
+        Returns
+        -------
+        nbrs : scipy.sparse.csr_matrix
+            PxP matrix (with P==self.nvertices) so that nbrs[i,j]=d means
+            that the distance from node i to its neighbour j is d. Entries
+            for nodes that are not neighbours are not stored.
 
-        return dict(self._nbrs)  # make a copy
+        Note
+        ----
+        This function computes nbrs if called for the first time, otherwise
+        it caches the results and returns these immediately on the next call.
+        The returned matrix should not be modified.'''
+        if not hasattr(self, '_nbr_csr'):
+            from scipy import sparse
+            p, q, d = self._edges
+            nv = self._nv
+            # construct directly so that edges of length zero are kept
+            indptr = np.searchsorted(p, np.arange(nv + 1))
+            self._nbr_csr = sparse.csr_matrix((d, q, indptr), shape=(nv, nv))
+
+        return self._nbr_csr
+
+    @property
+    def _kdtree(self):
+        '''Spatial index of the vertices.
+
+        Returns
+        -------
+        tree_idxs : tuple
+            Tuple (tree, idxs) with a scipy.spatial.cKDTree of all vertices
+            with finite coordinates, and the node indices of these vertices
+            (so that the i-th point in tree is node idxs[i]).
+
+        Note
+        ----
+        The index is built on the first call and rebuilt if the vertices
+        are replaced.
+        '''
+        cached = getattr(self, '_kdtree_', None)
+        if cached is None or cached[0] is not self._v:
+            from scipy.spatial import cKDTree
+            v = self._v
+            idxs = np.nonzero(np.all(np.isfinite(v), 1))[0]
+            self._kdtree_ = (v, cKDTree(v[idxs]), idxs)
+            cached = self._kdtree_
+
+        return cached[1:]
 
     def circlearound_n2d(self, src, radius, metric='euclidean'):
         '''Finds the distances from a center node to surrounding nodes.
@@ -295,6 +354,58 @@ class Surface(object):
 
         return c
 
+    def circlearound_n2ds(self, srcs, radius, metric='euclidean'):
+        '''Finds the distances from many center nodes to surrounding nodes.
+
+        Parameters
+        ----------
+        srcs : list of int
+            Indices of center nodes
+        radius : float
+            Maximum distance for other nodes to qualify as a 'surrounding'
+            node.
+        metric : string (default: euclidean)
+            'euclidean' or 'dijkstra': distance metric
+
+        Returns
+        -------
+        n2ds : list of dict
+            n2ds[i] is the output of circlearound_n2d for srcs[i].
+
+        Note
+        ----
+        Unlike calling circlearound_n2d for each node, the distances are
+        not computed to all nodes for each center node: Dijkstra distances
+        are computed for blocks of center nodes at once (see
+        dijkstra_distances), and Euclidean distances only for the nodes
+        found nearby using the spatial index of the vertices.
+        '''
+        shortmetric = metric.lower()[0]
+
+        if shortmetric == 'd':
+            return self.dijkstra_distances(srcs, maxdistance=radius)
+
+        srcs = np.asarray(srcs, dtype=np.int_).ravel()
+        v = self._v
+        if shortmetric != 'e' or not externals.exists('scipy') or \
+                not len(srcs) or not np.all(np.isfinite(v[srcs])):
+            return [self.circlearound_n2d(src, radius, metric)
+                    for src in srcs]
+
+        tree, tree_idxs = self._kdtree
+        # allow for rounding differences with the distances computed
+        # below, which decide whether a node is nearby
+        nearby = tree.query_ball_point(v[srcs], radius * (1 + 1e-6) + 1e-9)
+
+        n2ds = []
+        for src, nds in zip(srcs, nearby):
+            nds = np.sort(tree_idxs[np.asarray(nds, dtype=np.int_)])
+            ds = self.euclidean_distance(src, nds)
+            keep = ds <= radius
+            n2ds.append(dict(zip(nds[keep].tolist(), ds[keep].tolist())))
+
+        return n2ds
+
     def dijkstra_distance(self, src, maxdistance=None):
         '''Computes Dijkstra distance from one node to surrounding nodes
 
@@ -318,6 +429,69 @@ class Surface(object):
         Preliminary analyses show that the Dijkstra distance gives very similar
         results to geodesic distances (unpublished results, NNO)
         '''
+        return self.dijkstra_distances([src], maxdistance=maxdistance)[0]
+
+    def dijkstra_distances(self, srcs, maxdistance=None):
+        '''Computes Dijkstra distance from many nodes to surrounding nodes
+
+        Parameters
+        ----------
+        srcs : list of int
+            Indices of center (source) nodes
+        maxdistance: float (default: None)
+            Maximum distance for a node to qualify as a 'surrounding' node.
+            If 'maxdistance is None' then the distances to all nodes is
+            returned.
+
+        Returns:
+        --------
+        n2ds : list of dict
+            n2ds[i] is a dict "n2d" so that n2d[j]=d" is the distance "d"
+            from node "srcs[i]" to node "j".
+
+        Note
+        ----
+        Distances are computed with scipy.sparse.csgraph on the graph in
+        neighbor_matrix, which stops searching beyond maxdistance. Without
+        scipy this falls back to dijkstra_distance_slow for each node.
+        '''
+        srcs = np.asarray(srcs, dtype=np.int_).ravel()
+
+        if not externals.exists('scipy'):
+            return [self.dijkstra_distance_slow(src, maxdistance)
+                    for src in srcs]
+
+        from scipy.sparse import csgraph
+
+        nbrs = self.neighbor_matrix
+        kwargs = dict()
+        if maxdistance is not None:
+            kwargs['limit'] = maxdistance
+
+        # distances are computed for a block of sources at once;
+        # limit the size of each block to ~10M values
+        block_size = max(1, 10000000 // max(self._nv, 1))
+
+        n2ds = []
+        for start in xrange(0, len(srcs), block_size):
+            block = csgraph.dijkstra(nbrs, directed=True,
+                                     indices=srcs[start:start + block_size],
+                                     **kwargs)
+            for ds in np.atleast_2d(block):
+                if maxdistance is None:
+                    nds = np.nonzero(np.isfinite(ds))[0]
+                else:
+                    nds = np.nonzero(ds <= maxdistance)[0]
+                n2ds.append(dict(zip(nds.tolist(), ds[nds].tolist())))
+
+        return n2ds
+
+    def dijkstra_distance_slow(self, src, maxdistance=None):
+        '''Computes Dijkstra distance from one node to surrounding nodes
+
+        Pure python implementation; see dijkstra_distance for the
+        parameters and output.
+        '''
 
         tdist = {src: 0}  # tentative distances
         fdist = dict()  # final distances
@@ -543,6 +717,12 @@ class Surface(object):
         -------
         idxs: numpy.ndarray (P-valued vector)
             Indices of nearest nodes
+
+        Note
+        ----
+        If scipy is available, all coordinates are queried at once using
+        a KD-tree of the vertices; otherwise distances to all vertices are
+        computed for each coordinate.
         '''
 
         if not isinstance(src_coords, np.ndarray):
@@ -565,6 +745,23 @@ class Surface(object):
 
         n = src_coords.shape[0]
         idxs = np.zeros((n,), dtype=np.int)
+
+        if externals.exists('scipy'):
+            if use_mask:
+                from scipy.spatial import cKDTree
+                keep = np.all(np.isfinite(v), 1)
+                tree, tree_idxs = cKDTree(v[keep]), masked_idxs[keep]
+            else:
+                tree, tree_idxs = self._kdtree
+
+            # coordinates that are not finite are mapped to the first node
+            idxs[:] = masked_idxs[0]
+            finite = np.all(np.isfinite(src_coords), 1)
+            if np.any(finite) and len(tree_idxs):
+                _, pos = tree.query(src_coords[finite])
+                idxs[finite] = tree_idxs[pos]
+            return idxs
+
         for i in xrange(n):
             delta = v - src_coords[i]
             minidx = np.argmin(np.sum(delta ** 2, 1))
@@ -762,6 +959,9 @@ class Surface(object):
         If src and trg are both None, then this function checks if the surface
         has two components; if so they are taken as source and target. A use
         case for this behaviour is a surface consisting of two hemispheres
+
+        If max_distance is not None and scipy is available, near pairs are
+        found using KD-trees of the source and target vertices.
         '''
 
         if src is None and trg is None:
@@ -771,6 +971,9 @@ class Surface(object):
             src, trg = (np.asarray([i for i in c]) for c in components)
 
         v = self.vertices
+        if max_distance is not None and externals.exists('scipy'):
+            return self._pairwise_near_nodes_kdtree(max_distance, src, trg)
+
         if max_distance is not None:
             # hopefully we can reduce the number of vertices significantly
             # if src and trg can be seperated easily (as in the case of
@@ -808,6 +1011,30 @@ class Surface(object):
 
         return st2d
 
+    def _pairwise_near_nodes_kdtree(self, max_distance, src, trg):
+        '''Helper function for pairwise_near_nodes using KD-trees'''
+        from scipy.spatial import cKDTree
+
+        v = self.vertices
+        src, trg = [np.asarray(i, dtype=np.int_).ravel() for i in (src, trg)]
+
+        # as in the exhaustive search, nodes without finite coordinates
+        # are never near any other node
+        src, trg = [i[np.all(np.isfinite(v[i]), 1)] for i in (src, trg)]
+        if len(src) == 0 or len(trg) == 0:
+            return dict()
+
+        near = cKDTree(v[src]).query_ball_tree(cKDTree(v[trg]), max_distance)
+
+        counts = np.asarray([len(ns) for ns in near], dtype=np.int_)
+        s = np.repeat(src, counts)
+        t = trg[np.fromiter(itertools.chain.from_iterable(near),
+                            dtype=np.int_, count=np.sum(counts))]
+        d = np.sum((v[s] - v[t]) ** 2, 1) ** .5
+
+        keep = d <= max_distance
+        return dict(zip(zip(s[keep], t[keep]), d[keep]))
+
     def project_vertices(self, n, v=None):
         '''Projects vertex coordinates onto a vector
 
@@ -943,7 +1170,8 @@ class Surface(object):
 
     def __reduce__(self):
         # these are lazily computed on the first call to e.g. node2faces
-        lazy_keys = ('_n2f', '_f2el', '_v2ael', '_e2f', '_nbrs')
+        lazy_keys = ('_n2f', '_f2el', '_v2ael', '_e2f', '_nbrs', '_edges_',
+                     '_nbr_csr', '_kdtree_')
         lazy_dict = dict()
         # TODO: add in efficient way to translate these dictionaries
         #       to something like a numpy array, and implement the 
@@ -1329,8 +1557,10 @@ class Surface(object):
         MapIcosahedron, where the lower resolution surface defines centers
         in a searchlight whereas the higher resolution surfaces is used to
         delineate the grey matter for voxel selection.
-        This function implements an optimization which in most cases
-        yields solutions much faster than map_to_high_resolution_surf_exact,
+        If scipy is available, nearest nodes are found for all nodes at
+        once using a KD-tree of the high resolution surface. Otherwise
+        this function implements an optimization which in most cases
+        yields solutions much faster than map_to_high_resolution_surf_slow,
         but may fail to find the correct solution for larger values
         of epsilon.
 
@@ -1393,6 +1623,23 @@ class Surface(object):
             raise ValueError("Other surface has fewer nodes (%d) than "
                              "this one (%d)" % (nx, ny))
 
+        if externals.exists('scipy'):
+            tree, tree_idxs = highres._kdtree
+            if len(tree_idxs) == 0:
+                raise ValueError("Empty sequence: no node in high resolution "
+                                 "surface has finite coordinates")
+
+            # centers that are not finite are not mapped
+            idxs = np.nonzero(np.all(np.isfinite(x), 1))[0]
+            ds, pos = tree.query(x[idxs])
+
+            if epsilon is not None:
+                far = np.nonzero(np.logical_not(ds < epsilon))[0]
+                if len(far):
+                    raise ValueError("Not found for node %i: %s > %s" %
+                                     (idxs[far[0]], ds[far[0]], epsilon))
+
+            return dict(zip(idxs, tree_idxs[pos]))
 
         # use a fast approach
         # slice up the high and low res in smaller boxes
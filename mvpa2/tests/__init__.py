@@ -261,6 +261,7 @@ def collect_nose_tests(verbosity=1):
         'test_surfing_surface',
         'test_eeglab',
         'test_progress',
+        'test_parallel',
         'test_winner',
         'test_viz',
         ]
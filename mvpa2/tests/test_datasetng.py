@@ -630,6 +630,40 @@ def test_combined_samplesfeature_selection():
     ok_(isinstance(single.samples, myarray))
 
 
+def test_lazy_slicing():
+    data = dataset_wizard(np.arange(40).reshape((8, 5)),
+                          targets=range(8), chunks=[0, 1] * 4)
+    data.fa['ids'] = np.arange(5)
+    lazy = data.copy(deep=False)
+    lazy.lazy_slicing = True
+    for sel in (slice(2, 6), [2, 3, 4, 5], data.targets > 3,
+                [1, 0, 7]):
+        for fsel in (slice(None), [1, 2], [4, 0]):
+            eager_sel = data[sel, fsel]
+            lazy_sel = lazy[sel, fsel]
+            ok_(lazy_sel.lazy_slicing)
+            assert_equal(len(lazy_sel.sa.targets), eager_sel.nsamples)
+            # not sliced until accessed
+            ok_(lazy_sel.sa['targets']._lazy is not None)
+            assert_array_equal(lazy_sel.samples, eager_sel.samples)
+            assert_array_equal(lazy_sel.targets, eager_sel.targets)
+            assert_array_equal(lazy_sel.chunks, eager_sel.chunks)
+            assert_array_equal(lazy_sel.fa.ids, eager_sel.fa.ids)
+            ok_(lazy_sel.sa['targets']._lazy is None)
+            assert_array_equal(
+                lazy_sel.a.mapper.reverse(lazy_sel.samples),
+                eager_sel.a.mapper.reverse(eager_sel.samples))
+    # consecutive selections are views
+    assert_true(np.may_share_memory(lazy[[2, 3, 4]].samples, data.samples))
+    assert_true(np.may_share_memory(lazy[data.targets > 3].samples,
+                                    data.samples))
+    assert_false(np.may_share_memory(data[[2, 3, 4]].samples, data.samples))
+    # copies and pickles carry the values
+    lazy_sel = lazy[:3, [1, 2]]
+    assert_array_equal(copy.deepcopy(lazy_sel).fa.ids, [1, 2])
+    assert_array_equal(copy.copy(lazy_sel[1:]).targets, [1, 2])
+
+
 @reseed_rng()
 def test_labelpermutation_randomsampling():
     ds = vstack([Dataset.from_wizard(np.ones((5, 10)), targets=range(5), chunks=i)
@@ -1058,6 +1092,43 @@ def test_npz_io(dsfile):
     assert_datasets_equal(ds2, ds2_)
 
 
+@with_tempfile()
+def test_npy_io(dsdir):
+    ds = datasets['3dlarge'].copy()
+    ds.a.pop('mapper')
+    ds.sa['objs'] = np.array([{'a': i} for i in range(len(ds))], dtype=object)
+    ds.to_npy(dsdir)
+
+    ds2 = Dataset.from_npy(dsdir)
+    # samples are memory-mapped read-only
+    assert_true(isinstance(ds2.samples, np.memmap))
+    assert_false(ds2.samples.flags.writeable)
+    assert_datasets_equal(ds, ds2)
+    # arrays of objects cannot be mapped but are loaded
+    assert_equal(list(ds2.sa.objs), list(ds.sa.objs))
+
+    # from_npz opens such directories as well
+    assert_datasets_equal(ds, Dataset.from_npz(dsdir))
+
+    # loading into memory
+    ds3 = Dataset.from_npy(dsdir, mmap_mode=None)
+    assert_false(isinstance(ds3.samples, np.memmap))
+    assert_datasets_equal(ds, ds3)
+
+    # storing again overwrites the previous content
+    ds.sa.pop('objs')
+    ds.to_npy(dsdir)
+    assert_false('objs' in Dataset.from_npy(dsdir).sa)
+    # and leaves no arrays of the previous content behind
+    import json
+    from mvpa2.base.dataset import _NPY_MANIFEST
+    with open(os.path.join(dsdir, _NPY_MANIFEST)) as f:
+        stored = json.load(f)['entries'].values()
+    assert_equal(sorted(os.listdir(dsdir)), sorted(stored + [_NPY_MANIFEST]))
+
+    assert_raises(ValueError, Dataset.from_npy, os.path.dirname(dsdir))
+
+
 def test_all_equal():
     # all these values are supposed to be different from each other
     # but equal to themselves
@@ -54,7 +54,7 @@ def test_glm_mapper():
     assert_equal(bold.nfeatures, 2)
     assert('model' in bold.sa)
     reg_names = ['model']
-    implementations = []
+    implementations = [OLSGLMMapper]
     if externals.exists('nipy'):
         implementations.append(NiPyGLMMapper)
     if externals.exists('statsmodels'):
@@ -102,3 +102,69 @@ def test_glm_mapper():
     # should really have very similar results, independent of actual model fit details
     assert(np.corrcoef(ds1.samples.ravel(), ds2.samples.ravel())[0,1] > 0.99)
 
+
+
+def test_ols_glm():
+    from mvpa2.misc.ols import ols_fit
+    bold = get_bold()
+    X = np.vstack((bold.sa.model, np.linspace(-1, 1, len(bold)),
+                   np.ones(len(bold)))).T
+    Y = np.hstack([bold.samples] * 3)
+    fit = ols_fit(X, Y)
+    betas, ssr = np.linalg.lstsq(X, Y)[:2]
+    assert_array_almost_equal(fit.params, betas)
+    assert_array_almost_equal(fit.ssr, ssr)
+    assert_equal(fit.df_resid, len(X) - 3)
+    # chunking doesn't matter
+    assert_array_almost_equal(ols_fit(X, Y, chunk_size=4).bse, fit.bse)
+    # t-contrast of a single parameter is its t-value
+    tstats = fit.t_test([1, 0, 0])
+    assert_array_almost_equal(tstats.tvalue, fit.tvalues[0])
+    assert_array_almost_equal(tstats.pvalue, fit.pvalues[0])
+    # F-test of a single contrast is the square of the t-test
+    fstats = fit.f_test([[1, 0, 0]])
+    assert_array_almost_equal(fstats.fvalue, tstats.tvalue ** 2)
+    assert_array_almost_equal(fstats.pvalue, tstats.pvalue)
+    assert_raises(ValueError, fit.t_test, [1, 0])
+
+    # prewhitening retains the signal, but changes the estimates
+    ar1 = ols_fit(X, Y, ar1=True)
+    assert_equal(ar1.rho.shape, (Y.shape[1],))
+    assert_true(np.all(np.abs(ar1.rho) < 1))
+    assert_true(np.all(ar1.tvalues[0, ::2] > ar1.tvalues[0, 1::2]))
+    assert_array_almost_equal(ols_fit(X, Y, ar1=True, chunk_size=2).params,
+                              ar1.params)
+
+    # same through the mapper
+    mapper = OLSGLMMapper(['model'], add_constant=True, results='tvalues')
+    tvalues = mapper(bold)
+    assert_array_equal(tvalues.sa.regressor_names, ['model', 'constant'])
+    assert_equal(len(OLSGLMMapper(['model'], results=[1])(bold)), 6)
+
+    if externals.exists('statsmodels'):
+        import statsmodels.api as sm
+        from mvpa2.measures.statsmodels_adaptor import UnivariateStatsModels
+        ds = Dataset(Y)
+        for res in ('params', 'bse', 'tvalues', 'pvalues', 'ssr', 'scale',
+                    [1, -1, 0], [[1, 0, 0], [0, 1, 0]]):
+            native = UnivariateStatsModels(X, 'ols', res=res,
+                                           add_constant=False)(ds)
+            ref = UnivariateStatsModels(X, lambda y, x: sm.OLS(y, x), res=res,
+                                        add_constant=False)(ds)
+            assert_equal(native.shape, ref.shape)
+            assert_array_almost_equal(native.samples, ref.samples)
+
+        # results not provided by the native fit are left to StatsModels
+        from mvpa2.measures.statsmodels_adaptor import GLM
+        from mvpa2.mappers.glm.statsmodels_glm import StatsmodelsGLMMapper
+        rsquared = GLM(X, voi='rsquared')(ds)
+        assert_equal(rsquared.shape, (1, ds.nfeatures))
+        assert_array_almost_equal(
+            rsquared.samples[0],
+            [sm.OLS(y, X).fit().rsquared for y in Y.T])
+        resid = StatsmodelsGLMMapper(['model'], add_constant=True,
+                                     results='resid')(bold)
+        assert_equal(resid.shape, bold.shape)
+        assert_raises(ValueError, UnivariateStatsModels, X, 'ols',
+                      res='rsquared')
+    assert_raises(ValueError, OLSGLMMapper(['model'], results='resid'), bold)
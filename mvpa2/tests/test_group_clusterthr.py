@@ -50,6 +50,13 @@ def test_pval():
     assert_almost_equal(thresholds, dsthresholds)
     assert_raises(ValueError,
                   gct.get_thresholding_map, x, p=0.00000001)
+    # streamed in blocks of rows of various sizes
+    for nrows in (1, 77, 1000, len(x)):
+        assert_array_equal(
+            gct.get_thresholding_map(
+                (x[i:i + nrows] for i in xrange(0, len(x), nrows)),
+                p=0.001, nsamples=len(x)),
+            expected_result)
 
     x = range(0, 100, 5)
     null_dist = np.repeat(1, 100).astype(float)[None]
@@ -140,6 +147,23 @@ def test_cluster_count():
                            gct.get_cluster_sizes(ds))
 
 
+def test_cluster_count_batched():
+    # maps labeled together must give the same sizes as labeled one by one,
+    # and touching clusters of subsequent maps must not get merged
+    maps = np.random.rand(12, 5, 4, 3) > 0.6
+    maps[0] = True
+    maps[1] = True
+    maps[[2, 5, 11]] = False
+    ds = dataset_wizard(maps)
+    expected = Counter()
+    for m in maps:
+        expected.update(gct._get_map_cluster_sizes(m))
+    assert_equal(expected[0], 3)
+    assert_equal(expected[60], 2)
+    assert_equal(gct.get_cluster_sizes(ds), expected)
+    assert_equal(Counter(gct._get_maps_cluster_sizes(maps)), expected)
+
+
 # run same test with parallel and serial execution
 @sweepargs(n_proc=[1, 2])
 def test_group_clusterthreshold_simple(n_proc):
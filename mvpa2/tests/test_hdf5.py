@@ -174,6 +174,66 @@ def test_dataset_without_chunks(fname):
     ok_(ds_loaded.a.custom == ds.a.custom)
 
 
+@sweepargs(kwargs=(dict(),
+                   dict(chunks=(3, 4), compression='lzf'),
+                   dict(chunks=True, compression='gzip')))
+@with_tempfile(suffix='.hdf5')
+def test_partial_load(fname, kwargs=None):
+    ds = datasets['3dsmall'].copy()
+    ds.sa['run'] = np.arange(len(ds)) % 3
+    ds.fa['roi'] = np.arange(ds.nfeatures) % 4
+    # unicode attributes are stored as views of their bytes
+    ds.sa['label'] = np.array([u'l%d' % i for i in xrange(len(ds))])
+    ds.fa['tags'] = np.array([[u't%d' % i, u'u%d' % i]
+                              for i in xrange(ds.nfeatures)])
+    h5save(fname, ds, **kwargs)
+    hdf = h5py.File(fname, 'r')
+    try:
+        samples = hdf['rcargs/items/0']
+        if kwargs.get('chunks') == (3, 4):
+            assert_equal(samples.chunks, (3, 4))
+        if 'compression' in kwargs:
+            assert_equal(samples.compression, kwargs['compression'])
+    finally:
+        hdf.close()
+
+    # everything
+    assert_datasets_equal(h5load(fname), ds)
+    for samples, features in ((None, [3, 1, 1]),
+                              ([4, 0], None),
+                              (slice(2, 7), np.arange(ds.nfeatures) > 5),
+                              ({'run': [0, 2]}, {'roi': 1}),
+                              ([-1], slice(None, None, 2))):
+        sub = h5load(fname, samples=samples, features=features)
+        sids = np.arange(len(ds))
+        if isinstance(samples, dict):
+            sids = np.flatnonzero(np.in1d(ds.sa.run, samples['run']))
+        elif samples is not None:
+            sids = sids[samples]
+        fids = np.arange(ds.nfeatures)
+        if isinstance(features, dict):
+            fids = np.flatnonzero(ds.fa.roi == features['roi'])
+        elif features is not None:
+            fids = fids[features]
+        assert_datasets_equal(sub, ds[sids][:, fids], ignore_a=['mapper'])
+        # mapper knows about the feature selection
+        assert_equal(sub.a.mapper.reverse(sub).shape[1:],
+                     ds.a.mapper.reverse(ds).shape[1:])
+
+    assert_equal(h5load(fname, samples=[]).shape, (0, ds.nfeatures))
+
+    # selected attributes only
+    sub = h5load(fname, samples={'run': 1}, sa=['run'], fa=[], a=[])
+    assert_equal(sub.sa.keys(), ['run'])
+    assert_equal(len(sub.fa), 0)
+    assert_equal(len(sub.a), 0)
+    assert_array_equal(sub.samples, ds[ds.sa.run == 1].samples)
+    assert_raises(ValueError, h5load, fname, samples={'unknown': 1})
+    # no dataset to select from
+    h5save(fname, [1, 2])
+    assert_raises(ValueError, h5load, fname, samples=[0])
+
+
 @with_tempfile()
 def test_recursion(fname):
     obj = range(2)
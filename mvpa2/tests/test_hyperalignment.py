@@ -8,8 +8,10 @@
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 """Unit tests for PyMVPA ..."""
 
+import os
 import unittest
 import numpy as np
+from glob import glob
 
 from mvpa2.base import cfg
 from mvpa2.datasets.base import Dataset
@@ -258,6 +260,65 @@ class HyperAlignmentTests(unittest.TestCase):
         ha = Hyperalignment(nproc=0)
         mappers = ha(dss_rotated)
 
+    @sweepargs(backend=(None, 'threads', 'multiprocessing'))
+    @with_tempfile()
+    def test_hpal_from_files(self, tempdir, backend=None):
+        ds4l = datasets['uni4large']
+        dss_rotated = [random_affine_transformation(ds4l, scale_fac=100, shift_fac=10)
+                       for i in range(4)]
+        os.mkdir(tempdir)
+        filenames = []
+        for i, ds in enumerate(dss_rotated):
+            if i % 2:
+                filename = os.path.join(tempdir, 'ds%i.npy' % i)
+                np.save(filename, ds.samples)
+            else:
+                filename = os.path.join(tempdir, 'ds%i.npz' % i)
+                ds.to_npz(filename)
+            filenames.append(filename)
+        kwargs = dict(zscore_all=True, level2_niter=2,
+                      enable_ca=['residual_errors', 'training_residual_errors'])
+        ha = Hyperalignment(**kwargs)
+        mappers = ha(dss_rotated)
+        if backend is not None:
+            kwargs.update(backend=backend, nproc=2)
+        ha_files = Hyperalignment(tmp_prefix=os.path.join(tempdir, 'hpal'),
+                                  **kwargs)
+        mappers_files = ha_files(filenames)
+        assert_array_almost_equal(ha.commonspace, ha_files.commonspace)
+        assert_array_almost_equal(ha.ca.training_residual_errors.samples,
+                                  ha_files.ca.training_residual_errors.samples)
+        assert_array_almost_equal(ha.ca.residual_errors.samples,
+                                  ha_files.ca.residual_errors.samples)
+        for m, mf, ds in zip(mappers, mappers_files, dss_rotated):
+            assert_array_almost_equal(m.forward(ds).samples,
+                                      mf.forward(ds).samples)
+        # projections stored while training are gone
+        assert_equal(glob(os.path.join(tempdir, 'hpal*')), [])
+        # preprocessing of each file was trained once and kept for reuse
+        assert_equal(sorted(ha_files._premappers), sorted(filenames))
+        assert_true(all(len(pm) == 1
+                        for pm in ha_files._premappers.itervalues()))
+
+    @with_tempfile()
+    def test_hpal_nfeatures_from_files(self, tempdir):
+        from mvpa2.algorithms.hyperalignment import _get_nfeatures
+        ds = datasets['uni4large']
+        os.mkdir(tempdir)
+        filenames = [os.path.join(tempdir, 'ds.npy'),
+                     os.path.join(tempdir, 'ds.npz'),
+                     os.path.join(tempdir, 'ds_npy')]
+        np.save(filenames[0], ds.samples)
+        ds.to_npz(filenames[1])
+        ds.to_npy(filenames[2])
+        if externals.exists('h5py'):
+            from mvpa2.base.hdf5 import h5save
+            filenames.append(os.path.join(tempdir, 'ds.hdf5'))
+            h5save(filenames[-1], ds)
+        for filename in filenames:
+            assert_equal(_get_nfeatures(filename), ds.nfeatures)
+        assert_equal(_get_nfeatures(ds), ds.nfeatures)
+
     def test_hypal_michael_caused_problem(self):
         from mvpa2.misc import data_generators
         from mvpa2.mappers.zscore import zscore
@@ -15,6 +15,7 @@ from mvpa2.testing.datasets import pure_multivariate_signal
 
 from mvpa2.clfs.knn import kNN
 from mvpa2.clfs.distance import one_minus_correlation
+from mvpa2.datasets.base import dataset_wizard
 
 class KNNTests(unittest.TestCase):
 
@@ -63,6 +64,44 @@ class KNNTests(unittest.TestCase):
         self.assertTrue(not (clf.ca.distances.fa['chunks'] is train.sa['chunks']))
         self.assertTrue(not (clf.ca.distances.fa.chunks is train.sa.chunks))
 
+
+    def test_knn_chunked_and_ties(self):
+        train = pure_multivariate_signal(20, 3)
+        test = pure_multivariate_signal(15, 3)
+
+        clf = kNN(k=5)
+        clf.ca.enable(['estimates', 'distances'])
+        clf.train(train)
+        p = clf.predict(test.samples)
+        estimates = clf.ca.estimates
+        distances = clf.ca.distances.samples
+
+        for chunk_size in (1, 7, 1000):
+            clf_chunked = kNN(k=5, chunk_size=chunk_size)
+            clf_chunked.ca.enable(['estimates', 'distances'])
+            clf_chunked.train(train)
+            self.assertEqual(clf_chunked.predict(test.samples), p)
+            self.assertEqual(clf_chunked.ca.estimates, estimates)
+            assert_array_equal(clf_chunked.ca.distances.samples, distances)
+
+        # ties are broken by the mean distance to the neighbors of a class
+        ds = dataset_wizard([[0.], [1.], [3.], [4.5]],
+                            targets=['a', 'b', 'a', 'b'])
+        for voting in ('majority', 'weighted'):
+            clf = kNN(k=2, voting=voting)
+            clf.ca.enable(['estimates'])
+            clf.train(ds)
+            self.assertEqual(list(clf.predict([[0.4], [0.6], [3.7], [3.8]])),
+                             ['a', 'b', 'a', 'b'])
+            self.assertEqual(clf.ca.estimates[0]['a'],
+                             clf.ca.estimates[0]['b'])
+        # k larger than the number of training samples
+        clf = kNN(k=10, voting='majority')
+        clf.ca.enable(['estimates'])
+        clf.train(ds[:3])
+        self.assertEqual(list(clf.predict([[4.]])), ['a'])
+        self.assertEqual(clf.ca.estimates, [{'a': 2, 'b': 1}])
+
 def suite():  # pragma: no cover
     return unittest.makeSuite(KNNTests)
 
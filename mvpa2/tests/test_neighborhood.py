@@ -17,7 +17,7 @@ import mvpa2.misc.neighborhood as ne
 from mvpa2.clfs.distance import *
 
 from mvpa2.testing.tools import ok_, assert_raises, assert_false, assert_equal, \
-        assert_array_equal
+        assert_array_equal, with_tempfile
 from mvpa2.testing.datasets import datasets
 
 def test_distances():
@@ -230,6 +230,55 @@ def test_query_engine():
                        [0, 1, 3, 9, 27, 28, 30, 36])
 
 
+def test_query_batch():
+    def check_batch(qe, ids=None):
+        ids_ = qe.ids if ids is None else ids
+        indptr, indices = qe.query_batch(ids)
+        assert_equal(len(indptr), len(ids_) + 1)
+        for i, fid in enumerate(ids_):
+            assert_array_equal(indices[indptr[i]:indptr[i + 1]], qe[fid])
+
+    data = np.arange(54)
+    ind = np.transpose((np.ones((3, 3, 3)).nonzero()))
+    ds = Dataset([data, data], fa={'s_ind': np.concatenate((ind, ind)),
+                                   't_ind': np.repeat([0, 1], 27)})
+    for qe in (ne.IndexQueryEngine(s_ind=ne.Sphere(1), t_ind=None),
+               ne.IndexQueryEngine(s_ind=ne.Sphere(2), t_ind=ne.Sphere(1)),
+               ne.IndexQueryEngine(s_ind=ne.HollowSphere(1, 0), t_ind=None),
+               ne.IndexQueryEngine(s_ind=ne.IdentityNeighborhood(),
+                                   t_ind=ne.Sphere(1)),
+               ne.IndexQueryEngine(s_ind=ne.Sphere(0.5), t_ind=None)):
+        qe.train(ds)
+        ok_(qe._get_batch_index() is not None)
+        check_batch(qe)
+        check_batch(qe, [53, 0, 3])
+        check_batch(qe, [])
+
+    # masked dataset with non-contiguous coordinates
+    ds = datasets['3dlarge'].copy()
+    ds = ds[:, np.arange(0, ds.nfeatures, 3)]
+    qe = ne.IndexQueryEngine(myspace=ne.Sphere(2))
+    qe.train(ds)
+    check_batch(qe)
+    # unsorted ones are the same sets of features
+    qe_unsorted = ne.IndexQueryEngine(myspace=ne.Sphere(2), sorted=False)
+    qe_unsorted.train(ds)
+    indptr, indices = qe_unsorted.query_batch()
+    for i in xrange(ds.nfeatures):
+        assert_equal(set(indices[indptr[i]:indptr[i + 1]]), set(qe[i]))
+
+    # literal attributes lead to the generic implementation
+    ds.fa['lit'] = np.array(['roi1', 'ro2', 'r3'])[np.arange(ds.nfeatures) % 3]
+    qe_lit = ne.IndexQueryEngine(myspace=ne.Sphere(1), lit=None)
+    qe_lit.train(ds)
+    ok_(qe_lit._get_batch_index() is None)
+    check_batch(qe_lit)
+    # and so does the cached one
+    qec = ne.CachedQueryEngine(ne.IndexQueryEngine(myspace=ne.Sphere(1)))
+    qec.train(ds)
+    check_batch(qec)
+
+
 def test_cached_query_engine():
     """Test cached query engine
     """
@@ -277,6 +326,90 @@ def test_cached_query_engine():
     #ds2.fa.myspace = ds2.fa.myspace*3
     #assert_raises(ValueError, qec.train, ds2)
 
+
+@with_tempfile()
+def test_cached_query_engine_on_disk(cache_dir):
+    ds = datasets['3dlarge'].copy()
+    qe = ne.IndexQueryEngine(myspace=ne.Sphere(2))
+    qe.train(ds)
+    qec = ne.CachedQueryEngine(ne.IndexQueryEngine(myspace=ne.Sphere(2)),
+                               cache_dir=cache_dir)
+    qec.train(ds)
+    cached = os.listdir(cache_dir)
+    assert_equal(len(cached), 3)
+    for fid in (0, 10, ds.nfeatures - 1):
+        assert_equal(qec[fid], qe[fid])
+
+    # another engine (e.g. in another process) reuses stored neighborhoods
+    qec2 = ne.CachedQueryEngine(ne.IndexQueryEngine(myspace=ne.Sphere(2)),
+                                cache_dir=cache_dir)
+    qec2.train(ds.copy())
+    assert_equal(sorted(os.listdir(cache_dir)), sorted(cached))
+    ok_(isinstance(qec2._csr[2], np.memmap))
+    assert_equal([qec2[fid] for fid in xrange(ds.nfeatures)],
+                 [qe[fid] for fid in xrange(ds.nfeatures)])
+    ids = [5, 0, ds.nfeatures - 1, 5]
+    indptr, indices = qec2.query_batch(ids)
+    for i, fid in enumerate(ids):
+        assert_array_equal(indices[indptr[i]:indptr[i + 1]], qe[fid])
+    assert_array_equal(qec2.query_batch()[0], qe.query_batch()[0])
+
+    # different configuration or coordinates -- different neighborhoods
+    ne.CachedQueryEngine(ne.IndexQueryEngine(myspace=ne.Sphere(1)),
+                         cache_dir=cache_dir).train(ds)
+    assert_equal(len(os.listdir(cache_dir)), 6)
+    ds.fa.myspace = ds.fa.myspace[::-1]
+    qec2.untrain()
+    qec2.train(ds)
+    assert_equal(len(os.listdir(cache_dir)), 9)
+
+    # ids which are not cached are not silently mapped to others
+    assert_raises(ValueError, qec2.query_batch, [0, ds.nfeatures])
+
+    # cached ids need not be sorted (e.g. if they are keys of a dict)
+    perm = np.random.permutation(ds.nfeatures)
+    qec2._csr = (perm,) + tuple(qe.query_batch(perm))
+    qec2._csr_lookup = None
+    qec2._lookup_ids = [None] * ds.nfeatures
+    ids = [5, 0, ds.nfeatures - 1, 5]
+    indptr, indices = qec2.query_batch(ids)
+    for i, fid in enumerate(ids):
+        assert_array_equal(indices[indptr[i]:indptr[i + 1]], qe[fid])
+    assert_equal(qec2[7], qe[7])
+
+
+def test_content_hash():
+    def content_hash(obj):
+        h = ne.hashlib.sha1()
+        ne._update_content_hash(h, obj)
+        return h.hexdigest()
+
+    # large arrays differing only in values that repr would leave out
+    a = np.zeros((100, 100))
+    b = a.copy()
+    b[50, 50] = 1
+    ok_(content_hash(a) != content_hash(b))
+    assert_equal(content_hash(a), content_hash(a.copy()))
+
+    # same configuration in different instances
+    assert_equal(content_hash(ne.Sphere(2, distance_func=manhattan_distance)),
+                 content_hash(ne.Sphere(2, distance_func=manhattan_distance)))
+    ok_(content_hash(ne.Sphere(2)) !=
+        content_hash(ne.Sphere(2, distance_func=manhattan_distance)))
+    ok_(content_hash(ne.Sphere(2)) != content_hash(ne.Sphere(3)))
+    assert_equal(content_hash(ne.IndexQueryEngine(myspace=ne.Sphere(2))),
+                 content_hash(ne.IndexQueryEngine(myspace=ne.Sphere(2))))
+
+    # functions differing only in defaults or values they closed over
+    def scaled_distance(scale):
+        return lambda a, b: scale * manhattan_distance(a, b)
+    assert_equal(content_hash(scaled_distance(2)),
+                 content_hash(scaled_distance(2)))
+    ok_(content_hash(scaled_distance(2)) != content_hash(scaled_distance(3)))
+    ok_(content_hash(ne.Sphere(2, distance_func=scaled_distance(2))) !=
+        content_hash(ne.Sphere(2, distance_func=scaled_distance(3))))
+    ok_(content_hash(lambda a, b, p=1: p) != content_hash(lambda a, b, p=2: p))
+
 def test_scattered_neighborhoods():
     radius = 1
     sphere = ne.Sphere(radius)
@@ -0,0 +1,154 @@
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+#
+#   See COPYING file distributed along with the PyMVPA package for the
+#   copyright and license terms.
+#
+### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
+"""Unit tests for PyMVPA parallel executors"""
+
+import os
+import numpy as np
+
+from mvpa2.base import externals
+from mvpa2.base.parallel import get_executor, get_blocks, get_nproc, \
+     parallel_backends, Executor, SerialExecutor, SharedArray, share_array, \
+     share_dataset, release_shared
+from mvpa2.testing import assert_equal, assert_raises, assert_true, \
+     assert_false, assert_array_equal
+from mvpa2.testing.sweep import sweepargs
+
+
+def _available_backends():
+    return [b for b, cls in sorted(parallel_backends.items())
+            if cls.external is None or externals.exists(cls.external)]
+
+
+@sweepargs(backend=_available_backends())
+def test_executor_map(backend):
+    # local function and (unpicklable) lambda -- should be fine for all
+    # backends which do not need to pickle the job
+    offset = 10
+    def fx(a, b=0):
+        return (a + b + offset, os.getpid())
+
+    executor = get_executor(backend, nproc=2)
+    assert_equal(executor.nproc, 2)
+    tasks = [((i,), dict(b=i)) for i in range(7)]
+    if backend == 'joblib':
+        # joblib must pickle, so use a module-level function
+        res = list(executor.map(_double, tasks))
+        assert_equal(res, [i * 4 for i in range(7)])
+        return
+    res = list(executor.map(fx, tasks))
+    assert_equal([r[0] for r in res], [2 * i + 10 for i in range(7)])
+    if backend == 'serial':
+        assert_equal(set(r[1] for r in res), set([os.getpid()]))
+    # no tasks -- no results
+    assert_equal(list(executor.map(fx, [])), [])
+
+
+def _double(a, b=0):
+    return 2 * (a + b)
+
+
+def test_executor_exceptions():
+    def fx(a):
+        if a == 3:
+            raise ValueError("thrown on purpose")
+        return a
+    for backend in ('serial', 'multiprocessing', 'threads'):
+        executor = get_executor(backend, nproc=2)
+        assert_raises(ValueError, list,
+                      executor.map(fx, [((i,), {}) for i in range(5)]))
+
+
+def test_get_executor():
+    assert_raises(ValueError, get_executor, 'bogus')
+    executor = SerialExecutor()
+    assert_true(get_executor(executor) is executor)
+    assert_equal(executor.nproc, 1)
+    assert_true(isinstance(get_executor(), Executor))
+    assert_equal(get_nproc(3, 'serial'), 3)
+    assert_equal(get_nproc(None, 'serial'), 1)
+    assert_equal(get_nproc(None, executor), 1)
+    if not externals.exists('pprocess'):
+        # we do not go parallel by default unless asked for
+        assert_equal(get_nproc(), 1)
+
+
+def test_get_blocks():
+    ids = np.arange(1000)
+    blocks = get_blocks(ids, 4)
+    assert_array_equal(np.hstack(blocks), ids)
+    sizes = [len(b) for b in blocks]
+    # decreasing sizes, so we have more blocks than workers
+    assert_true(len(blocks) > 4)
+    assert_equal(sizes, sorted(sizes, reverse=True))
+    # but not too small (besides the remainder)
+    assert_equal(min(sizes[:-1]), 1000 // 64)
+
+    # static split
+    blocks = get_blocks(ids, 4, nblocks=3)
+    assert_equal([len(b) for b in blocks], [334, 333, 333])
+    # fewer ids than workers
+    assert_equal(len(get_blocks(range(3), 4)), 3)
+    assert_equal(len(get_blocks(range(10), 1)), 1)
+    assert_array_equal(np.hstack(get_blocks(range(10), 1)), range(10))
+
+
+def test_share_array():
+    import cPickle
+    a = np.arange(2000.).reshape(40, 50)
+    sa = share_array(a, prefix='test_share_array')
+    filename = sa._shared_info[0]
+    try:
+        assert_true(os.path.exists(filename))
+        assert_array_equal(sa, a)
+        # read-only by default
+        assert_raises(ValueError, sa.__setitem__, 0, 1)
+        # pickled as a reference to the file
+        s = cPickle.dumps(sa, protocol=2)
+        assert_true(len(s) < a.nbytes)
+        assert_array_equal(cPickle.loads(s), a)
+        # so are views
+        for v in (sa[1:3], sa[:, ::-2], sa.T):
+            s = cPickle.dumps(v, protocol=2)
+            assert_true(len(s) < a.nbytes)
+            assert_array_equal(cPickle.loads(s), v)
+        # but not the results of computation
+        assert_array_equal(cPickle.loads(cPickle.dumps(sa * 2)), a * 2)
+        assert_false(isinstance(cPickle.loads(cPickle.dumps(sa * 2)),
+                                SharedArray))
+
+        # writable one, which is zero-initialized
+        out = share_array(shape=(2, 3), dtype=int, readonly=False)
+        out_ = cPickle.loads(cPickle.dumps(out[1]))
+        out_[1] = 5
+        assert_array_equal(out, [[0, 0, 0], [0, 5, 0]])
+        release_shared(out)
+    finally:
+        release_shared(sa)
+    assert_true(not os.path.exists(filename))
+    # objects are not sharable
+    assert_raises(ValueError, share_array, np.array([{}], dtype=object))
+
+
+def test_share_dataset():
+    from mvpa2.datasets import Dataset
+    ds = Dataset(np.arange(12.).reshape(3, 4),
+                 sa={'targets': ['a', 'b', 'c']},
+                 fa={'ids': range(4), 'obj': np.array([{}] * 4)})
+    sds, shared = share_dataset(ds)
+    try:
+        assert_equal(len(shared), 2)
+        assert_true(isinstance(sds.samples, SharedArray))
+        assert_true(isinstance(sds.fa['ids'].value, SharedArray))
+        assert_true(sds.fa['obj'].value is ds.fa['obj'].value)
+        assert_array_equal(sds.samples, ds.samples)
+        assert_array_equal(sds[:, 1:].samples, ds[:, 1:].samples)
+        # original remains intact
+        assert_false(isinstance(ds.samples, SharedArray))
+    finally:
+        release_shared(shared)
@@ -163,6 +163,58 @@ class ProcrusteanMapperTests(unittest.TestCase):
                             msg='Procrustes with reflection should work better, '
                             'but %f > %f' % (norm4, norm2))
 
+    @sweepargs(svd=('gram', 'randomized'))
+    @reseed_rng()
+    def test_svd_subspace(self, svd):
+        # more dimensions than samples
+        d_s = np.random.normal(size=(20, 50))
+        R = get_random_rotation(50)
+        d_t = np.dot(0.5 * d_s, R) + 1.0
+        ds = dataset_wizard(samples=d_s, targets=d_t)
+        pm = ProcrusteanMapper()
+        pm.train(ds)
+        pm_ = ProcrusteanMapper(svd=svd)
+        pm_.train(ds)
+        assert_almost_equal(pm_._scale, pm._scale)
+        # identical within the space spanned by the training data
+        assert_array_almost_equal(pm_.forward(d_s), pm.forward(d_s))
+        assert_array_almost_equal(pm_.forward(d_s), d_t)
+        assert_array_almost_equal(pm_.reverse(d_t), d_s)
+        # and with fewer dimensions than samples they are all covered
+        ds = ds[:, :10]
+        ds.sa.targets = d_t[:, :10]
+        pm.train(ds)
+        pm_.train(ds)
+        assert_array_almost_equal(pm_.proj, pm.proj)
+        # no shortcuts if only rotations are allowed
+        pm = ProcrusteanMapper(reflection=False)
+        pm_ = ProcrusteanMapper(svd=svd, reflection=False)
+        pm.train(ds)
+        pm_.train(ds)
+        assert_array_almost_equal(pm_.proj, pm.proj)
+
+    @reseed_rng()
+    def test_svd_randomized_rank(self):
+        # more dimensions than samples
+        d_s = np.random.normal(size=(20, 50))
+        R = get_random_rotation(50)
+        d_t = np.dot(0.5 * d_s, R) + 1.0
+        ds = dataset_wizard(samples=d_s, targets=d_t)
+        pm = ProcrusteanMapper()
+        pm.train(ds)
+        # rank of the data is covered by svd_rank
+        pm_ = ProcrusteanMapper(svd='randomized', svd_rank=20)
+        state = np.random.get_state()
+        pm_.train(ds)
+        # global random state is not used
+        assert_array_equal(np.random.get_state()[1], state[1])
+        assert_almost_equal(pm_._scale, pm._scale)
+        assert_array_almost_equal(pm_.forward(d_s), pm.forward(d_s))
+        # and is reproducible
+        pm__ = ProcrusteanMapper(svd='randomized', svd_rank=20)
+        pm__.train(ds)
+        assert_array_equal(pm__.proj, pm_.proj)
+
 
 def suite():  # pragma: no cover
     return unittest.makeSuite(ProcrusteanMapperTests)
@@ -25,6 +25,7 @@ from mvpa2.mappers.base import ChainMapper
 from mvpa2.mappers.fx import mean_group_sample
 from mvpa2.clfs.transerror import ConfusionMatrix
 from mvpa2.measures.searchlight import sphere_searchlight, Searchlight
+from mvpa2.base.parallel import parallel_backends
 from mvpa2.measures.gnbsearchlight import sphere_gnbsearchlight, \
      GNBSearchlight
 from mvpa2.clfs.gnb import GNB
@@ -321,6 +322,28 @@ class SearchlightTests(unittest.TestCase):
         assert_array_equal(sl.ca.null_t.samples.shape,
                            (1, ds.nfeatures))
 
+    @reseed_rng()
+    def test_adhocsearchlight_call_batch(self):
+        ds = datasets['3dmedium'].copy()
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        permutator = AttributePermutator('targets', count=4, limit='chunks')
+        dss = list(permutator.generate(ds))
+        for sl_fx, clf in ((sphere_gnbsearchlight, GNB()),
+                           (sphere_m1nnsearchlight, kNN(1))):
+            sl = sl_fx(clf, NFoldPartitioner(), radius=1)
+            # query engine is trained once for all permutations
+            trainings = []
+            qe_train = sl.queryengine.train
+            sl.queryengine.train = lambda ds: trainings.append(ds) \
+                                              or qe_train(ds)
+            batch = sl.call_batch(dss)
+            assert_equal(len(trainings), 1)
+            assert_equal(len(batch), len(dss))
+            for d, res in zip(dss, batch):
+                assert_array_equal(res.samples, sl(d).samples)
+            # neighbors are not kept beyond the batch
+            assert_false(sl.reuse_neighbors)
+
     def test_gnbsearchlight_matchaccuracy(self):
         # was not able to deal with custom errorfx collapsing samples
         # after 55e147e0bd30fbf4edede3faef3a15c6c65b33ea
@@ -665,6 +688,75 @@ class SearchlightTests(unittest.TestCase):
         assert_array_equal(res1, res2)
 
 
+    @sweepargs(backend=('multiprocessing', 'threads', 'joblib', 'futures'))
+    def test_parallel_backends(self, backend):
+        if backend in parallel_backends \
+                and parallel_backends[backend].external is not None:
+            skip_if_no_external(parallel_backends[backend].external)
+        ds = datasets['3dsmall'].copy(deep=True)[:, :13]
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        cv = CrossValidation(GNB(), OddEvenPartitioner())
+        res_serial = sphere_searchlight(cv, radius=1, nproc=1)(ds)
+        sl = sphere_searchlight(cv, radius=1, nproc=2, backend=backend,
+                                enable_ca=['roi_sizes'])
+        res = sl(ds)
+        assert_array_equal(res_serial, res)
+        assert_array_equal(res.fa.center_ids, np.arange(ds.nfeatures))
+        assert_equal(len(sl.ca.roi_sizes), ds.nfeatures)
+        assert_true("backend=%r" % backend in repr(sl))
+        # the same with fixed number of blocks
+        res = sphere_searchlight(cv, radius=1, nproc=2, backend=backend,
+                                 nblocks=5)(ds)
+        assert_array_equal(res_serial, res)
+        # and passing everything through shared memory
+        tmp_prefix = tempfile.mktemp('mvpa', 'test-sl')
+        sl = sphere_searchlight(cv, radius=1, nproc=2, backend=backend,
+                                results_backend='shared', share_dataset=True,
+                                tmp_prefix=tmp_prefix,
+                                enable_ca=['roi_sizes', 'roi_feature_ids'])
+        res = sl(ds)
+        assert_array_equal(res_serial, res)
+        assert_array_equal(res.fa.center_ids, np.arange(ds.nfeatures))
+        assert_equal(len(sl.ca.roi_feature_ids), ds.nfeatures)
+        assert_equal(glob.glob(tmp_prefix + '*'), [])
+
+
+    def test_shared_results_backend(self):
+        ds = datasets['3dsmall'].copy(deep=True)[:, :13]
+        ds.fa['voxel_indices'] = ds.fa.myspace
+        # multiple values per ROI
+        measure = lambda x: Dataset([[x.samples.mean()], [x.samples.std()]],
+                                    sa={'stat': ['mean', 'std']})
+        res_native = sphere_searchlight(measure, radius=1, nproc=1)(ds)
+        res = sphere_searchlight(measure, radius=1, nproc=2,
+                                 backend='multiprocessing',
+                                 results_backend='shared')(ds)
+        assert_array_almost_equal(res_native, res)
+        assert_array_equal(res.sa.stat, res_native.sa.stat)
+        assert_array_equal(res.fa.center_ids, res_native.fa.center_ids)
+
+        # results of varying shapes or number are passed back natively
+        measure = lambda x: np.arange(x.nfeatures)
+
+        def results_fx(sl=None, dataset=None, roi_ids=None, results=None):
+            return Dataset([np.hstack([np.ravel(getattr(r, 'samples', r))
+                                       for rs in results for r in rs])])
+
+        for postproc in (None,
+                         lambda results: [r for r in results for _ in (0, 1)]):
+            res_native = sphere_searchlight(measure, radius=1, nproc=1,
+                                            results_fx=results_fx,
+                                            results_postproc_fx=postproc)(ds)
+            res = sphere_searchlight(measure, radius=1, nproc=2,
+                                     backend='multiprocessing',
+                                     results_backend='shared',
+                                     results_fx=results_fx,
+                                     results_postproc_fx=postproc)(ds)
+            assert_array_equal(res_native, res)
+        assert_raises(ValueError, sphere_searchlight, measure,
+                      results_backend='bogus')
+
+
     def test_custom_results_fx_logic(self):
         # results_fx was introduced for the blow-up-the-memory-Swaroop
         # where keeping all intermediate results of the dark-magic SL
@@ -8,6 +8,7 @@
 ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ### ##
 """Unit tests for Searchlight Hyperalignment ..."""
 
+import os
 import unittest
 import numpy as np
 
@@ -240,7 +241,9 @@ class SearchlightHyperalignmentTests(unittest.TestCase):
                        {'combine_neighbormappers': False},
                        {'combine_neighbormappers': False, 'mask_node_ids': np.arange(dss[0].nfeatures).tolist()},
                        {'combine_neighbormappers': True, 'sparse_radius': 1},
-                       {'combine_neighbormappers': True, 'nblocks': 2}]:
+                       {'combine_neighbormappers': True, 'nblocks': 2},
+                       {'combine_neighbormappers': True, 'nblocks': 2,
+                        'spill_triplets': True}]:
             slhyp = SearchlightHyperalignment(radius=2, **kwargs)
             mappers = slhyp(dss)
             # one mapper per input ds
@@ -257,6 +260,9 @@ class SearchlightHyperalignmentTests(unittest.TestCase):
                                       projs[1][midx].recon.T.todense(), decimal=5)
             assert_equal(projs[1][midx].proj.dtype, 'float64')
             assert_equal(projs[0][midx].proj.dtype, 'float32')
+            # storage of the triplets does not matter
+            assert_array_almost_equal(projs[6][midx].proj.todense(),
+                                      projs[7][midx].proj.todense())
         # making sure the projections make sense
         for proj in projs:
             # no .max on sparse matrices on older scipy (e.g. on precise) so conver to array first
@@ -296,6 +302,30 @@ class SearchlightHyperalignmentTests(unittest.TestCase):
             raise SkipTest("h5save of hyperalignment")
         h5save(tempfile, slhyp)
 
+    def test_sparse_triplets(self):
+        skip_if_no_external('scipy')
+        from mvpa2.algorithms.searchlight_hyperalignment import _SparseTriplets
+        rows = np.random.randint(0, 6, size=(50, 7))
+        cols = np.random.randint(0, 5, size=(50, 7))
+        values = np.random.normal(size=(50, 7))
+        rows[0, 0], cols[0, 0] = 5, 4
+        expected = np.zeros((6, 5))
+        for r, c, v in zip(rows.ravel(), cols.ravel(), values.ravel()):
+            expected[r, c] += v
+        for tmp_prefix in (None, 'tmptriplets'):
+            triplets = _SparseTriplets((4, 4), 'float64',
+                                       tmp_prefix=tmp_prefix, capacity=3)
+            for r, c, v in zip(rows, cols, values):
+                triplets.append(r, c, v)
+            assert_equal(len(triplets), rows.size)
+            files = triplets._files
+            assert_equal(len(files), 0 if tmp_prefix is None else 3)
+            proj = triplets.tocsc()
+            assert_equal(proj.shape, (6, 5))
+            assert_array_almost_equal(proj.toarray(), expected)
+            # temporary files are gone
+            assert_false(any(os.path.exists(f) for f in files))
+
     @reseed_rng()
     def test_searchlight_hyperalignment_warnings_and_exceptions(self):
         skip_if_no_external('scipy')
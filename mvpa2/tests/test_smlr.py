@@ -64,3 +64,38 @@ def test_smlr_sensitivities(clf):
     # again
     sens = clf.get_sensitivity_analyzer(force_train=False)(None)
     assert_equal(sens.shape, (len(data.UT) - 1, data.nfeatures))
+
+
+@sweepargs(implementation=('C', 'Python'))
+def test_smlr_warm_start(implementation):
+    data = normal_feature_dataset(perlabel=10, nlabels=3, nfeatures=6,
+                                  nonbogus_features=[0, 1, 2], snr=3)
+    data.init_origids('features')
+    clf = SMLR(implementation=implementation, warm_start=True, seed=1,
+               convergence_tol=1e-5)
+    if clf.params.implementation != implementation:
+        raise SkipTest("%s implementation is not available" % implementation)
+    clf.train(data)
+    w = clf.weights.copy()
+    # starting from the solution should converge to the same one
+    clf.train(data)
+    assert_array_almost_equal(clf.weights, w, decimal=3)
+    # weights of selected features are matched by their origids
+    sub = data[:, [4, 0, 1]]
+    clf.train(sub)
+    assert_equal(clf.weights.shape, (3, 3))
+    cold = SMLR(implementation=implementation, seed=1, convergence_tol=1e-5)
+    cold.train(sub)
+    assert_array_equal(clf.predict(sub), cold.predict(sub))
+
+    # path is fitted in descending order of lm
+    lms = [0.1, 10., 1.]
+    path = clf.regularization_path(data, lms)
+    assert_equal([p[0] for p in path], [10., 1., 0.1])
+    assert_equal(clf.params.lm, 0.1)
+    assert_true(clf.params.warm_start)
+    # stronger penalty yields sparser solutions
+    nonzero = [np.sum(p[1] != 0) for p in path]
+    assert_true(nonzero[0] <= nonzero[-1])
+    assert_array_equal(path[-1][1], clf.weights)
+    assert_equal(path[-1][2].shape, (3,))
@@ -118,6 +118,88 @@ class StatsTests(unittest.TestCase):
                         msg='In compound anova, we should get different'
                         ' results for different labels. Got %s' % ac)
 
+    def test_anova_chunked(self):
+        ds = datasets['uni4medium']
+        for m in (OneWayAnova, CompoundOneWayAnova):
+            ref = m()(ds)
+            for kwargs in (dict(chunk_size=3),
+                           dict(chunk_size=1000),
+                           dict(accumulation_dtype='float32', chunk_size=2)):
+                res = m(**kwargs)(ds)
+                assert_equal(res.shape, ref.shape)
+                assert_array_almost_equal(
+                    res.samples, ref.samples,
+                    decimal=3 if 'accumulation_dtype' in kwargs else 6)
+                if 'accumulation_dtype' in kwargs:
+                    assert_equal(res.samples.dtype, np.float32)
+
+        # compound comparisons match a two-group ANOVA per label
+        ac = CompoundOneWayAnova()(ds)
+        for i, l in enumerate(ds.sa.targets.unique):
+            ds_ = Dataset(ds.samples, sa={'targets': ds.targets == l})
+            assert_array_almost_equal(ac.samples[i],
+                                      OneWayAnova()(ds_).samples[0])
+        assert_array_equal(ac.sa.targets, ds.sa.targets.unique)
+
+    def test_anova_batch(self):
+        ds = datasets['uni4medium']
+        perm = AttributePermutator('targets', count=7,
+                                   rng=np.random.RandomState(3))
+        dss = list(perm.generate(ds))
+        # permutations do differ
+        assert_true(len(set(tuple(d.targets) for d in dss)) > 1)
+        # like a call, it fails if not trained and auto training is disabled
+        assert_raises(RuntimeError,
+                      OneWayAnova(auto_train=False).call_batch, dss)
+        m = OneWayAnova()
+        batch = m.call_batch(dss)
+        assert_true(m.is_trained)
+        assert_equal(len(batch), len(dss))
+        assert_true(np.any(batch[0].samples != batch[-1].samples))
+        for d, res in zip(dss, batch):
+            single = m(d)
+            assert_array_almost_equal(res.samples, single.samples)
+            if externals.exists('scipy'):
+                assert_array_almost_equal(res.fa.fprob, single.fa.fprob)
+        # datasets with different samples are not batched but still computed
+        dss[1] = dss[1].copy()
+        dss[1].samples = dss[1].samples + 1
+        assert_array_almost_equal(m.call_batch(dss)[1].samples,
+                                  m(dss[1]).samples)
+
+    def test_featurewise_nonparametric(self):
+        from mvpa2.clfs.stats import Nonparametric, FeaturewiseNonparametric
+        samples = np.random.randint(0, 5, size=(20, 6)).astype(float)
+        samples[3, 2] = np.nan
+        x = np.array([-1, 0, 2, 2.5, 4, np.nan])
+        for correction in ('clip', None):
+            fnp = FeaturewiseNonparametric(samples, correction=correction)
+            assert_equal(len(fnp), 6)
+            dists = [Nonparametric(s, correction=correction)
+                     for s in samples.T]
+            assert_array_almost_equal(
+                fnp.cdf(x), [d.cdf(v) for d, v in zip(dists, x)])
+            assert_array_almost_equal(
+                fnp.rcdf(x), [d.rcdf(v) for d, v in zip(dists, x)])
+            assert_array_almost_equal(fnp[2].cdf(1), dists[2].cdf(1))
+
+    def test_mcnulldist_batch(self):
+        ds = datasets['uni2small']
+        p = [20, 0, 0, 0, 0, np.nan]
+        probs = []
+        for batch_size in (None, 4):
+            perm = AttributePermutator('targets', count=10,
+                                       rng=np.random.RandomState(1))
+            null = MCNullDist(perm, tail='right', batch_size=batch_size)
+            null.ca.enable('dist_samples')
+            null.fit(OneWayAnova(), ds)
+            assert_equal(null.ca.dist_samples.shape, (1, ds.nfeatures, 10))
+            samples = null.ca.dist_samples.samples
+            assert_true(np.any(samples[..., 0] != samples[..., -1]))
+            assert_equal(len(null.dists()), ds.nfeatures)
+            probs.append(null.p(p))
+        assert_array_almost_equal(probs[0], probs[1])
+
     def test_pearson_correlation(self):
         sh = (3, -1)
         x = np.reshape(np.asarray([5, 3, 6, 5, 5, 4]), sh)
@@ -136,6 +218,37 @@ class StatsTests(unittest.TestCase):
 
         assert_array_almost_equal(c, c_np)
 
+@sweepargs(backend=['serial', 'threads', 'multiprocessing'])
+@with_tempfile(suffix='.npy')
+def test_mcnulldist_parallel(filename, backend=None):
+    ds = datasets['uni2small']
+    def get_dist_samples(**kwargs):
+        # a RandomState instance, so permutations continue its sequence
+        perm = AttributePermutator('targets', count=11,
+                                   rng=np.random.RandomState(5))
+        null = MCNullDist(perm, tail='right', **kwargs)
+        null.ca.enable('dist_samples')
+        null.fit(OneWayAnova(), ds)
+        assert_equal(null.ca.skipped, 0)
+        return null.ca.dist_samples.samples
+
+    serial = get_dist_samples()
+    assert_equal(serial.shape, (1, ds.nfeatures, 11))
+    # permutations differ
+    assert_true(np.any(serial[..., 0] != serial[..., -1]))
+    parallel = get_dist_samples(nproc=2, backend=backend)
+    assert_equal(parallel.shape, serial.shape)
+    # independent RNG streams per block, reproducible for the same seed
+    assert_array_equal(parallel,
+                       get_dist_samples(nproc=2, backend=backend))
+    assert_true(np.any(parallel[..., 0] != parallel[..., -1]))
+    # samples streamed into a memory-mapped file
+    mapped = get_dist_samples(nproc=2, backend=backend,
+                              dist_samples_file=filename)
+    assert_array_equal(mapped, parallel)
+    assert_array_equal(np.rollaxis(np.load(filename), 0, 3), parallel)
+
+
 def test_tsboxplot():
     skip_if_no_external('scipy')
     skip_if_no_external('numpy', min_version='1.5') # for .percentile. approx version
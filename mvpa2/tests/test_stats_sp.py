@@ -93,6 +93,22 @@ class StatsTestsScipy(unittest.TestCase):
         self.failUnlessAlmostEqual(p100[0], p_100)
 
 
+    def test_corrcoef_vectorized(self):
+        skip_if_no_external('scipy')
+        from mvpa2.measures.corrcoef import CorrCoef
+        ds = datasets['uni2medium'].copy()
+        ds.sa.targets = AttributeMap().to_numeric(ds.targets)
+        # constant feature
+        ds.samples[:, 1] = 3
+        for pvalue in (False, True):
+            ref = CorrCoef(pvalue=pvalue, corr_backend='scipy')(ds)
+            for chunk_size in (None, 1, 7):
+                res = CorrCoef(pvalue=pvalue, chunk_size=chunk_size)(ds)
+                assert_array_almost_equal(res.samples, ref.samples)
+        assert_equal(CorrCoef()(ds).samples[0, 1], 0)
+        assert_equal(CorrCoef(pvalue=True)(ds).samples[0, 1], 1)
+        assert_raises(ValueError, CorrCoef, corr_backend='unknown')
+
     @sweepargs(nd=nulldist_sweep)
     def test_dataset_measure_prob(self, nd):
         """Test estimation of measures statistics"""
@@ -35,6 +35,7 @@ from mvpa2.support.nibabel import surf, surf_fs_asc, surf_gifti
 
 from mvpa2.measures.searchlight import sphere_searchlight, Searchlight
 from mvpa2.misc.neighborhood import Sphere
+from mvpa2.base import parallel
 
 if externals.exists('h5py'):
     from mvpa2.base.hdf5 import h5save, h5load
@@ -173,6 +174,82 @@ class SurfTests(unittest.TestCase):
         assert_equal(s4.nvertices, 26)
         assert_equal(s4.nfaces, 48)
 
+    @reseed_rng()
+    def test_surf_dijkstra_distances(self):
+        s = surf.generate_sphere(10)
+        # add a node without faces
+        s = surf.Surface(np.vstack((s.vertices, [3, 3, 3])), s.faces)
+
+        nbrs = s.neighbors
+        m = s.neighbor_matrix
+        assert_equal(m.shape, (s.nvertices, s.nvertices))
+        assert_equal(m.nnz, sum(len(n2d) for n2d in nbrs.itervalues()))
+        for i, n2d in nbrs.iteritems():
+            for j, d in n2d.iteritems():
+                assert_almost_equal(m[i, j], d)
+
+        srcs = np.random.permutation(s.nvertices - 1)[:10]
+        for maxdistance in (None, .5, 1.):
+            n2ds = s.dijkstra_distances(srcs, maxdistance=maxdistance)
+            assert_equal(len(n2ds), len(srcs))
+            for src, n2d in zip(srcs, n2ds):
+                slow = s.dijkstra_distance_slow(src, maxdistance)
+                assert_equal(set(n2d), set(slow))
+                for k, v in slow.iteritems():
+                    assert_almost_equal(n2d[k], v)
+                assert_equal(s.dijkstra_distance(src, maxdistance), n2d)
+
+            if maxdistance is not None:
+                assert_equal(s.circlearound_n2ds(srcs, maxdistance,
+                                                 'dijkstra'), n2ds)
+                assert_equal(s.circlearound_n2ds(srcs, maxdistance,
+                                                 'euclidean'),
+                             [s.circlearound_n2d(src, maxdistance,
+                                                 'euclidean')
+                              for src in srcs])
+
+        assert_equal(s.dijkstra_distance(s.nvertices - 1), {s.nvertices - 1: 0})
+
+    @reseed_rng()
+    def test_surf_kdtree_queries(self):
+        skip_if_no_external('scipy')
+        s = surf.generate_sphere(10)
+        v = s.vertices
+
+        tree, idxs = s._kdtree
+        assert_array_equal(idxs, np.arange(s.nvertices))
+        assert_true(s._kdtree[0] is tree)
+
+        # nearest nodes, compared with an exhaustive search
+        coords = np.random.normal(size=(20, 3))
+        ds = np.sum((coords[:, np.newaxis, :] - v[np.newaxis]) ** 2, 2)
+        assert_array_equal(s.nearest_node_index(coords), np.argmin(ds, 1))
+
+        mask = np.arange(0, s.nvertices, 3)
+        assert_array_equal(s.nearest_node_index(coords, mask),
+                           mask[np.argmin(ds[:, mask], 1)])
+
+        # near pairs between two hemispheres
+        s2 = surf.merge(s, s + (0, 0, .5))
+        nv = s.nvertices
+        src, trg = np.arange(nv), np.arange(nv, 2 * nv)
+        max_distance = 1.
+        pw = s2.pairwise_near_nodes(max_distance, src, trg)
+        expected = dict()
+        for i in src:
+            d = s2.euclidean_distance(i, trg)
+            for j in np.nonzero(d <= max_distance)[0]:
+                expected[(i, trg[j])] = d[j]
+        assert_equal(set(pw), set(expected))
+        for k, d in expected.iteritems():
+            assert_almost_equal(pw[k], d)
+
+        # mapping to a high resolution surface
+        h = surf.generate_sphere(40)
+        assert_equal(s.map_to_high_resolution_surf(h, .1),
+                     s.map_to_high_resolution_surf_slow(h, .1))
+        assert_raises(ValueError, s.map_to_high_resolution_surf, h, .01)
+
     def test_surf_border(self):
         s = surf.generate_sphere(3)
         assert_array_equal(s.nodes_on_border(), [False] * 11)
@@ -502,6 +579,51 @@ class SurfTests(unittest.TestCase):
         # check that string building works
         assert_true(len('%s%r' % (vs, vs)) > 0)
 
+    def test_volsurf_mapping_csr(self):
+        vg = volgeom.VolGeom((30, 30, 30), np.identity(4))
+        outer = surf.generate_sphere(20) * 14. + 15
+        inner = surf.generate_sphere(20) * 10. + 15
+
+        nsteps = 7
+        vs = volsurf.VolSurfMaximalMapping(vg, outer, inner, nsteps=nsteps)
+        n2vs, v2ns = vs._get_node_voxels_maximal_mapping()
+
+        # reference: go through nodes and steps one by one
+        n2vs_ref = dict((n, None) for n in xrange(outer.nvertices))
+        v2ns_ref = dict()
+        step = 1. / float(nsteps - 1)
+        for i in xrange(nsteps):
+            # white is the outer surface here
+            w = 0. + step * float(i)
+            xyz = (inner * (1 - w) + outer * w).vertices
+            lin = vg.xyz2lin(xyz)
+            pos = vs.surf_project_weights_nodewise(vg.lin2xyz(lin))
+            for n in np.nonzero(vg.contains_lin(lin))[0]:
+                if n2vs_ref[n] is None:
+                    n2vs_ref[n] = dict()
+                n2vs_ref[n][lin[n]] = pos[n]
+                v2ns_ref.setdefault(lin[n], set()).add(n)
+
+        assert_equal(n2vs, n2vs_ref)
+        assert_equal(v2ns, v2ns_ref)
+
+        # in the minimal mapping each voxel is kept for the node nearest
+        # to the intermediate surface
+        vs_min = volsurf.VolSurfMinimalMapping(vg, outer, inner,
+                                               nsteps=nsteps)
+        n2vs_min = vs_min.get_node2voxels_mapping()
+        assert_equal(set(n2vs_min), set(n2vs))
+        v2n_min = dict()
+        for n, v2pos in n2vs_min.iteritems():
+            assert_equal(v2pos is None, n2vs[n] is None)
+            for v, p in (v2pos or {}).iteritems():
+                assert_false(v in v2n_min)
+                v2n_min[v] = n
+                assert_equal(p, n2vs[n][v])
+                assert_equal(abs(p - .5),
+                             min(abs(n2vs[m][v] - .5) for m in v2ns[v]))
+        assert_equal(set(v2n_min), set(v2ns))
+
     def test_volsurf_surf_from_volume(self):
         aff = np.eye(4)
         aff[0, 0] = aff[1, 1] = aff[2, 2] = 3
@@ -677,6 +799,21 @@ class SurfTests(unittest.TestCase):
 
                 assert_true(all([lab in labs for lab in expected_labs]))
 
+            # distances computed for blocks of center nodes at once are
+            # the same as those computed for each center node
+            selector = surf_voxel_selection.VoxelSelector(radius,
+                                    vs.pial_surface * .5 + vs.white_surface * .5,
+                                    vs.get_node2voxels_mapping(),
+                                    distance_metric,
+                                    outside_node_margin=2.)
+            selector.precompute_distances(srcs)
+            for src in srcs:
+                attrs = selector.copy().disc_voxel_attributes(src)
+                attrs_pre = selector.disc_voxel_attributes(src)
+                assert_equal(sorted(attrs), sorted(attrs_pre))
+                for k in attrs:
+                    assert_array_equal(attrs[k], attrs_pre[k])
+
                 if externals.exists('h5py'):
                     # some I/O testing
                     fd, fn = tempfile.mkstemp('.h5py', 'test'); os.close(fd)
@@ -860,6 +997,25 @@ class SurfTests(unittest.TestCase):
             else:
                 assert_equal(sel0, sel)
 
+    @sweepargs(backend=('multiprocessing', 'threads'))
+    def test_voxel_selection_parallel(self, backend):
+        vg = volgeom.VolGeom((20, 20, 20), np.identity(4))
+
+        outer = surf.generate_sphere(20) * 10. + 5
+        inner = surf.generate_sphere(20) * 5. + 5
+
+        for radius in (50, 4.):
+            sel = surf_voxel_selection.run_voxel_selection(radius, vg, inner,
+                            outer, nproc=1)
+            for nblocks in (None, 3):
+                sel_par = surf_voxel_selection.run_voxel_selection(radius, vg,
+                            inner, outer, nproc=2, backend=backend,
+                            nblocks=nblocks)
+                assert_equal(sel, sel_par)
+                # the result does not refer to any shared memory
+                assert_false(isinstance(sel_par.source.vertices,
+                                        parallel.SharedArray))
+
     def test_agreement_surface_volume(self):
         '''test agreement between volume-based and surface-based
         searchlights when using euclidean measure'''
@@ -987,6 +1143,13 @@ class SurfTests(unittest.TestCase):
 
                 assert_equal(set(feature_ids), set(fa_indices))
 
+            # all nodes at once
+            indptr, indices = qe.query_batch()
+            for i, node in enumerate(qe.ids):
+                assert_equal(set(indices[indptr[i]:indptr[i + 1]]),
+                             set(qe.query_byid(node)))
+            assert_raises(KeyError, qe.query_batch, [0, s2.nvertices])
+
             # smoke tests
             assert_true('SurfaceQueryEngine' in '%s' % qe)
             assert_true('SurfaceQueryEngine' in '%r' % qe)
@@ -1049,6 +1212,11 @@ class SurfTests(unittest.TestCase):
                     fa_indices += np.where(ds3.fa.node_indices == node)[0].tolist()
                 assert_equal(set(feature_ids), set(fa_indices))
 
+            indptr, indices = qe.query_batch()
+            for i, node in enumerate(qe.ids):
+                assert_equal(set(indices[indptr[i]:indptr[i + 1]]),
+                             set(qe.query_byid(node)))
+
     def test_surf_pairs(self):
         o, x, y = map(np.asarray, [(0, 0, 0), (0, 1, 0), (1, 0, 0)])
         d = np.asarray((0, 0, .1))
@@ -19,6 +19,7 @@ from numpy.testing.utils import assert_array_almost_equal, \
 import nibabel as nb
 
 import os
+import copy
 from os.path import join as pathjoin
 import tempfile
 
@@ -849,6 +850,71 @@ class SurfVoxelSelectionTests(unittest.TestCase):
         d._src2aux['foo'][1] = np.asarray('bar')
         assert_raises(TypeError, _dict_with_arrays2array_tuple, d._src2aux)
 
+    @reseed_rng()
+    @with_tempfile()
+    def test_volume_mask_dictionary_compact(self, dirname):
+        vg = VolGeom((4, 4, 4), np.identity(4))
+        src2nbr = dict()
+        parts = [VolumeMaskDictionary(vg, None) for _ in xrange(2)]
+        for src in xrange(20):
+            nbrs = np.random.permutation(vg.nvoxels)[:np.random.randint(1, 9)]
+            src2nbr[src] = nbrs.tolist()
+            parts[src % 2].add(src, nbrs, dict(dist=nbrs * .5, center=[src]))
+
+        d = VolumeMaskDictionary(vg, None)
+        for part in parts:
+            d.merge(part)
+        assert_raises(ValueError, d.merge, parts[0])
+
+        def check(d):
+            assert_equal(set(d.keys()), set(src2nbr))
+            for src, nbrs in src2nbr.iteritems():
+                assert_equal(d[src], nbrs)
+                assert_array_almost_equal(d.get_aux(src, 'dist'),
+                                          np.asarray(nbrs) * .5)
+                assert_equal(d.get_aux(src, 'center'), [src])
+
+            for target in xrange(vg.nvoxels):
+                srcs = set(src for src, nbrs in src2nbr.iteritems()
+                           if target in nbrs)
+                assert_equal(d.target2sources(target), srcs or None)
+            all_targets = sorted(set(sum(src2nbr.values(), [])))
+            assert_equal(d.get_targets(), all_targets)
+
+            mask = np.zeros(vg.nvoxels, dtype=np.int8)
+            mask[src2nbr[3] + src2nbr[4]] = 1
+            assert_array_equal(d.get_mask([3, 4]).ravel(), mask)
+            assert_equal(np.sum(d.get_mask()), len(all_targets))
+
+        check(d)
+
+        # round trip through the compact state
+        d_copy = copy.deepcopy(d)
+        check(d_copy)
+        assert_equal(d, d_copy)
+
+        # memory-mapped storage
+        d.to_npy(dirname)
+        d_npy = VolumeMaskDictionary.from_npy(dirname)
+        assert_true(isinstance(d_npy._src2nbr._data, np.memmap))
+        check(d_npy)
+        assert_equal(d, d_npy)
+        assert_equal(d, volume_mask_dict.from_any(dirname))
+
+        # masks can still be added
+        src2nbr[20] = [1, 2]
+        d_npy.add(20, [1, 2], dict(dist=[.5, 1.], center=[20]))
+        check(d_npy)
+
+        # storing masks without auxiliary information leaves no arrays
+        # of the previous ones behind
+        d_empty = VolumeMaskDictionary(vg, None)
+        d_empty.add(0, [1, 2], dict())
+        d_empty.to_npy(dirname)
+        assert_equal([fn for fn in os.listdir(dirname)
+                      if fn.startswith('aux')], [])
+        assert_equal(VolumeMaskDictionary.from_npy(dirname), d_empty)
+
 
 
 def _cartprod(d):
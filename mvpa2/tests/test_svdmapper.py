@@ -13,7 +13,7 @@ import unittest
 import numpy as np
 
 from mvpa2.mappers.svd import SVDMapper
-from mvpa2.testing import reseed_rng
+from mvpa2.testing import reseed_rng, assert_array_almost_equal
 from mvpa2.support.copy import deepcopy
 
 
@@ -99,6 +99,31 @@ class SVDMapperTests(unittest.TestCase):
         self.assertEqual(data_r.shape, (98,40))
 
 
+    @reseed_rng()
+    def test_svd_implementations(self):
+        # low-rank data with more features than samples
+        data = np.dot(np.random.normal(size=(15, 4)),
+                      np.random.normal(size=(4, 60)))
+        pm = SVDMapper()
+        pm.train(data)
+        for kwargs in (dict(svd='gram'),
+                       dict(svd='randomized'),
+                       dict(svd='randomized', rank=4, oversampling=2)):
+            pm_ = SVDMapper(**kwargs)
+            pm_.train(data)
+            # same non-zero singular values
+            assert_array_almost_equal(pm_.sv[:4], pm.sv[:4])
+            self.assertTrue((pm_.sv[4:] < 1e-8).all())
+            # same components up to their sign
+            assert_array_almost_equal(np.abs(pm_.proj[:, :4]),
+                                      np.abs(pm.proj[:, :4]))
+            # data can be fully recovered
+            p = pm_.forward(data)
+            assert_array_almost_equal(pm_.reverse(p), data)
+        pm_ = SVDMapper(svd='randomized', rank=3)
+        pm_.train(data)
+        self.assertEqual(pm_.proj.shape, (60, 3))
+
 
 def suite():  # pragma: no cover
     return unittest.makeSuite(SVDMapperTests)
@@ -214,6 +214,31 @@ class SVMTests(unittest.TestCase):
                         msg="Memory consumption was %d, became %d"
                             % (mem0[1], mem1[1]))
 
+    def test_libsvm_batch_prediction(self):
+        skip_if_no_external('libsvm')
+        from mvpa2.clfs.libsvmc import _svm
+        from mvpa2.clfs.libsvmc.svm import SVM as LibSVM
+        ds = datasets['uni3small']
+        for svm_impl in ('C_SVC', 'NU_SVR'):
+            clf = LibSVM(svm_impl=svm_impl)
+            clf.train(ds)
+            model = clf.model
+            labels, values = model.predict_batch(ds.samples)
+            assert_equal(labels.shape, (len(ds),))
+            for i, x in enumerate(ds.samples):
+                assert_almost_equal(labels[i], model.predict(x))
+                assert_array_almost_equal(values[i],
+                                          model.predict_values_raw(x))
+
+        # dense and per-sample problem construction lead to the same model
+        y = np.unique(ds.targets, return_inverse=True)[1].tolist()
+        param = _svm.SVMParameter()
+        labels = [_svm.SVMModel(_svm.SVMProblem(y, x), param)
+                              .predict_batch(ds.samples)[0]
+                  for x in (ds.samples, [list(x) for x in ds.samples])]
+        assert_array_equal(labels[0], labels[1])
+
+
 def suite():  # pragma: no cover
     return unittest.makeSuite(SVMTests)
 